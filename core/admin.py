@@ -1,8 +1,38 @@
-from django.contrib import admin
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractHour, TruncDate
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from django.utils import timezone
-from .models import Usuario, Servicio, Reserva, Horario,EstadoHorario,EstadoReserva,EstadoServicio,TipoUsuario
+from . import busqueda, catalogos, estadisticas, exportacion, horarios, reservas, resumenes
+from .forms import RepetirHorariosForm
+from .signals import reservas_modificadas_en_bloque
+from .models import Usuario, Servicio, Reserva, Horario,EstadoHorario,EstadoReserva,EstadoServicio,TipoUsuario,Tarea,ResumenDiario
+
+# Reservas sin lugar que se nombran en el mensaje de planificar_pendientes
+MAX_SIN_LUGAR_LISTADAS = 10
+
+
+class CatalogoAdminMixin:
+    """Toma las opciones de los FK a tablas de catálogo desde la cache en memoria"""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        campo = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if campo is not None and db_field.related_model in catalogos.modelos():
+            opciones = catalogos.opciones(db_field.related_model)
+            if campo.empty_label is not None:
+                opciones = [('', campo.empty_label)] + opciones
+            # Opciones fijas: cada fila del listado editable ya no consulta la tabla
+            campo.choices = opciones
+        return campo
+
 @admin.register(TipoUsuario)
 class TipoUsuarioAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'descripcion', 'fecha_registro')
@@ -24,11 +54,11 @@ class EstadoHorarioAdmin(admin.ModelAdmin):
     search_fields = ('nombre', 'descripcion')
     
 @admin.register(Usuario)
-class UsuarioAdmin(UserAdmin):
-    list_display = ('username', 'email', 'full_name', 'tipo_usuario', 'fecha_registro', 'is_active')
+class UsuarioAdmin(CatalogoAdminMixin, UserAdmin):
+    list_display = ('username', 'email', 'full_name', 'tipo', 'fecha_registro', 'is_active')
     list_filter = ('tipo_usuario', 'is_staff', 'is_active', 'fecha_registro')
     fieldsets = UserAdmin.fieldsets + (
-        ('Información adicional', {'fields': ('tipo_usuario_id',)}),
+        ('Información adicional', {'fields': ('tipo_usuario',)}),
     )
     search_fields = ('username', 'first_name', 'last_name', 'email')
     ordering = ('-fecha_registro',)
@@ -37,14 +67,35 @@ class UsuarioAdmin(UserAdmin):
         return f"{obj.first_name} {obj.last_name}"
     full_name.short_description = 'Nombre completo'
 
+    def tipo(self, obj):
+        return catalogos.nombre(TipoUsuario, obj.tipo_usuario_id)
+    tipo.short_description = 'Tipo de usuario'
+    tipo.admin_order_field = 'tipo_usuario'
+
 @admin.register(Servicio)
-class ServicioAdmin(admin.ModelAdmin):
+class ServicioAdmin(CatalogoAdminMixin, admin.ModelAdmin):
     list_display = ('nombre', 'duracion', 'mostrar_precio', 'estado_servicio', 'total_reservas', 'acciones')
     list_filter = ('estado_servicio', 'duracion')
     search_fields = ('nombre', 'descripcion')
     list_editable = ('estado_servicio',)
     ordering = ('nombre',)
 
+    def get_queryset(self, request):
+        # Los conteos salen en la misma consulta del listado, no uno por fila
+        return super().get_queryset(request).annotate(
+            num_reservas=Count('reservas'),
+            num_reservas_activas=Count('reservas', filter=Q(
+                reservas__estado_reserva_id__in=(1, 2),
+                reservas__fecha_hora__gte=timezone.now()
+            ))
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Índice FTS5 en vez de un LIKE por campo sobre toda la tabla
+        if busqueda.palabras(search_term):
+            return queryset.filter(busqueda.filtro(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
     def mostrar_precio(self, obj):
         return format_html(
             '<span style="color: green; font-weight: bold;">${}</span>',
@@ -53,16 +104,12 @@ class ServicioAdmin(admin.ModelAdmin):
     mostrar_precio.short_description = 'Precio'
 
     def total_reservas(self, obj):
-        count = obj.reservas.count()
-        activas = obj.reservas.filter(
-            estado__in=['pendiente', 'confirmada'],
-            fecha_hora__gte=timezone.now()
-        ).count()
         return format_html(
             '<span title="Total: {}">{} ({} activas)</span>',
-            count, count, activas
+            obj.num_reservas, obj.num_reservas, obj.num_reservas_activas
         )
     total_reservas.short_description = 'Reservas'
+    total_reservas.admin_order_field = 'num_reservas'
 
     def acciones(self, obj):
         return format_html(
@@ -73,23 +120,46 @@ class ServicioAdmin(admin.ModelAdmin):
         )
     acciones.short_description = 'Acciones'
 
+
+def _cambiar_estado_pendientes(queryset, estado_nuevo):
+    """Pasa a ``estado_nuevo`` las reservas pendientes de ``queryset`` y devuelve cuántas cambió"""
+    with transaction.atomic():
+        leidas = list(queryset.filter(estado_reserva_id=1).order_by().values('id', *estadisticas.CAMPOS_DATOS))
+        ids = [reserva['id'] for reserva in leidas]
+        marca = timezone.now()
+        actualizadas = Reserva.objects.filter(id__in=ids, estado_reserva_id=1).update(
+            estado_reserva_id=estado_nuevo, actualizada=marca
+        )
+        afectadas = leidas
+        if actualizadas != len(leidas):
+            # Otro proceso cambió algunas después del SELECT: la marca identifica las que cambió este UPDATE
+            propias = set(Reserva.objects.filter(
+                id__in=ids, estado_reserva_id=estado_nuevo, actualizada=marca
+            ).values_list('id', flat=True))
+            afectadas = [reserva for reserva in leidas if reserva['id'] in propias]
+        # update() no dispara señales: liberar turnos y actualizar estadísticas y resúmenes a mano
+        reservas_modificadas_en_bloque(afectadas, estado_nuevo)
+    return len(afectadas)
+
+
 @admin.register(Reserva)
-class ReservaAdmin(admin.ModelAdmin):
+class ReservaAdmin(CatalogoAdminMixin, admin.ModelAdmin):
     list_display = ('usuario', 'servicio', 'fecha_hora', 'estado_coloreado', 'tiempo_espera', 'creada')
     list_filter = ('estado_reserva', 'fecha_hora', 'servicio')
     search_fields = ('usuario__username', 'usuario__email', 'servicio__nombre')
     date_hierarchy = 'fecha_hora'
     readonly_fields = ('creada',)
-    ordering = ('-fecha_hora',)
-    actions = ['confirmar_reservas', 'cancelar_reservas']
+    ordering = ('-fecha_hora', '-id')
+    list_select_related = ('usuario', 'servicio')
+    actions = ['confirmar_reservas', 'planificar_pendientes', 'cancelar_reservas', 'exportar_csv', 'exportar_ndjson']
 
     def estado_coloreado(self, obj):
         estados = {
             'pendiente': ('#FFA500', 'En espera de confirmación'),
-            'confirmada': ('#28A745', 'Confirmada'),
-            'cancelada': ('#DC3545', 'Cancelada')
+            'confirmado': ('#28A745', 'Confirmada'),
+            'cancelado': ('#DC3545', 'Cancelada')
         }
-        color, texto = estados.get(obj.estado, ('#6C757D'))
+        color, texto = estados.get(obj.nombre_estado, ('#6C757D', obj.get_estado_display()))
         return format_html(
             '<span style="color: white; background-color: {}; padding: 5px 10px; '
             'border-radius: 15px; font-weight: 500;">{}</span>',
@@ -98,7 +168,7 @@ class ReservaAdmin(admin.ModelAdmin):
     estado_coloreado.short_description = 'Estado'
 
     def tiempo_espera(self, obj):
-        if obj.estado == 'pendiente':
+        if obj.nombre_estado == 'pendiente':
             tiempo = timezone.now() - obj.creada
             horas = tiempo.total_seconds() / 3600
             if horas < 1:
@@ -117,7 +187,7 @@ class ReservaAdmin(admin.ModelAdmin):
     tiempo_espera.short_description = 'Tiempo en espera'
 
     def confirmar_reservas(self, request, queryset):
-        updated = queryset.filter(estado='pendiente').update(estado='confirmada')
+        updated = _cambiar_estado_pendientes(queryset, 2)
         self.message_user(
             request,
             'Se {} confirmado {} reserva{}'.format(
@@ -128,8 +198,26 @@ class ReservaAdmin(admin.ModelAdmin):
         )
     confirmar_reservas.short_description = "Confirmar reservas seleccionadas"
 
+    def planificar_pendientes(self, request, queryset):
+        """Confirma las pendientes seleccionadas sin conflictos, moviendo las que chocan a lo sumo PLANIFICAR_MAX_MINUTOS"""
+        asignadas, sin_lugar = reservas.planificar_pendientes(
+            queryset, max_corrimiento=timedelta(minutes=settings.PLANIFICAR_MAX_MINUTOS)
+        )
+        movidas = sum(pedida != asignada for _, pedida, asignada in asignadas)
+        self.message_user(request, f'{len(asignadas)} reservas confirmadas ({movidas} en otro turno)')
+        if sin_lugar:
+            self.message_user(
+                request,
+                f'{len(sin_lugar)} reservas siguen pendientes por falta de lugar: ' + ', '.join(
+                    f'{reserva.servicio.nombre} {timezone.localtime(reserva.fecha_hora):%d/%m %H:%M}'
+                    for reserva in sin_lugar[:MAX_SIN_LUGAR_LISTADAS]
+                ) + ('…' if len(sin_lugar) > MAX_SIN_LUGAR_LISTADAS else ''),
+                level=messages.WARNING
+            )
+    planificar_pendientes.short_description = "Planificar y confirmar pendientes seleccionadas"
+
     def cancelar_reservas(self, request, queryset):
-        updated = queryset.filter(estado='pendiente').update(estado='cancelada')
+        updated = _cambiar_estado_pendientes(queryset, 3)
         self.message_user(
             request,
             'Se {} cancelado {} reserva{}'.format(
@@ -140,13 +228,48 @@ class ReservaAdmin(admin.ModelAdmin):
         )
     cancelar_reservas.short_description = "Cancelar reservas seleccionadas"
 
+    def exportar_csv(self, request, queryset):
+        return exportacion.respuesta(queryset, 'csv')
+    exportar_csv.short_description = "Exportar seleccionadas a CSV"
+
+    def exportar_ndjson(self, request, queryset):
+        return exportacion.respuesta(queryset, 'ndjson')
+    exportar_ndjson.short_description = "Exportar seleccionadas a NDJSON"
+
+class HorarioChangeList(ChangeList):
+    """Cuenta las reservas de todos los horarios de la página con una consulta agrupada"""
+
+    def get_results(self, request):
+        super().get_results(request)
+        # Se evalúa el queryset de la página: el formset de list_editable reutiliza estas instancias
+        horarios = list(self.result_list)
+        conteos = {}
+        if horarios:
+            # __date y __hour usan la zona horaria actual, igual que el filtro original.
+            # El rango sobre fecha_hora es lo que permite usar el índice.
+            fechas = {horario.fecha for horario in horarios}
+            por_hora = Reserva.objects.filter(
+                fecha_hora__gte=timezone.make_aware(datetime.combine(min(fechas), time.min)),
+                fecha_hora__lt=timezone.make_aware(datetime.combine(max(fechas) + timedelta(days=1), time.min)),
+                fecha_hora__date__in=fechas
+            ).order_by().values_list(
+                TruncDate('fecha_hora'), ExtractHour('fecha_hora')
+            ).annotate(n=Count('id'))
+            conteos = {(fecha, hora): n for fecha, hora, n in por_hora}
+        for horario in horarios:
+            horario.num_reservas = sum(
+                conteos.get((horario.fecha, hora), 0)
+                for hora in range(horario.hora_inicio.hour, horario.hora_fin.hour)
+            )
+
 @admin.register(Horario)
-class HorarioAdmin(admin.ModelAdmin):
+class HorarioAdmin(CatalogoAdminMixin, admin.ModelAdmin):
     list_display = ('fecha', 'hora_inicio', 'hora_fin', 'estado_horario', 'estado', 'reservas_en_horario')
     list_filter = ('estado_horario', 'fecha')
     date_hierarchy = 'fecha'
     list_editable = ('estado_horario',)
     ordering = ('fecha', 'hora_inicio')
+    actions = ['repetir_semanalmente']
 
     def estado(self, obj):
         color = 'green' if obj.disponible else 'red'
@@ -157,12 +280,11 @@ class HorarioAdmin(admin.ModelAdmin):
         )
     estado.short_description = 'Estado'
 
+    def get_changelist(self, request, **kwargs):
+        return HorarioChangeList
+
     def reservas_en_horario(self, obj):
-        count = Reserva.objects.filter(
-            fecha_hora__date=obj.fecha,
-            fecha_hora__hour__gte=obj.hora_inicio.hour,
-            fecha_hora__hour__lt=obj.hora_fin.hour
-        ).count()
+        count = obj.num_reservas
         color = 'red' if count > 0 else 'green'
         return format_html(
             '<span style="color: {};">{} reserva{}</span>',
@@ -170,3 +292,76 @@ class HorarioAdmin(admin.ModelAdmin):
         )
     reservas_en_horario.short_description = 'Reservas'
 
+    def repetir_semanalmente(self, request, queryset):
+        """Usa los horarios seleccionados como plantilla y los repite cada semana hasta una fecha"""
+        plantilla = {}
+        for horario in queryset.order_by('hora_inicio'):
+            turnos = plantilla.setdefault(horario.fecha.weekday(), [])
+            if (horario.hora_inicio, horario.hora_fin) not in turnos:
+                turnos.append((horario.hora_inicio, horario.hora_fin))
+        desde = queryset.order_by('-fecha').values_list('fecha', flat=True).first() + timedelta(days=1)
+
+        form = RepetirHorariosForm(request.POST if 'aplicar' in request.POST else None)
+        if form.is_valid():
+            creados, actualizados, sin_cambios = horarios.guardar(horarios.expandir(
+                desde, form.cleaned_data['hasta'], plantilla, form.cleaned_data['excepciones']
+            ))
+            self.message_user(
+                request, f'{creados} horarios creados, {actualizados} actualizados y {sin_cambios} ya existían'
+            )
+            return None
+        return TemplateResponse(request, 'admin/core/horario/repetir_semanalmente.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Repetir horarios semanalmente',
+            'opts': self.model._meta,
+            'form': form,
+            'desde': desde,
+            'plantilla': [(horarios.DIAS_SEMANA[dia], turnos) for dia, turnos in sorted(plantilla.items())],
+            'seleccionados': queryset.values_list('pk', flat=True),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+    repetir_semanalmente.short_description = "Repetir seleccionados cada semana"
+
+
+@admin.register(ResumenDiario)
+class ResumenDiarioAdmin(admin.ModelAdmin):
+    """Tablero de ocupación e ingresos: solo lee los resúmenes, nunca la tabla de reservas"""
+    list_display = ('fecha', 'servicio', 'estado_reserva', 'reservas', 'minutos', 'ingresos')
+    list_filter = ('servicio', 'estado_reserva')
+    date_hierarchy = 'fecha'
+    ordering = ('-fecha', 'servicio__nombre', 'estado_reserva_id')
+    list_select_related = ('servicio', 'estado_reserva')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        respuesta = super().changelist_view(request, extra_context)
+        cl = getattr(respuesta, 'context_data', {}).get('cl')
+        if cl is not None:
+            # Totales del mismo filtro que el listado (fecha, servicio, estado)
+            respuesta.context_data['totales'] = resumenes.totales_por_servicio(cl.queryset)
+        return respuesta
+
+
+@admin.register(Tarea)
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'estado', 'intentos', 'max_intentos', 'disponible_desde', 'creada', 'terminada')
+    list_filter = ('estado', 'nombre')
+    readonly_fields = ('nombre', 'argumentos', 'intentos', 'trabajador', 'bloqueada_hasta', 'ultimo_error',
+                       'creada', 'terminada')
+    ordering = ('-creada',)
+    actions = ['reintentar']
+
+    def reintentar(self, request, queryset):
+        actualizadas = queryset.filter(estado=Tarea.FALLIDA).update(
+            estado=Tarea.PENDIENTE, intentos=0, disponible_desde=timezone.now(), terminada=None
+        )
+        self.message_user(request, f'{actualizadas} tarea{"" if actualizadas == 1 else "s"} en cola de nuevo')
+    reintentar.short_description = "Reintentar tareas fallidas seleccionadas"
@@ -0,0 +1,192 @@
+"""API REST de servicios, reservas y horarios para clientes externos (app móvil).
+
+Los listados responden con ``ETag`` y ``Last-Modified``, así un cliente que
+consulta periódicamente recibe 304 sin que se serialice nada si no hubo
+cambios. En los listados paginados salen de las filas de la página (con las
+marcas de las filas relacionadas que muestra, como el servicio de cada
+reserva), que se leen una sola vez; en el resto, de un agregado con la última
+actualización y la cantidad de filas. ``?fields=`` limita los campos de la
+respuesta.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from functools import reduce
+
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from . import busqueda, disponibilidad, paginacion
+from .models import Horario, Reserva, Servicio
+from .reservas import TurnoOcupado, reservar_turno
+from .serializers import HorarioSerializer, ReservaSerializer, ServicioSerializer
+
+
+class Conflicto(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'El horario seleccionado no está disponible'
+    default_code = 'conflicto'
+
+
+class CursorReservasPaginacion(BasePagination):
+    """Paginación por cursor de ``paginacion``, con los mismos parámetros que /api/mis-reservas/"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            tamano = int(request.query_params.get('limite', paginacion.TAMANO_PAGINA))
+        except ValueError:
+            tamano = 0
+        if tamano < 1:
+            raise ValidationError({'limite': 'El límite debe ser un número positivo'})
+        try:
+            filas, self.siguiente = paginacion.paginar(
+                queryset, request.query_params.get('cursor'), min(tamano, paginacion.TAMANO_MAXIMO)
+            )
+        except paginacion.CursorInvalido as e:
+            raise ValidationError({'cursor': str(e)})
+        return filas
+
+    def get_paginated_response(self, data):
+        return Response({'results': data, 'siguiente': self.siguiente})
+
+
+class GetCondicionalMixin:
+    """Responde 304 a listados y detalles sin cambios desde el ETag/fecha del cliente"""
+    campo_actualizacion = 'actualizado'
+    # Marcas de actualización de filas relacionadas que aparecen en la respuesta
+    campos_relacionados = ()
+
+    def _etag(self, *partes):
+        # La respuesta depende de la URL (filtros, cursor, fields) y de quién consulta
+        huella = '|'.join(map(str, (self.request.user.pk, self.request.get_full_path(), *partes)))
+        return f'"{hashlib.sha256(huella.encode()).hexdigest()[:32]}"'
+
+    def validadores(self, queryset):
+        """ETag y última actualización de todo ``queryset``, con un agregado"""
+        campos = (self.campo_actualizacion, *self.campos_relacionados)
+        resumen = queryset.order_by().aggregate(
+            total=Count('pk'), **{f'ultima_{i}': Max(campo) for i, campo in enumerate(campos)}
+        )
+        ultimas = [resumen[f'ultima_{i}'] for i in range(len(campos))]
+        return self._etag(resumen['total'], *ultimas), max(filter(None, ultimas), default=None)
+
+    def validadores_pagina(self, filas):
+        """ETag y última actualización de las filas ya leídas de una página"""
+        campos = (self.campo_actualizacion, *self.campos_relacionados)
+        marcas = [
+            (fila.pk, *(reduce(getattr, campo.split('__'), fila) for campo in campos)) for fila in filas
+        ]
+        ultima = max((marca for _, *marcas_fila in marcas for marca in marcas_fila if marca), default=None)
+        return self._etag(marcas, self.paginator.siguiente), ultima
+
+    def respuesta_condicional(self, validadores, generar):
+        etag, ultima = validadores
+        no_modificada = get_conditional_response(
+            self.request, etag=etag, last_modified=int(ultima.timestamp()) if ultima else None
+        )
+        if no_modificada is not None:
+            return no_modificada
+        respuesta = generar()
+        respuesta['ETag'] = etag
+        if ultima:
+            respuesta['Last-Modified'] = http_date(ultima.timestamp())
+        return respuesta
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            return self.respuesta_condicional(
+                self.validadores(queryset),
+                lambda: super(GetCondicionalMixin, self).list(request, *args, **kwargs)
+            )
+        # La página se lee una vez: el ETag sale de sus filas y, si cambió, se serializan esas mismas
+        filas = self.paginate_queryset(queryset)
+        return self.respuesta_condicional(
+            self.validadores_pagina(filas),
+            lambda: self.get_paginated_response(self.get_serializer(filas, many=True).data)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respuesta_condicional(
+            self.validadores(self.filter_queryset(self.get_queryset()).filter(pk=kwargs['pk'])),
+            lambda: super(GetCondicionalMixin, self).retrieve(request, *args, **kwargs)
+        )
+
+
+class ServicioViewSet(GetCondicionalMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = ServicioSerializer
+
+    def get_queryset(self):
+        servicios = Servicio.objects.order_by('nombre')
+        if not self.request.user.is_staff:
+            servicios = servicios.filter(estado_servicio=1)
+        return servicios
+
+    @action(detail=False)
+    def buscar(self, request):
+        """Servicios con todas las palabras de ``?q=``, ordenados por relevancia"""
+        texto = request.query_params.get('q', '')
+        if not busqueda.palabras(texto):
+            raise ValidationError({'q': 'Indicar al menos una palabra a buscar'})
+        try:
+            limite = int(request.query_params.get('limite', busqueda.LIMITE))
+        except ValueError:
+            limite = 0
+        if limite < 1:
+            raise ValidationError({'limite': 'El límite debe ser un número positivo'})
+        servicios = busqueda.buscar(texto, solo_activos=not request.user.is_staff, limite=min(limite, busqueda.LIMITE_MAXIMO))
+        return Response({'results': self.get_serializer(servicios, many=True).data})
+
+
+class ReservaViewSet(GetCondicionalMixin, mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = ReservaSerializer
+    pagination_class = CursorReservasPaginacion
+    campo_actualizacion = 'actualizada'
+    # servicio_nombre sale del servicio
+    campos_relacionados = ('servicio__actualizado',)
+
+    def get_queryset(self):
+        reservas = Reserva.objects.select_related('servicio')
+        if not self.request.user.is_staff:
+            reservas = reservas.filter(usuario=self.request.user)
+        return reservas
+
+    def perform_create(self, serializer):
+        # Misma ruta que el formulario: reservar_turno revisa superposiciones y capacidad
+        try:
+            serializer.instance = reservar_turno(
+                self.request.user,
+                serializer.validated_data['servicio'],
+                serializer.validated_data['fecha_hora']
+            )
+        except TurnoOcupado as e:
+            raise Conflicto(e.messages[0])
+
+
+class HorarioViewSet(GetCondicionalMixin, viewsets.ReadOnlyModelViewSet):
+    """Horarios entre ``?desde`` y ``?hasta`` (AAAA-MM-DD), por defecto la ventana de reserva"""
+    serializer_class = HorarioSerializer
+
+    def get_queryset(self):
+        return Horario.objects.order_by('fecha', 'hora_inicio')
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return queryset
+        hoy = timezone.localdate()
+        try:
+            desde = self._fecha('desde', hoy)
+            hasta = self._fecha('hasta', hoy + timedelta(days=disponibilidad.DIAS_ANTICIPACION))
+        except ValueError:
+            raise ValidationError({'fecha': 'Las fechas deben tener el formato AAAA-MM-DD'})
+        return queryset.filter(fecha__range=(desde, hasta))
+
+    def _fecha(self, parametro, defecto):
+        valor = self.request.query_params.get(parametro)
+        return datetime.strptime(valor, '%Y-%m-%d').date() if valor else defecto
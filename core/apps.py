@@ -5,3 +5,8 @@ class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
 
+    def ready(self):
+        # Registrar las señales de la aplicación
+        from . import avisos, checks, signals  # noqa: F401
+        from . import metricas
+        metricas.instalar()
@@ -0,0 +1,82 @@
+"""Usuario de la sesión guardado en cache por id y hash de autenticación.
+
+``AutenticacionMiddleware`` reemplaza al ``AuthenticationMiddleware`` de
+Django: busca el usuario (con ``tipo_usuario`` ya cargado) en la clave
+``usuario:<id>:<hash de la sesión>`` y solo consulta la base cuando no está.
+Lo que se guarda ya pasó la verificación de Django, así que una entrada solo
+sirve a sesiones abiertas con esa misma contraseña: cambiarla no reutiliza
+nada de la cache y la sesión nueva se verifica contra la base.
+
+``post_save``/``post_delete`` de ``Usuario`` borran las entradas del hash
+anterior y del nuevo. En otros workers con cache local, o si el cambio se hizo
+con ``QuerySet.update()`` (que no manda señales), las sesiones viejas siguen
+usando la copia hasta ``USUARIO_CACHE_TIMEOUT``; ``check`` avisa
+(``core.W001``) cuando se combina con ``locmem`` y varios workers.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .models import Usuario
+
+RUTA_BACKEND = 'core.autenticacion.UsuarioCacheBackend'
+
+
+def clave_cache(usuario_id, hash_sesion):
+    return f'usuario:{usuario_id}:{hash_sesion}'
+
+
+def invalidar(usuario):
+    """Borra las entradas del hash actual de ``usuario`` y del que tenía al leerlo de la base"""
+    hashes = {usuario.get_session_auth_hash()}
+    anterior = getattr(usuario, '_valores_originales', {}).get('password')
+    if anterior is not None and anterior != usuario.password:
+        hashes.add(Usuario(password=anterior).get_session_auth_hash())
+    cache.delete_many([clave_cache(usuario.pk, hash_sesion) for hash_sesion in hashes])
+
+
+class UsuarioCacheBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        usuario = Usuario.objects.select_related('tipo_usuario').filter(pk=user_id).first()
+        return usuario if usuario is not None and self.user_can_authenticate(usuario) else None
+
+
+def usuario_de_sesion(request):
+    """``auth.get_user`` que busca primero en la cache el usuario del id y hash de la sesión"""
+    sesion = request.session
+    hash_sesion = sesion.get(auth.HASH_SESSION_KEY)
+    if (not settings.USUARIO_CACHE_TIMEOUT or not hash_sesion
+            or sesion.get(auth.BACKEND_SESSION_KEY) != RUTA_BACKEND):
+        return auth.get_user(request)
+
+    clave = clave_cache(sesion.get(auth.SESSION_KEY), hash_sesion)
+    usuario = cache.get(clave)
+    if usuario is not None:
+        return usuario
+    usuario = auth.get_user(request)
+    # Con una SECRET_KEY de respaldo Django acepta la sesión pero le cambia el hash: no se guarda con el viejo
+    if usuario.is_authenticated and constant_time_compare(usuario.get_session_auth_hash(), hash_sesion):
+        cache.set(clave, usuario, settings.USUARIO_CACHE_TIMEOUT)
+    return usuario
+
+
+async def _ausuario_de_sesion(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await sync_to_async(usuario_de_sesion)(request)
+    return request._acached_user
+
+
+class AutenticacionMiddleware(AuthenticationMiddleware):
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: usuario_de_sesion(request))
+        request.auser = partial(_ausuario_de_sesion, request)
@@ -0,0 +1,90 @@
+"""Avisos por correo de las reservas nuevas o movidas, ejecutados por la cola de tareas"""
+from datetime import datetime
+
+from django.core.mail import mail_admins, send_mail
+from django.utils import timezone
+
+from . import tareas
+from .models import Reserva
+
+
+def _reservas(reserva_ids):
+    return list(Reserva.objects.filter(id__in=reserva_ids).select_related('usuario', 'servicio').order_by('fecha_hora'))
+
+
+def _linea(reserva):
+    return f'- {reserva.servicio.nombre}: {timezone.localtime(reserva.fecha_hora):%d/%m/%Y %H:%M}'
+
+
+@tareas.tarea
+def enviar_confirmacion(reserva_ids):
+    """Correo al usuario con las reservas recién creadas (todas son del mismo usuario)"""
+    reservas = _reservas(reserva_ids)
+    if not reservas or not reservas[0].usuario.email:
+        return
+    usuario = reservas[0].usuario
+    send_mail(
+        'ZenTeach - Reserva recibida' if len(reservas) == 1 else f'ZenTeach - {len(reservas)} reservas recibidas',
+        '\n'.join([
+            f'Hola {usuario.first_name or usuario.username},',
+            '',
+            'Registramos tus reservas en ZenTeach:' if len(reservas) > 1 else 'Registramos tu reserva en ZenTeach:',
+            *map(_linea, reservas),
+        ]),
+        None,
+        [usuario.email],
+    )
+
+
+@tareas.tarea
+def notificar_administradores(reserva_ids):
+    """Aviso a ``ADMINS`` de reservas pendientes de confirmar"""
+    reservas = _reservas(reserva_ids)
+    if not reservas:
+        return
+    mail_admins(
+        f'{len(reservas)} reserva(s) nueva(s) de {reservas[0].usuario.username}',
+        '\n'.join(map(_linea, reservas)),
+    )
+
+
+@tareas.tarea
+def avisar_cambio_de_turno(reserva_ids, turnos_pedidos):
+    """Correo al usuario con las reservas que se confirmaron en otro turno (todas son del mismo usuario)"""
+    reservas = _reservas(reserva_ids)
+    if not reservas or not reservas[0].usuario.email:
+        return
+    usuario = reservas[0].usuario
+    pedidos = {reserva_id: datetime.fromisoformat(pedido) for reserva_id, pedido in zip(reserva_ids, turnos_pedidos)}
+    send_mail(
+        'ZenTeach - Cambio de turno' if len(reservas) == 1 else f'ZenTeach - {len(reservas)} cambios de turno',
+        '\n'.join([
+            f'Hola {usuario.first_name or usuario.username},',
+            '',
+            'Confirmamos tus reservas en otro turno:' if len(reservas) > 1 else 'Confirmamos tu reserva en otro turno:',
+            *(
+                f'{_linea(reserva)} (pediste {timezone.localtime(pedidos[reserva.pk]):%d/%m/%Y %H:%M})'
+                for reserva in reservas
+            ),
+        ]),
+        None,
+        [usuario.email],
+    )
+
+
+def reservas_creadas(reservas):
+    """Encola los avisos de reservas creadas; llamar dentro de la transacción que las crea"""
+    reserva_ids = [reserva.pk for reserva in reservas]
+    if reserva_ids:
+        tareas.encolar(enviar_confirmacion, reserva_ids=reserva_ids)
+        tareas.encolar(notificar_administradores, reserva_ids=reserva_ids)
+
+
+def turnos_cambiados(cambios):
+    """Encola un aviso por usuario de las reservas ``(reserva, fecha_hora pedida)`` movidas; llamar dentro de la transacción"""
+    por_usuario = {}
+    for reserva, pedida in cambios:
+        por_usuario.setdefault(reserva.usuario_id, []).append((reserva.pk, pedida.isoformat()))
+    for cambios_usuario in por_usuario.values():
+        reserva_ids, turnos_pedidos = zip(*cambios_usuario)
+        tareas.encolar(avisar_cambio_de_turno, reserva_ids=list(reserva_ids), turnos_pedidos=list(turnos_pedidos))
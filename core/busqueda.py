@@ -0,0 +1,147 @@
+"""Búsqueda de servicios con un índice FTS5 de SQLite.
+
+``core_servicio_fts`` es una tabla virtual FTS5 con contenido externo: no
+duplica el texto, solo guarda el índice invertido de ``nombre`` y
+``descripcion`` de ``core_servicio``. Tres triggers la mantienen al día con
+cualquier escritura (``save``, ``bulk_create``, ``update`` o SQL directo).
+El tokenizador ``unicode61`` con ``remove_diacritics 2`` ignora mayúsculas y
+tildes ("masaje" encuentra "Masáje"); cada palabra buscada se usa como
+prefijo, que también cubre los plurales ("masaje" encuentra "masajes").
+
+Los resultados se ordenan por BM25, con el nombre pesando más que la
+descripción. En bases sin FTS5 (Postgres, SQLite compilado sin el módulo)
+se usa ``icontains``, que recorre la tabla completa.
+"""
+import re
+
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Servicio
+
+TABLA = 'core_servicio_fts'
+LIMITE = 20
+LIMITE_MAXIMO = 100
+MAX_PALABRAS = 8
+# Peso de nombre y descripción en el ranking BM25
+PESOS = (10.0, 1.0)
+
+SQL_INSTALAR = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA} USING fts5(
+        nombre, descripcion,
+        content='core_servicio', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_ai AFTER INSERT ON core_servicio BEGIN
+        INSERT INTO {TABLA}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_ad AFTER DELETE ON core_servicio BEGIN
+        INSERT INTO {TABLA}({TABLA}, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_au AFTER UPDATE OF nombre, descripcion ON core_servicio BEGIN
+        INSERT INTO {TABLA}({TABLA}, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+        INSERT INTO {TABLA}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    f"INSERT INTO {TABLA}({TABLA}, rank) VALUES ('rank', 'bm25({PESOS[0]}, {PESOS[1]})')",
+]
+TRIGGERS = {f'{TABLA}_ai', f'{TABLA}_ad', f'{TABLA}_au'}
+
+_disponible = {}
+
+
+def instalar(conexion):
+    """Crea el índice y los triggers si faltan y reindexa si hubo que crearlos.
+
+    La migración 0011 los crea con su propia copia del SQL; ``reponer`` lo
+    llama desde ``post_migrate`` para volver a crear los triggers que SQLite
+    borra cuando una migración reconstruye ``core_servicio``. Devuelve False
+    si la base no soporta FTS5.
+    """
+    _disponible.clear()
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'core_servicio'")
+        existentes = {nombre for nombre, in cursor.fetchall()}
+        if TRIGGERS <= existentes:
+            return True
+        try:
+            for sql in SQL_INSTALAR:
+                cursor.execute(sql)
+        except OperationalError:
+            # SQLite compilado sin FTS5
+            return False
+        # Sin triggers pudo haber escrituras que el índice no vio
+        cursor.execute(f"INSERT INTO {TABLA}({TABLA}) VALUES ('rebuild')")
+    return True
+
+
+def reponer(conexion):
+    """Repone los triggers después de ``migrate`` solo si el índice existe (la migración 0011 está aplicada)"""
+    if conexion.vendor == 'sqlite' and TABLA in conexion.introspection.table_names():
+        instalar(conexion)
+
+
+def fts_disponible():
+    """Si la base actual tiene el índice FTS5 (se consulta una vez por base)"""
+    base = connection.settings_dict['NAME']
+    if base not in _disponible:
+        _disponible[base] = connection.vendor == 'sqlite' and TABLA in connection.introspection.table_names()
+    return _disponible[base]
+
+
+def palabras(texto):
+    return re.findall(r'\w+', texto.lower())[:MAX_PALABRAS]
+
+
+def consulta_fts(texto):
+    """Texto libre a una consulta FTS5: todas las palabras, cada una como prefijo.
+
+    Las comillas evitan que una palabra se lea como operador (``OR``, ``NEAR``).
+    """
+    return ' '.join(f'"{palabra}"*' for palabra in palabras(texto))
+
+
+def filtro_icontains(texto):
+    condicion = Q()
+    for palabra in palabras(texto):
+        condicion &= Q(nombre__icontains=palabra) | Q(descripcion__icontains=palabra)
+    return condicion
+
+
+def filtro(texto):
+    """Q para filtrar cualquier queryset de Servicio, sin orden por relevancia (admin)"""
+    if fts_disponible():
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {TABLA} WHERE {TABLA} MATCH %s', [consulta_fts(texto)]))
+    return filtro_icontains(texto)
+
+
+def buscar_icontains(texto, solo_activos=True, limite=LIMITE):
+    servicios = Servicio.objects.filter(filtro_icontains(texto)).order_by('nombre')
+    if solo_activos:
+        servicios = servicios.filter(estado_servicio=1)
+    return list(servicios[:limite])
+
+
+def buscar_fts(texto, solo_activos=True, limite=LIMITE):
+    parametros = [consulta_fts(texto)]
+    condicion_estado = ''
+    if solo_activos:
+        condicion_estado = 'AND s.estado_servicio_id = %s'
+        parametros.append(1)
+    parametros.append(limite)
+    return list(Servicio.objects.raw(
+        f'SELECT s.* FROM {TABLA} JOIN core_servicio s ON s.id = {TABLA}.rowid '
+        f'WHERE {TABLA} MATCH %s {condicion_estado} ORDER BY {TABLA}.rank LIMIT %s',
+        parametros,
+    ))
+
+
+def buscar(texto, solo_activos=True, limite=LIMITE):
+    """Servicios que contienen todas las palabras, del más al menos relevante"""
+    if not palabras(texto):
+        return []
+    if fts_disponible():
+        return buscar_fts(texto, solo_activos, limite)
+    return buscar_icontains(texto, solo_activos, limite)
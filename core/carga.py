@@ -0,0 +1,108 @@
+"""Utilidades para las pruebas de carga contra un servidor local.
+
+Solo usa la biblioteca estándar (``urllib`` con hilos) para no sumar
+dependencias: cada hilo es un cliente con su propia sesión y cookie CSRF.
+"""
+import http.cookiejar
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentil(valores, p):
+    """Percentil ``p`` (0-100) por el método del rango más cercano; ``valores`` ordenados"""
+    if not valores:
+        return None
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+def resumen(latencias, duracion, errores=0, **extra):
+    """Métricas de una corrida: latencias en segundos, duración total en segundos"""
+    ordenadas = sorted(latencias)
+    milisegundos = lambda valor: round(valor * 1000, 2) if valor is not None else None
+    return {
+        'solicitudes': len(ordenadas),
+        'errores': errores,
+        'por_segundo': round(len(ordenadas) / duracion, 1) if duracion else None,
+        'p50_ms': milisegundos(percentil(ordenadas, 50)),
+        'p95_ms': milisegundos(percentil(ordenadas, 95)),
+        'p99_ms': milisegundos(percentil(ordenadas, 99)),
+        'max_ms': milisegundos(ordenadas[-1] if ordenadas else None),
+        **extra,
+    }
+
+
+class ClienteHttp:
+    """Cliente con sesión propia para un servidor Django"""
+
+    def __init__(self, url_base, timeout=30):
+        self.url_base = url_base.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def _csrf(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def solicitar(self, metodo, ruta, datos=None):
+        """Devuelve el código HTTP; los errores de conexión se devuelven como 0"""
+        cuerpo = urllib.parse.urlencode(datos).encode() if datos is not None else None
+        solicitud = urllib.request.Request(self.url_base + ruta, data=cuerpo, method=metodo)
+        if metodo != 'GET':
+            solicitud.add_header('X-CSRFToken', self._csrf())
+            solicitud.add_header('Referer', self.url_base + ruta)
+        try:
+            with self.abridor.open(solicitud, timeout=self.timeout) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+        except (urllib.error.URLError, OSError):
+            return 0
+
+    def iniciar_sesion(self, usuario, clave):
+        self.solicitar('GET', '/login/')
+        self.solicitar('POST', '/login/', {
+            'username': usuario, 'password': clave, 'csrfmiddlewaretoken': self._csrf()
+        })
+        if not any(cookie.name == 'sessionid' for cookie in self.cookies):
+            raise RuntimeError(f'No se pudo iniciar sesión como {usuario} en {self.url_base}')
+
+
+def ejecutar(url_base, peticiones, concurrencia, usuario=None, clave=None):
+    """Reparte ``peticiones`` (lista de (método, ruta, datos)) entre ``concurrencia`` clientes.
+
+    Devuelve ``(latencias, codigos, duracion)``.
+    """
+    clientes = [ClienteHttp(url_base) for _ in range(concurrencia)]
+    if usuario:
+        for cliente in clientes:
+            cliente.iniciar_sesion(usuario, clave)
+    latencias, codigos = [], []
+    bloqueo = threading.Lock()
+
+    def trabajar(indice):
+        cliente = clientes[indice]
+        for metodo, ruta, datos in peticiones[indice::concurrencia]:
+            inicio = time.perf_counter()
+            codigo = cliente.solicitar(metodo, ruta, datos)
+            transcurrido = time.perf_counter() - inicio
+            with bloqueo:
+                latencias.append(transcurrido)
+                codigos.append(codigo)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        list(ejecutor.map(trabajar, range(concurrencia)))
+    return latencias, codigos, time.perf_counter() - inicio
+
+
+def guardar(resultado, ruta):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(resultado, archivo, indent=2, ensure_ascii=False, sort_keys=True)
@@ -0,0 +1,109 @@
+"""Cache en memoria del proceso para las tablas de catálogo.
+
+``TipoUsuario``, ``EstadoServicio``, ``EstadoReserva`` y ``EstadoHorario``
+tienen pocas filas y casi nunca cambian, así que se cargan completas una vez
+por proceso. Las señales de esos modelos invalidan la copia local y el TTL
+(``CATALOGOS_TTL``) acota cuánto tarda otro worker en ver un cambio.
+
+Las instancias devueltas se comparten entre solicitudes: no modificarlas.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_catalogos = {}
+_bloqueo = threading.Lock()
+
+
+def _ttl():
+    return getattr(settings, 'CATALOGOS_TTL', 300)
+
+
+def _vigente(entrada):
+    return entrada is not None and time.monotonic() - entrada[0] < _ttl()
+
+
+def _cargar(modelo):
+    entrada = _catalogos.get(modelo)
+    if not _vigente(entrada):
+        with _bloqueo:
+            entrada = _catalogos.get(modelo)
+            if not _vigente(entrada):
+                filas = list(modelo.objects.order_by('pk'))
+                entrada = (
+                    time.monotonic(),
+                    {fila.pk: fila for fila in filas},
+                    {fila.nombre: fila.pk for fila in filas},
+                )
+                _catalogos[modelo] = entrada
+    return entrada
+
+
+def _buscar(modelo, indice, clave):
+    encontrado = _cargar(modelo)[indice].get(clave)
+    if encontrado is None:
+        # Puede ser una fila creada por otro proceso: recargar una vez antes de fallar
+        invalidar(modelo)
+        encontrado = _cargar(modelo)[indice].get(clave)
+    if encontrado is None:
+        raise modelo.DoesNotExist(f'{modelo.__name__} {clave!r} no existe')
+    return encontrado
+
+
+def obtener(modelo, pk):
+    """Instancia del catálogo por clave primaria"""
+    return _buscar(modelo, 1, int(pk))
+
+
+def id_por_nombre(modelo, nombre):
+    """Clave primaria de la fila con ese ``nombre``"""
+    return _buscar(modelo, 2, nombre)
+
+
+def nombre(modelo, pk, defecto=''):
+    """Nombre de la fila o ``defecto`` si no existe (para mostrar en listados)"""
+    if pk is None:
+        return defecto
+    try:
+        return obtener(modelo, pk).nombre
+    except modelo.DoesNotExist:
+        return defecto
+
+
+def todos(modelo):
+    return list(_cargar(modelo)[1].values())
+
+
+def opciones(modelo):
+    """Pares (pk, etiqueta) para widgets de selección sin consultar la base"""
+    return [(fila.pk, str(fila)) for fila in todos(modelo)]
+
+
+def invalidar(modelo=None):
+    if modelo is None:
+        _catalogos.clear()
+    else:
+        _catalogos.pop(modelo, None)
+
+
+def modelos():
+    from .models import TipoUsuario, EstadoServicio, EstadoReserva, EstadoHorario
+    return (TipoUsuario, EstadoServicio, EstadoReserva, EstadoHorario)
+
+
+def calentar():
+    """Carga todos los catálogos; se llama al iniciar cada worker (ver wsgi.py/asgi.py)"""
+    try:
+        for modelo in modelos():
+            _cargar(modelo)
+    except DatabaseError:
+        # Base sin migrar todavía: se cargarán en la primera consulta
+        logger.warning('No se pudieron precargar los catálogos', exc_info=True)
+    finally:
+        # No dejar conexiones abiertas fuera de una solicitud (p. ej. con gunicorn --preload)
+        connections.close_all()
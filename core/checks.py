@@ -0,0 +1,59 @@
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# <script src>, <link href> y @import de CSS que apuntan a otro dominio
+RECURSO_EXTERNO = re.compile(
+    r'<(?:script|link)\b[^>]*\b(?:src|href)\s*=\s*["\']?((?:https?:)?//[^"\'\s>]+)'
+    r'|@import\s+(?:url\()?\s*["\']?((?:https?:)?//[^"\'\s)]+)',
+    re.IGNORECASE
+)
+
+
+def _directorios_plantillas():
+    for motor in settings.TEMPLATES:
+        yield from (Path(directorio) for directorio in motor.get('DIRS', []))
+    yield Path(__file__).resolve().parent / 'templates'
+
+
+@register(Tags.staticfiles, Tags.templates)
+def plantillas_sin_cdn(app_configs, **kwargs):
+    """Los scripts y estilos se sirven desde static/: una plantilla con un CDN hace fallar collectstatic"""
+    errores = []
+    for directorio in _directorios_plantillas():
+        for plantilla in sorted(directorio.rglob('*.html')):
+            texto = plantilla.read_text(encoding='utf-8')
+            for coincidencia in RECURSO_EXTERNO.finditer(texto):
+                linea = texto.count('\n', 0, coincidencia.start()) + 1
+                errores.append(Error(
+                    f'{plantilla}:{linea} carga {coincidencia.group(1) or coincidencia.group(2)} desde un CDN',
+                    hint='Copiar el archivo a static/ y usar {% static %}.',
+                    id='core.E001',
+                ))
+    return errores
+
+
+@register(Tags.caches)
+def sesiones_con_cache_compartida(app_configs, **kwargs):
+    """Con cache local por proceso, otro worker puede devolver una sesión ya cerrada o un usuario ya cambiado"""
+    if not settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+        return []
+    avisos = []
+    if settings.SESSION_ENGINE.endswith('cached_db'):
+        avisos.append(Warning(
+            'SESION_MODO=cached_db con la cache locmem: cada worker guarda su propia copia de las sesiones',
+            hint='Con varios workers usar CACHE_BACKEND=file o db, o SESION_MODO=db.',
+            id='core.W001',
+        ))
+    if (settings.WORKERS > 1 and settings.USUARIO_CACHE_TIMEOUT
+            and 'core.autenticacion.AutenticacionMiddleware' in settings.MIDDLEWARE):
+        avisos.append(Warning(
+            f'Usuario de la sesión en la cache locmem con {settings.WORKERS} workers: un cambio de contraseña, '
+            f'is_active o is_staff tarda hasta USUARIO_CACHE_TIMEOUT={settings.USUARIO_CACHE_TIMEOUT} s en verse '
+            'en los demás workers',
+            hint='Usar CACHE_BACKEND=file o db, o USUARIO_CACHE_TIMEOUT=0.',
+            id='core.W001',
+        ))
+    return avisos
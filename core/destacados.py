@@ -0,0 +1,117 @@
+"""Ranking de servicios destacados de la página de inicio.
+
+El ranking se guarda en cache con un vencimiento "suave": cuando vence (o una
+señal lo marca como desactualizado) se sigue sirviendo el valor anterior
+mientras un único proceso lo recalcula, así una expiración no dispara el
+``Count('reservas')`` en todas las solicitudes a la vez.
+
+Marcarlo como desactualizado incrementa un contador de versión con
+``cache.incr`` en vez de reescribir la entrada, y el ranking guarda la versión
+que había al empezar a calcularlo: un recálculo que leyó la base antes de un
+cambio no queda como vigente. Las señales de ``Reserva`` lo marcan al
+confirmarse la transacción.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Servicio
+
+CLAVE = 'servicios_destacados'
+CLAVE_BLOQUEO = f'{CLAVE}:recalculando'
+CLAVE_VERSION = f'{CLAVE}:version'
+CANTIDAD = 3
+BLOQUEO_SEGUNDOS = 30
+ESPERA_INICIAL = 0.05
+INTENTOS_ESPERA = 10
+
+
+def _timeout():
+    return getattr(settings, 'DESTACADOS_CACHE_TIMEOUT', 300)
+
+
+def _calcular():
+    servicios = Servicio.objects.filter(estado_servicio=1).annotate(
+        total_reservas=Count('reservas')
+    ).order_by('-total_reservas', 'id')[:CANTIDAD]
+    return [
+        {
+            'id': servicio.id,
+            'nombre': servicio.nombre,
+            'descripcion': servicio.descripcion,
+            'duracion': servicio.duracion,
+            'precio': servicio.precio,
+            'total_reservas': servicio.total_reservas,
+        }
+        for servicio in servicios
+    ]
+
+
+def _guardar(servicios, version):
+    timeout = _timeout()
+    entrada = {'vence': time.time() + timeout, 'version': version, 'servicios': servicios}
+    # La entrada vive el doble del TTL para poder servirla vencida mientras se recalcula
+    cache.set(CLAVE, entrada, timeout * 2)
+
+
+def _recalcular(version):
+    servicios = _calcular()
+    _guardar(servicios, version)
+    return servicios
+
+
+def _vigente(entrada, version):
+    return entrada is not None and entrada['vence'] > time.time() and entrada.get('version') == version
+
+
+def servicios_destacados():
+    """Devuelve los servicios activos con más reservas, leyendo de cache"""
+    valores = cache.get_many([CLAVE, CLAVE_VERSION])
+    entrada = valores.get(CLAVE)
+    version = valores.get(CLAVE_VERSION, 0)
+    if _vigente(entrada, version):
+        return entrada['servicios']
+
+    if cache.add(CLAVE_BLOQUEO, True, BLOQUEO_SEGUNDOS):
+        try:
+            return _recalcular(version)
+        finally:
+            cache.delete(CLAVE_BLOQUEO)
+
+    # Otro proceso está recalculando: servir el valor vencido si existe
+    if entrada is not None:
+        return entrada['servicios']
+    for intento in range(INTENTOS_ESPERA):
+        time.sleep(ESPERA_INICIAL)
+        entrada = cache.get(CLAVE)
+        if entrada is not None:
+            return entrada['servicios']
+    return _calcular()
+
+
+def marcar_desactualizado():
+    """Fuerza el recálculo en la próxima lectura sin perder el valor actual"""
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        # Sin contador la versión es 0: empezar en 1 deja vencidas las entradas guardadas con 0
+        if not cache.add(CLAVE_VERSION, 1, None):
+            cache.incr(CLAVE_VERSION)
+
+
+def _ajustar(servicio_id, diferencia):
+    entrada = cache.get(CLAVE)
+    if entrada is None:
+        return
+    en_ranking = any(s['id'] == servicio_id for s in entrada['servicios'])
+    # Restarle a un servicio fuera del ranking no cambia ni el orden ni los totales mostrados
+    if en_ranking or diferencia > 0:
+        marcar_desactualizado()
+
+
+def ajustar(servicio_id, diferencia):
+    """Al confirmarse la transacción, marca el ranking si crear (+1) o borrar (-1) una reserva puede cambiarlo"""
+    transaction.on_commit(lambda: _ajustar(servicio_id, diferencia))
@@ -0,0 +1,332 @@
+"""Motor de disponibilidad de turnos.
+
+La grilla de atención se divide en turnos de 30 minutos (08:00 a 18:00, de
+lunes a viernes, igual que ``validar_horario``). La ocupación de cada día se
+guarda en cache como un entero donde el bit ``i`` indica que el turno ``i``
+está lleno (tantas reservas activas a la vez como ``CAPACIDAD_SALA``) o
+bloqueado por un ``Horario`` no disponible. Una reserva ocupa todos los turnos
+que cubre su duración. Las señales de ``Reserva`` y ``Horario`` descartan los
+días que cambian, otra vez al confirmarse la transacción: un lector que los
+recalculó mientras tanto con los datos anteriores no deja su copia vieja.
+
+Las superposiciones se calculan con ``activas_en``, una consulta por rango
+sobre ``reserva_estado_intervalo_idx``, y un ``IndiceIntervalos`` en memoria.
+"""
+import math
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .intervalos import IndiceIntervalos
+from .models import DURACION_MAXIMA_MINUTOS, EstadoReserva, Reserva, Horario
+
+# Reglas de negocio del horario de atención
+HORA_APERTURA = 8
+HORA_CIERRE = 18
+INTERVALO_MINUTOS = 30
+DIAS_ANTICIPACION = 30
+MARGEN_PASADO = timedelta(minutes=5)
+
+# El último turno empieza justo a la hora de cierre (18:00), como en validar_horario
+TOTAL_TURNOS = (HORA_CIERRE - HORA_APERTURA) * 60 // INTERVALO_MINUTOS + 1
+GRILLA_COMPLETA = (1 << TOTAL_TURNOS) - 1
+DURACION_TURNO = timedelta(minutes=INTERVALO_MINUTOS)
+# Ninguna reserva empieza antes de esto respecto de otra con la que se superpone
+DURACION_MAXIMA = timedelta(minutes=DURACION_MAXIMA_MINUTOS)
+
+# Estados de reserva que ocupan un turno (pendiente, confirmado)
+ESTADOS_ACTIVOS = (1, 2)
+ESTADO_HORARIO_NO_DISPONIBLE = 2
+
+CACHE_PREFIJO = 'disponibilidad'
+# Clave del advisory lock de Postgres que serializa las verificaciones de capacidad
+CLAVE_BLOQUEO_AGENDA = 0x5A454E54
+
+
+def _cache_timeout():
+    return getattr(settings, 'DISPONIBILIDAD_CACHE_TIMEOUT', 300)
+
+
+def clave_cache(fecha):
+    return f'{CACHE_PREFIJO}:{fecha.isoformat()}'
+
+
+def indice_turno(hora):
+    """Devuelve el índice del turno que empieza a ``hora`` o None si no es un turno válido"""
+    minutos = (hora.hour - HORA_APERTURA) * 60 + hora.minute
+    if hora.second or hora.microsecond or minutos % INTERVALO_MINUTOS:
+        return None
+    indice = minutos // INTERVALO_MINUTOS
+    if 0 <= indice < TOTAL_TURNOS:
+        return indice
+    return None
+
+
+def hora_turno(indice):
+    minutos = HORA_APERTURA * 60 + indice * INTERVALO_MINUTOS
+    return time(minutos // 60, minutos % 60)
+
+
+def inicio_turno(fecha, indice):
+    """Fecha y hora (aware, zona local) en que empieza el turno ``indice`` de ``fecha``"""
+    return timezone.make_aware(datetime.combine(fecha, hora_turno(indice)))
+
+
+def mascara_rango(hora_inicio, hora_fin):
+    """Bits de los turnos que empiezan dentro de [hora_inicio, hora_fin)"""
+    mascara = 0
+    for indice in range(TOTAL_TURNOS):
+        if hora_inicio <= hora_turno(indice) < hora_fin:
+            mascara |= 1 << indice
+    return mascara
+
+
+def mascara_intervalo(inicio, fin):
+    """Bits de los turnos del día local de ``inicio`` que se superponen con [inicio, fin)"""
+    local = timezone.localtime(inicio)
+    minutos = (local.hour - HORA_APERTURA) * 60 + local.minute + local.second / 60
+    duracion = (fin - inicio).total_seconds() / 60
+    primero = max(0, math.floor(minutos / INTERVALO_MINUTOS))
+    ultimo = min(TOTAL_TURNOS, math.ceil((minutos + duracion) / INTERVALO_MINUTOS))
+    mascara = 0
+    for indice in range(primero, ultimo):
+        mascara |= 1 << indice
+    return mascara
+
+
+def mascara_vigencia(fecha, ahora=None):
+    """Turnos de ``fecha`` que todavía se pueden reservar según las reglas de validar_horario"""
+    if fecha.weekday() >= 5:
+        return 0
+    ahora = ahora or timezone.now()
+    minimo = ahora - MARGEN_PASADO
+    maximo = ahora + timedelta(days=DIAS_ANTICIPACION)
+    mascara = 0
+    for indice in range(TOTAL_TURNOS):
+        if minimo <= inicio_turno(fecha, indice) <= maximo:
+            mascara |= 1 << indice
+    return mascara
+
+
+def turnos_libres(bitmap):
+    """Convierte un bitmap en la lista de horas ``HH:MM`` libres"""
+    return [hora_turno(i).strftime('%H:%M') for i in range(TOTAL_TURNOS) if bitmap >> i & 1]
+
+
+def _unir(rangos):
+    """Rangos [inicio, fin) ordenados y sin superposiciones"""
+    unidos = []
+    for inicio, fin in sorted(rangos):
+        if unidos and inicio <= unidos[-1][1]:
+            unidos[-1][1] = max(unidos[-1][1], fin)
+        else:
+            unidos.append([inicio, fin])
+    return unidos
+
+
+def activas_en(rangos, excluir=None):
+    """Consulta (sin evaluar) de ``(inicio, fin, servicio_id, cantidad)`` de las reservas activas que se superponen con los ``rangos``.
+
+    Las reservas iguales salen agrupadas con su cantidad. Una reserva que termina después de ``inicio`` empezó como mucho
+    ``DURACION_MAXIMA`` antes, así que cada rango es un recorrido acotado del
+    índice ``reserva_estado_intervalo_idx`` por cada estado activo, que además
+    cubre las tres columnas.
+    """
+    condicion = Q()
+    for inicio, fin in _unir(rangos):
+        # El estado va en cada rama del OR: SQLite busca cada rango por separado en el índice
+        condicion |= Q(
+            estado_reserva_id__in=ESTADOS_ACTIVOS,
+            fecha_hora__gt=inicio - DURACION_MAXIMA,
+            fecha_hora__lt=fin,
+            fecha_fin__gt=inicio,
+        )
+    reservas = Reserva.objects.filter(condicion) if condicion else Reserva.objects.none()
+    if excluir is not None:
+        reservas = reservas.exclude(pk=excluir)
+    return reservas.order_by().values_list('fecha_hora', 'fecha_fin', 'servicio_id').annotate(cantidad=Count('pk'))
+
+
+def bloquear_agenda():
+    """Serializa, hasta el fin de la transacción, las verificaciones de capacidad que escriben después.
+
+    SQLite ya lo hace: una transacción que leyó antes de que otra escribiera
+    falla al escribir y se reintenta. En Postgres, leer y después insertar
+    dejaría pasar a dos solicitudes a la vez, así que se toma un advisory
+    lock. En otras bases se bloquea una fila fija del catálogo.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLAVE_BLOQUEO_AGENDA])
+    elif connection.vendor != 'sqlite' and connection.in_atomic_block:
+        list(EstadoReserva.objects.select_for_update().filter(pk=ESTADOS_ACTIVOS[0]))
+
+
+def agenda(rangos, excluir=None):
+    """Índice en memoria de las reservas activas que se superponen con los ``rangos``.
+
+    Toma antes ``bloquear_agenda``: llamar dentro de la transacción que inserta o modifica la reserva.
+    """
+    bloquear_agenda()
+    return IndiceIntervalos(activas_en(rangos, excluir))
+
+
+def admite(agenda, servicio, inicio, fin):
+    """Si una reserva de ``servicio`` en [inicio, fin) entra sin superar su capacidad ni la de la sala"""
+    return (
+        agenda.simultaneos(inicio, fin, servicio.pk) < servicio.capacidad
+        and agenda.simultaneos(inicio, fin) < settings.CAPACIDAD_SALA
+    )
+
+
+def _rango_dias(desde, hasta):
+    return (
+        timezone.make_aware(datetime.combine(desde, time.min)),
+        timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)),
+    )
+
+
+def _bloqueos(desde, hasta):
+    return Horario.objects.filter(
+        fecha__range=(desde, hasta),
+        estado_horario_id=ESTADO_HORARIO_NO_DISPONIBLE
+    ).values_list('fecha', 'hora_inicio', 'hora_fin')
+
+
+def _consultas_ocupacion(desde, hasta):
+    """Consultas (sin evaluar) de reservas activas y bloqueos entre ``desde`` y ``hasta``"""
+    return activas_en([_rango_dias(desde, hasta)]), _bloqueos(desde, hasta)
+
+
+def _bloqueos_por_dia(desde, hasta, bloqueos):
+    por_dia = {desde + timedelta(days=i): 0 for i in range((hasta - desde).days + 1)}
+    for fecha, hora_inicio, hora_fin in bloqueos:
+        por_dia[fecha] |= mascara_rango(hora_inicio, hora_fin)
+    return por_dia
+
+
+def turnos_bloqueados(desde, hasta):
+    """{fecha: bitmap de turnos bloqueados por un ``Horario`` no disponible} entre ``desde`` y ``hasta``"""
+    return _bloqueos_por_dia(desde, hasta, _bloqueos(desde, hasta))
+
+
+def _armar_ocupacion(desde, hasta, reservas, bloqueos):
+    ocupacion = _bloqueos_por_dia(desde, hasta, bloqueos)
+    indice = IndiceIntervalos(reservas)
+    if not len(indice):
+        return ocupacion
+    for fecha in ocupacion:
+        for turno in range(TOTAL_TURNOS):
+            inicio = inicio_turno(fecha, turno)
+            if indice.simultaneos(inicio, inicio + DURACION_TURNO) >= settings.CAPACIDAD_SALA:
+                ocupacion[fecha] |= 1 << turno
+    return ocupacion
+
+
+def _calcular_ocupacion(desde, hasta):
+    """Calcula la ocupación de todos los días entre ``desde`` y ``hasta`` (inclusive)"""
+    reservas, bloqueos = _consultas_ocupacion(desde, hasta)
+    return _armar_ocupacion(desde, hasta, reservas, bloqueos)
+
+
+async def _acalcular_ocupacion(desde, hasta):
+    reservas, bloqueos = _consultas_ocupacion(desde, hasta)
+    return _armar_ocupacion(
+        desde, hasta,
+        [fecha_hora async for fecha_hora in reservas],
+        [bloqueo async for bloqueo in bloqueos]
+    )
+
+
+def _claves_rango(desde, hasta):
+    fechas = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+    return {clave_cache(fecha): fecha for fecha in fechas}
+
+
+def ocupacion(desde, hasta):
+    """Devuelve {fecha: bitmap de turnos ocupados}, leyendo de cache los días ya calculados"""
+    claves = _claves_rango(desde, hasta)
+    resultado = {claves[clave]: valor for clave, valor in cache.get_many(list(claves)).items()}
+    faltantes = [fecha for fecha in claves.values() if fecha not in resultado]
+    if faltantes:
+        # Una sola pasada sobre la base de datos para todos los días que faltan
+        calculadas = _calcular_ocupacion(min(faltantes), max(faltantes))
+        nuevas = {fecha: calculadas[fecha] for fecha in faltantes}
+        cache.set_many({clave_cache(fecha): valor for fecha, valor in nuevas.items()}, _cache_timeout())
+        resultado.update(nuevas)
+    return resultado
+
+
+async def aocupacion(desde, hasta):
+    """Versión asíncrona de ``ocupacion`` para las vistas ASGI"""
+    claves = _claves_rango(desde, hasta)
+    resultado = {claves[clave]: valor for clave, valor in (await cache.aget_many(list(claves))).items()}
+    faltantes = [fecha for fecha in claves.values() if fecha not in resultado]
+    if faltantes:
+        calculadas = await _acalcular_ocupacion(min(faltantes), max(faltantes))
+        nuevas = {fecha: calculadas[fecha] for fecha in faltantes}
+        await cache.aset_many({clave_cache(fecha): valor for fecha, valor in nuevas.items()}, _cache_timeout())
+        resultado.update(nuevas)
+    return resultado
+
+
+def _libres(ocupados, ahora):
+    return {
+        fecha: mascara_vigencia(fecha, ahora) & ~ocupado & GRILLA_COMPLETA
+        for fecha, ocupado in sorted(ocupados.items())
+    }
+
+
+def disponibilidad(desde, hasta, ahora=None):
+    """Devuelve {fecha: bitmap de turnos libres} para el rango pedido"""
+    return _libres(ocupacion(desde, hasta), ahora or timezone.now())
+
+
+async def adisponibilidad(desde, hasta, ahora=None):
+    return _libres(await aocupacion(desde, hasta), ahora or timezone.now())
+
+
+def disponibilidad_servicio(servicio, desde, hasta, ahora=None):
+    """Devuelve {fecha: bitmap de turnos en los que puede empezar una reserva de ``servicio``}.
+
+    Tiene en cuenta la duración y la capacidad del servicio y de la sala: una
+    consulta para las reservas del rango, otra para los bloqueos y el resto en
+    memoria. No usa la cache de ocupación, que no depende del servicio.
+    """
+    ahora = ahora or timezone.now()
+    duracion = timedelta(minutes=servicio.duracion)
+    inicio, fin = _rango_dias(desde, hasta)
+    # Las reservas que empiezan a última hora pueden terminar al día siguiente
+    indice = IndiceIntervalos(activas_en([(inicio, fin + duracion)]))
+    bloqueados = turnos_bloqueados(desde, hasta)
+    libres = {}
+    for fecha, bloqueado in sorted(bloqueados.items()):
+        vigentes = mascara_vigencia(fecha, ahora) & ~bloqueado
+        bitmap = 0
+        for turno in range(TOTAL_TURNOS):
+            if not vigentes >> turno & 1:
+                continue
+            empieza = inicio_turno(fecha, turno)
+            termina = empieza + duracion
+            if not mascara_intervalo(empieza, termina) & bloqueado and admite(indice, servicio, empieza, termina):
+                bitmap |= 1 << turno
+        libres[fecha] = bitmap
+    return libres
+
+
+def invalidar(fechas):
+    """Descarta la ocupación en cache de los días indicados (acepta date o datetime)"""
+    claves = set()
+    for fecha in fechas:
+        if isinstance(fecha, datetime):
+            fecha = timezone.localtime(fecha).date()
+        claves.add(clave_cache(fecha))
+    if claves:
+        claves = list(claves)
+        cache.delete_many(claves)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: cache.delete_many(claves))
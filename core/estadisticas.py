@@ -0,0 +1,225 @@
+"""Estadísticas de reservas por usuario para el perfil.
+
+Cada cambio en una reserva se aplica como una diferencia sobre la fila de
+``EstadisticaUsuario`` dentro de la misma transacción, así el perfil lee una
+sola fila en lugar de recorrer todo el historial. ``recalcular`` reconstruye
+la fila desde cero cuando no existe o no se puede aplicar la diferencia.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Min, Value, When
+from django.utils import timezone
+
+from .models import EstadisticaUsuario, Reserva, Servicio
+
+ESTADOS_ACTIVOS = (1, 2)
+CAMPOS_ESTADO = {
+    1: 'reservas_pendientes',
+    2: 'reservas_confirmadas',
+    3: 'reservas_canceladas',
+}
+CAMPOS_DATOS = ('usuario_id', 'servicio_id', 'estado_reserva_id', 'fecha_hora')
+CANTIDAD_FAVORITOS = 3
+
+
+def datos_reserva(reserva):
+    return {campo: getattr(reserva, campo) for campo in CAMPOS_DATOS}
+
+
+def _proxima(usuario_id, ahora):
+    return Reserva.objects.filter(
+        usuario_id=usuario_id,
+        fecha_hora__gte=ahora,
+        estado_reserva_id__in=ESTADOS_ACTIVOS
+    ).order_by('fecha_hora', 'id').values_list('id', 'fecha_hora').first() or (None, None)
+
+
+def _estadistica_desde_conteos(usuario_id, por_estado, por_servicio, proxima):
+    estadistica = EstadisticaUsuario(
+        usuario_id=usuario_id,
+        total_reservas=sum(por_estado.values()),
+        reservas_por_servicio={str(servicio_id): n for servicio_id, n in por_servicio.items() if n},
+    )
+    for estado_id, campo in CAMPOS_ESTADO.items():
+        setattr(estadistica, campo, por_estado.get(estado_id, 0))
+    estadistica.proxima_reserva_id, estadistica.proxima_fecha_hora = proxima
+    return estadistica
+
+
+def recalcular(usuario_id, ahora=None):
+    """Reconstruye la estadística de un usuario a partir de sus reservas"""
+    ahora = ahora or timezone.now()
+    reservas = Reserva.objects.filter(usuario_id=usuario_id).order_by()
+    por_estado = dict(reservas.values_list('estado_reserva_id').annotate(n=Count('id')))
+    por_servicio = dict(reservas.values_list('servicio_id').annotate(n=Count('id')))
+    estadistica = _estadistica_desde_conteos(usuario_id, por_estado, por_servicio, _proxima(usuario_id, ahora))
+    estadistica.save()
+    return estadistica
+
+
+def recalcular_todos(tamano_lote=1000):
+    """Reconstruye las estadísticas de todos los usuarios con consultas agrupadas"""
+    ahora = timezone.now()
+    reservas = Reserva.objects.order_by()
+    por_estado = defaultdict(dict)
+    for usuario_id, estado_id, n in reservas.values_list('usuario_id', 'estado_reserva_id').annotate(n=Count('id')):
+        por_estado[usuario_id][estado_id] = n
+    por_servicio = defaultdict(dict)
+    for usuario_id, servicio_id, n in reservas.values_list('usuario_id', 'servicio_id').annotate(n=Count('id')):
+        por_servicio[usuario_id][servicio_id] = n
+    primeras = reservas.filter(
+        fecha_hora__gte=ahora, estado_reserva_id__in=ESTADOS_ACTIVOS
+    ).values_list('usuario_id').annotate(primera=Min('fecha_hora'))
+    proximas = dict(primeras)
+    # Con capacidad mayor que 1 varias reservas activas (de distintos usuarios o
+    # del mismo) comparten fecha_hora: la clave es (usuario, fecha_hora) y
+    # desempata el menor id, como en _proxima
+    ids_proximas = {
+        (usuario_id, fecha_hora): reserva_id
+        for usuario_id, fecha_hora, reserva_id in reservas.filter(
+            fecha_hora__in=list(set(proximas.values())), estado_reserva_id__in=ESTADOS_ACTIVOS
+        ).values_list('usuario_id', 'fecha_hora').annotate(primera=Min('id'))
+    }
+
+    estadisticas = [
+        _estadistica_desde_conteos(
+            usuario_id,
+            por_estado[usuario_id],
+            por_servicio[usuario_id],
+            (ids_proximas.get((usuario_id, proximas.get(usuario_id))), proximas.get(usuario_id))
+        )
+        for usuario_id in por_estado
+    ]
+    with transaction.atomic():
+        EstadisticaUsuario.objects.all().delete()
+        EstadisticaUsuario.objects.bulk_create(estadisticas, batch_size=tamano_lote)
+    return len(estadisticas)
+
+
+def _aplicar(estadistica, datos, signo):
+    estadistica.total_reservas += signo
+    campo = CAMPOS_ESTADO.get(datos['estado_reserva_id'])
+    if campo:
+        setattr(estadistica, campo, getattr(estadistica, campo) + signo)
+    por_servicio = Counter(estadistica.reservas_por_servicio)
+    por_servicio[str(datos['servicio_id'])] += signo
+    estadistica.reservas_por_servicio = {k: v for k, v in por_servicio.items() if v > 0}
+
+
+def _es_proxima(datos, ahora):
+    return datos['estado_reserva_id'] in ESTADOS_ACTIVOS and datos['fecha_hora'] >= ahora
+
+
+def registrar_cambios(cambios):
+    """Aplica una lista de cambios ``(anterior, actual, reserva_id)``.
+
+    ``anterior`` y ``actual`` son los datos de la reserva antes y después del
+    cambio (``None`` si no existía o se borró). Se bloquea una vez la fila de
+    cada usuario afectado y se guarda con todas sus diferencias aplicadas.
+    """
+    ahora = timezone.now()
+    por_usuario = defaultdict(list)
+    for anterior, actual, reserva_id in cambios:
+        for usuario_id in {datos['usuario_id'] for datos in (anterior, actual) if datos}:
+            por_usuario[usuario_id].append((
+                anterior if anterior and anterior['usuario_id'] == usuario_id else None,
+                actual if actual and actual['usuario_id'] == usuario_id else None,
+                reserva_id
+            ))
+
+    with transaction.atomic():
+        for usuario_id, cambios_usuario in por_usuario.items():
+            estadistica = EstadisticaUsuario.objects.select_for_update().filter(usuario_id=usuario_id).first()
+            if estadistica is None:
+                # Sin fila previa no hay base para la diferencia: se calcula completa
+                recalcular(usuario_id, ahora)
+                continue
+            buscar_proxima = False
+            for anterior, actual, reserva_id in cambios_usuario:
+                if anterior:
+                    _aplicar(estadistica, anterior, -1)
+                if actual:
+                    _aplicar(estadistica, actual, 1)
+                if estadistica.proxima_reserva_id == reserva_id:
+                    # La próxima reserva cambió o se borró: hay que buscar la siguiente
+                    buscar_proxima = True
+                elif actual and _es_proxima(actual, ahora) and (
+                        estadistica.proxima_fecha_hora is None
+                        or actual['fecha_hora'] < estadistica.proxima_fecha_hora):
+                    estadistica.proxima_reserva_id = reserva_id
+                    estadistica.proxima_fecha_hora = actual['fecha_hora']
+            if buscar_proxima:
+                estadistica.proxima_reserva_id, estadistica.proxima_fecha_hora = _proxima(usuario_id, ahora)
+            estadistica.save()
+
+
+def registrar_cambios_de_estado(reservas, estado_nuevo):
+    """Versión agrupada de ``registrar_cambios`` para pasar muchas reservas a ``estado_nuevo``.
+
+    ``reservas`` son dicts con ``id``, ``usuario_id`` y ``estado_reserva_id``.
+    Los contadores de todos los usuarios se ajustan con un único UPDATE; solo
+    se vuelve a buscar la próxima reserva de quienes la tenían entre las
+    cambiadas. Llamar dentro de la transacción que cambia las reservas.
+    """
+    ahora = timezone.now()
+    deltas = defaultdict(Counter)
+    for reserva in reservas:
+        if reserva['estado_reserva_id'] == estado_nuevo:
+            continue
+        for estado_id, signo in ((reserva['estado_reserva_id'], -1), (estado_nuevo, 1)):
+            if estado_id in CAMPOS_ESTADO:
+                deltas[CAMPOS_ESTADO[estado_id]][reserva['usuario_id']] += signo
+    usuarios = {reserva['usuario_id'] for reserva in reservas}
+    if not usuarios:
+        return
+
+    def ajuste(por_usuario):
+        # Un WHEN por valor de la diferencia, no por usuario
+        usuarios_por_delta = defaultdict(list)
+        for usuario_id, delta in por_usuario.items():
+            usuarios_por_delta[delta].append(usuario_id)
+        return Case(
+            *(When(usuario_id__in=ids, then=Value(delta)) for delta, ids in usuarios_por_delta.items() if delta),
+            default=Value(0),
+        )
+
+    estadisticas = EstadisticaUsuario.objects.filter(usuario_id__in=usuarios)
+    estadisticas.update(actualizada=ahora, **{
+        campo: F(campo) + ajuste(por_usuario) for campo, por_usuario in deltas.items()
+    })
+    for usuario_id in usuarios - set(estadisticas.values_list('usuario_id', flat=True)):
+        recalcular(usuario_id, ahora)
+    for estadistica in EstadisticaUsuario.objects.filter(proxima_reserva_id__in=[r['id'] for r in reservas]):
+        estadistica.proxima_reserva_id, estadistica.proxima_fecha_hora = _proxima(estadistica.usuario_id, ahora)
+        estadistica.save(update_fields=['proxima_reserva', 'proxima_fecha_hora', 'actualizada'])
+
+
+def registrar_cambio(anterior, actual, reserva_id):
+    registrar_cambios([(anterior, actual, reserva_id)])
+
+
+def obtener(usuario, ahora=None):
+    """Devuelve la estadística del usuario, creándola o refrescando la próxima reserva si hace falta"""
+    ahora = ahora or timezone.now()
+    estadistica = EstadisticaUsuario.objects.filter(usuario=usuario).first()
+    if estadistica is None:
+        return recalcular(usuario.pk, ahora)
+    if estadistica.proxima_fecha_hora is not None and estadistica.proxima_fecha_hora < ahora:
+        # La próxima reserva ya pasó
+        estadistica.proxima_reserva_id, estadistica.proxima_fecha_hora = _proxima(usuario.pk, ahora)
+        estadistica.save(update_fields=['proxima_reserva', 'proxima_fecha_hora', 'actualizada'])
+    return estadistica
+
+
+def servicios_favoritos(estadistica, cantidad=CANTIDAD_FAVORITOS):
+    """Servicios más reservados por el usuario, con el atributo ``num_reservas``"""
+    top = Counter(estadistica.reservas_por_servicio).most_common(cantidad)
+    servicios = Servicio.objects.in_bulk([int(servicio_id) for servicio_id, _ in top])
+    favoritos = []
+    for servicio_id, n in top:
+        servicio = servicios.get(int(servicio_id))
+        if servicio is not None:
+            servicio.num_reservas = n
+            favoritos.append(servicio)
+    return favoritos
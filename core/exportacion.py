@@ -0,0 +1,96 @@
+"""Exportación de reservas en CSV o NDJSON por streaming.
+
+Las filas se leen con ``QuerySet.iterator`` en bloques y se escriben a la
+respuesta a medida que se generan, así el worker nunca tiene en memoria más
+que un bloque, sin importar cuántos años abarque la exportación. El estado
+sale del cache de catálogos en lugar de un JOIN más.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import catalogos
+from .models import EstadoReserva, Reserva
+
+TAMANO_BLOQUE = 2000
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+COLUMNAS = (
+    'id', 'fecha_hora', 'estado', 'servicio_id', 'servicio', 'precio',
+    'duracion', 'usuario_id', 'usuario', 'email', 'creada'
+)
+
+
+class FiltroInvalido(ValueError):
+    pass
+
+
+def filtrar(reservas, desde=None, hasta=None, servicio=None):
+    """Aplica los filtros de la exportación (fechas AAAA-MM-DD inclusive e id de servicio)"""
+    try:
+        if desde:
+            inicio = datetime.combine(datetime.strptime(desde, '%Y-%m-%d').date(), time.min)
+            reservas = reservas.filter(fecha_hora__gte=timezone.make_aware(inicio))
+        if hasta:
+            fin = datetime.combine(datetime.strptime(hasta, '%Y-%m-%d').date() + timedelta(days=1), time.min)
+            reservas = reservas.filter(fecha_hora__lt=timezone.make_aware(fin))
+    except ValueError:
+        raise FiltroInvalido('Las fechas deben tener el formato AAAA-MM-DD')
+    if servicio:
+        try:
+            reservas = reservas.filter(servicio_id=int(servicio))
+        except ValueError:
+            raise FiltroInvalido('El servicio debe ser un id numérico')
+    return reservas
+
+
+def filas(reservas):
+    """Genera un dict por reserva leyendo la base en bloques de ``TAMANO_BLOQUE``"""
+    reservas = reservas.select_related('usuario', 'servicio').order_by('fecha_hora', 'id')
+    for reserva in reservas.iterator(chunk_size=TAMANO_BLOQUE):
+        yield {
+            'id': reserva.id,
+            'fecha_hora': timezone.localtime(reserva.fecha_hora).isoformat(),
+            'estado': catalogos.nombre(EstadoReserva, reserva.estado_reserva_id),
+            'servicio_id': reserva.servicio_id,
+            'servicio': reserva.servicio.nombre,
+            'precio': str(reserva.servicio.precio),
+            'duracion': reserva.servicio.duracion,
+            'usuario_id': reserva.usuario_id,
+            'usuario': reserva.usuario.username,
+            'email': reserva.usuario.email,
+            'creada': timezone.localtime(reserva.creada).isoformat(),
+        }
+
+
+class _Eco:
+    """Objeto tipo archivo que devuelve lo escrito, para usar csv.writer sin buffer"""
+
+    def write(self, valor):
+        return valor
+
+
+def _csv(reservas):
+    escritor = csv.DictWriter(_Eco(), fieldnames=COLUMNAS)
+    # La marca BOM hace que Excel abra el archivo como UTF-8
+    yield '\ufeff' + escritor.writeheader()
+    for fila in filas(reservas):
+        yield escritor.writerow(fila)
+
+
+def _ndjson(reservas):
+    for fila in filas(reservas):
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
+
+
+def respuesta(reservas, formato='csv'):
+    generador = _csv if formato == 'csv' else _ndjson
+    nombre = f'reservas_{timezone.localdate():%Y%m%d}.{formato}'
+    respuesta = StreamingHttpResponse(generador(reservas), content_type=FORMATOS[formato])
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return respuesta
@@ -1,3 +1,5 @@
+from datetime import date
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from .models import Usuario,TipoUsuario
@@ -21,4 +23,20 @@ class UserRegistrationForm(UserCreationForm):
         # Personalizar las etiquetas
         self.fields['username'].label = 'Nombre de usuario'
         self.fields['password1'].label = 'Contraseña'
-        self.fields['password2'].label = 'Confirmar contraseña'
\ No newline at end of file
+        self.fields['password2'].label = 'Confirmar contraseña'
+
+class RepetirHorariosForm(forms.Form):
+    hasta = forms.DateField(label='Repetir hasta', widget=forms.DateInput(attrs={'type': 'date'}))
+    excepciones = forms.CharField(
+        label='Fechas sin atención', required=False, widget=forms.Textarea(attrs={'rows': 3}),
+        help_text='Feriados u otros días a omitir, en formato AAAA-MM-DD separados por comas o líneas.'
+    )
+
+    def clean_excepciones(self):
+        fechas = []
+        for valor in self.cleaned_data['excepciones'].replace(',', '\n').split():
+            try:
+                fechas.append(date.fromisoformat(valor))
+            except ValueError:
+                raise forms.ValidationError(f'Fecha inválida: {valor}')
+        return fechas
@@ -0,0 +1,130 @@
+"""Generación masiva de ``Horario`` a partir de una plantilla semanal.
+
+La plantilla dice qué días de la semana se atiende y en qué rangos de horas;
+cada rango se parte en turnos de ``duracion`` minutos. Las filas se insertan
+con ``bulk_create(update_conflicts=True)`` sobre la restricción única
+``(fecha, hora_inicio)``, así que volver a generar el mismo período no crea
+duplicados: los turnos existentes solo se actualizan si cambió su hora de
+fin y conservan su estado (un bloqueo cargado a mano sigue bloqueado).
+"""
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from . import disponibilidad
+from .models import Horario
+
+DIAS_SEMANA = ('lun', 'mar', 'mie', 'jue', 'vie', 'sab', 'dom')
+ESTADO_DISPONIBLE = 1
+TAMANO_LOTE = 1000
+
+
+def parsear_dias(texto):
+    """``'lun-vie'``, ``'lun,mie,vie'`` o números (0 = lunes) a un conjunto de weekday()"""
+    def dia(valor):
+        valor = valor.strip().lower()
+        if valor.isdigit() and int(valor) < 7:
+            return int(valor)
+        if valor[:3] in DIAS_SEMANA:
+            return DIAS_SEMANA.index(valor[:3])
+        raise ValueError(f'Día de la semana inválido: {valor!r}')
+
+    dias = set()
+    for parte in texto.split(','):
+        if '-' in parte:
+            desde, hasta = (dia(valor) for valor in parte.split('-', 1))
+            if desde > hasta:
+                raise ValueError(f'Rango de días inválido: {parte!r}')
+            dias.update(range(desde, hasta + 1))
+        else:
+            dias.add(dia(parte))
+    return dias
+
+
+def parsear_rangos(texto):
+    """``'08:00-12:00,14:00-18:00'`` a una lista de pares (time, time)"""
+    rangos = []
+    for parte in texto.split(','):
+        try:
+            inicio, fin = (time.fromisoformat(valor.strip()) for valor in parte.split('-'))
+        except ValueError:
+            raise ValueError(f'Rango de horas inválido: {parte!r} (usar HH:MM-HH:MM)')
+        if inicio >= fin:
+            raise ValueError(f'El rango {parte!r} termina antes de empezar')
+        rangos.append((inicio, fin))
+    return rangos
+
+
+def turnos_del_dia(rangos, duracion):
+    """Pares (inicio, fin) de cada turno que cabe completo en los rangos"""
+    paso = timedelta(minutes=duracion)
+    turnos = []
+    for inicio, fin in rangos:
+        actual = datetime.combine(datetime.min, inicio)
+        limite = datetime.combine(datetime.min, fin)
+        while actual + paso <= limite:
+            turnos.append((actual.time(), (actual + paso).time()))
+            actual += paso
+    return turnos
+
+
+def expandir(desde, hasta, plantilla, excepciones=()):
+    """Horarios sin guardar entre ``desde`` y ``hasta`` inclusive.
+
+    ``plantilla`` asocia cada weekday() a su lista de turnos (inicio, fin).
+    """
+    excepciones = set(excepciones)
+    fecha = desde
+    while fecha <= hasta:
+        if fecha not in excepciones:
+            for inicio, fin in plantilla.get(fecha.weekday(), ()):
+                yield Horario(fecha=fecha, hora_inicio=inicio, hora_fin=fin, estado_horario_id=ESTADO_DISPONIBLE)
+        fecha += timedelta(days=1)
+
+
+def plantilla_semanal(dias, rangos, duracion):
+    turnos = turnos_del_dia(rangos, duracion)
+    return {dia: turnos for dia in dias}
+
+
+def guardar(horarios, tamano_lote=TAMANO_LOTE):
+    """Inserta o actualiza los horarios por lotes; devuelve (creados, actualizados, sin_cambios)"""
+    creados = actualizados = sin_cambios = 0
+    horarios = iter(horarios)
+    while lote := list(islice(horarios, tamano_lote)):
+        fechas = {horario.fecha for horario in lote}
+        existentes = {
+            (fecha, inicio): fin for fecha, inicio, fin in Horario.objects.filter(
+                fecha__range=(min(fechas), max(fechas))
+            ).values_list('fecha', 'hora_inicio', 'hora_fin')
+        }
+        cambios = []
+        for horario in lote:
+            fin = existentes.get((horario.fecha, horario.hora_inicio))
+            if fin is None:
+                creados += 1
+            elif fin != horario.hora_fin:
+                actualizados += 1
+            else:
+                sin_cambios += 1
+                continue
+            cambios.append(horario)
+        if cambios:
+            # El conflicto cubre también filas creadas por otro proceso entre la lectura y la inserción
+            Horario.objects.bulk_create(
+                cambios,
+                update_conflicts=True,
+                unique_fields=['fecha', 'hora_inicio'],
+                update_fields=['hora_fin', 'actualizado'],
+            )
+            # bulk_create no dispara post_save: descartar la ocupación en cache de esos días
+            disponibilidad.invalidar({horario.fecha for horario in cambios})
+    return creados, actualizados, sin_cambios
+
+
+def generar(desde, hasta, dias, rangos, duracion, excepciones=(), tamano_lote=TAMANO_LOTE):
+    if desde > hasta:
+        raise ValueError('La fecha de inicio es posterior a la de fin')
+    if duracion <= 0:
+        raise ValueError('La duración del turno debe ser positiva')
+    plantilla = plantilla_semanal(dias, rangos, duracion)
+    return guardar(expandir(desde, hasta, plantilla, excepciones), tamano_lote)
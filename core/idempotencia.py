@@ -0,0 +1,86 @@
+"""Soporte de la cabecera ``Idempotency-Key`` para las vistas que crean reservas.
+
+La primera respuesta (que no sea un error 5xx) se guarda junto con los cambios
+de la vista en la misma transacción. Si el cliente reintenta con la misma
+clave, se devuelve la respuesta guardada sin volver a ejecutar la vista.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.db import transaction, IntegrityError
+from django.http import HttpResponse, JsonResponse
+
+from .models import ClaveIdempotencia
+
+CABECERA = 'Idempotency-Key'
+TIPOS_FORMULARIO = ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+
+class _ClaveDuplicada(Exception):
+    """Otra solicitud con la misma clave guardó su respuesta primero"""
+
+
+def _huella(request):
+    # Los formularios multipart cambian de boundary en cada envío, por eso se usan los campos
+    if request.content_type in TIPOS_FORMULARIO:
+        contenido = urlencode(sorted(request.POST.lists()), doseq=True).encode()
+    else:
+        contenido = request.body
+    huella = hashlib.sha256()
+    huella.update(f'{request.method} {request.path}\n'.encode())
+    huella.update(contenido)
+    return huella.hexdigest()
+
+
+def _repetir(previa):
+    respuesta = HttpResponse(previa.cuerpo, status=previa.estado_http, content_type=previa.content_type)
+    respuesta['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def idempotente(vista):
+    """Guarda la respuesta por (usuario, Idempotency-Key) y la repite en los reintentos"""
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        clave = request.headers.get(CABECERA)
+        if not clave or not request.user.is_authenticated:
+            return vista(request, *args, **kwargs)
+        if len(clave) > 255:
+            return JsonResponse({
+                'success': False,
+                'error': 'La cabecera Idempotency-Key no puede superar 255 caracteres'
+            }, status=400)
+
+        huella = _huella(request)
+        previa = ClaveIdempotencia.objects.filter(usuario=request.user, clave=clave).first()
+        if previa is None:
+            try:
+                with transaction.atomic():
+                    respuesta = vista(request, *args, **kwargs)
+                    if respuesta.status_code >= 500 or respuesta.streaming:
+                        return respuesta
+                    try:
+                        with transaction.atomic():
+                            ClaveIdempotencia.objects.create(
+                                usuario=request.user,
+                                clave=clave,
+                                huella=huella,
+                                estado_http=respuesta.status_code,
+                                content_type=respuesta.get('Content-Type', ''),
+                                cuerpo=respuesta.content.decode(respuesta.charset)
+                            )
+                    except IntegrityError:
+                        raise _ClaveDuplicada()
+                    return respuesta
+            except _ClaveDuplicada:
+                # Se descartan los cambios de esta solicitud y se repite la que ganó
+                previa = ClaveIdempotencia.objects.get(usuario=request.user, clave=clave)
+
+        if previa.huella != huella:
+            return JsonResponse({
+                'success': False,
+                'error': 'La Idempotency-Key ya se usó con una solicitud distinta'
+            }, status=422)
+        return _repetir(previa)
+    return envoltura
@@ -0,0 +1,97 @@
+"""Índice en memoria de intervalos ``[inicio, fin)`` para detectar superposiciones.
+
+Los intervalos se guardan ordenados por inicio. Como ninguno dura más que
+el más largo del índice, los que pueden superponerse con ``[inicio, fin)``
+son los que empiezan entre ``inicio - duración máxima`` y ``fin``: dos
+búsquedas binarias encuentran ese tramo.
+
+Para contar cuántos coinciden, el índice arma la primera vez que se lo
+pide un perfil por ``clave`` (y otro con todos): los instantes en que
+empieza o termina algún intervalo y cuántos hay activos desde cada uno hasta
+el siguiente. El máximo en ``[inicio, fin)`` son dos búsquedas binarias y
+los pocos tramos del medio, y ``agregar`` actualiza los perfiles ya armados
+sin rehacerlos. Con la consulta por rango de ``disponibilidad.activas_en``
+alcanza para responder la disponibilidad de todos los turnos de una semana,
+o planificar miles de reservas, sin volver a la base.
+
+Cada intervalo lleva una ``cantidad``: las reservas con el mismo inicio, fin
+y servicio llegan agrupadas desde la base, así que el tamaño del índice
+crece con los turnos y servicios distintos, no con las reservas.
+"""
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import timedelta
+from operator import itemgetter
+
+_inicio = itemgetter(0)
+
+
+def _sumar(perfil, inicio, fin, cantidad):
+    instantes, activos = perfil
+    for instante in (inicio, fin):
+        posicion = bisect_left(instantes, instante)
+        if posicion == len(instantes) or instantes[posicion] != instante:
+            # El nuevo instante parte un tramo: empieza con los activos de ese tramo
+            instantes.insert(posicion, instante)
+            activos.insert(posicion, activos[posicion - 1] if posicion else 0)
+    for posicion in range(bisect_left(instantes, inicio), bisect_left(instantes, fin)):
+        activos[posicion] += cantidad
+
+
+class IndiceIntervalos:
+    """Intervalos ``(inicio, fin, clave, cantidad)``; ``clave`` agrupa los que comparten capacidad (el servicio)"""
+
+    def __init__(self, intervalos=()):
+        self._intervalos = sorted(intervalos, key=_inicio)
+        self._inicios = [intervalo[0] for intervalo in self._intervalos]
+        self._duracion_maxima = max((fin - inicio for inicio, fin, _, _ in self._intervalos), default=timedelta(0))
+        self._perfiles = {}
+
+    def __len__(self):
+        return len(self._intervalos)
+
+    def agregar(self, inicio, fin, clave=None, cantidad=1):
+        for perfil in (self._perfiles.get(None), self._perfiles.get(clave) if clave is not None else None):
+            if perfil is not None:
+                _sumar(perfil, inicio, fin, cantidad)
+        desde = bisect_left(self._inicios, inicio)
+        hasta = bisect_right(self._inicios, inicio)
+        for posicion in range(desde, hasta):
+            _, otro_fin, otra_clave, otra_cantidad = self._intervalos[posicion]
+            if otro_fin == fin and otra_clave == clave:
+                # El mismo intervalo ya está: solo crece su cantidad
+                self._intervalos[posicion] = (inicio, fin, clave, otra_cantidad + cantidad)
+                return
+        self._intervalos.insert(hasta, (inicio, fin, clave, cantidad))
+        self._inicios.insert(hasta, inicio)
+        self._duracion_maxima = max(self._duracion_maxima, fin - inicio)
+
+    def solapados(self, inicio, fin):
+        """Intervalos que comparten algún instante con ``[inicio, fin)``"""
+        desde = bisect_right(self._inicios, inicio - self._duracion_maxima)
+        hasta = bisect_left(self._inicios, fin)
+        return [intervalo for intervalo in self._intervalos[desde:hasta] if intervalo[1] > inicio]
+
+    def _perfil(self, clave):
+        """``(instantes, activos)``: ``activos[i]`` intervalos de ``clave`` desde ``instantes[i]`` hasta el siguiente"""
+        if clave not in self._perfiles:
+            cambios = Counter()
+            for inicio, fin, otra_clave, cantidad in self._intervalos:
+                if clave is None or otra_clave == clave:
+                    cambios[inicio] += cantidad
+                    cambios[fin] -= cantidad
+            # Un intervalo que termina cuando otro empieza se compensa en el mismo instante: no se superponen
+            instantes = sorted(cambios)
+            activos = []
+            actuales = 0
+            for instante in instantes:
+                actuales += cambios[instante]
+                activos.append(actuales)
+            self._perfiles[clave] = (instantes, activos)
+        return self._perfiles[clave]
+
+    def simultaneos(self, inicio, fin, clave=None):
+        """Máximo de intervalos (de ``clave``, si se indica) que coinciden en un mismo instante de ``[inicio, fin)``"""
+        instantes, activos = self._perfil(clave)
+        desde = max(bisect_right(instantes, inicio) - 1, 0)
+        return max(activos[desde:bisect_left(instantes, fin)], default=0)
@@ -0,0 +1,113 @@
+"""Límite de intentos de login y registro con token buckets en la cache.
+
+Cada POST a esas vistas toma una ficha de varios baldes: el de la IP y el del
+nombre de usuario (login). El balde ``contrasenas``, común a todo el sitio,
+acota cuántos hashes de contraseña se calculan por minuto aunque el ataque
+venga de muchas IPs; viene desactivado porque quien lo vacíe deja a todos sin
+poder entrar, y solo se toma de él cuando la vista llegaría a calcular un hash.
+Los baldes se recargan de a poco hasta su ráfaga (``settings.LIMITES_INTENTOS``).
+Si alguno está vacío la solicitud se rechaza con 429 y ``Retry-After`` antes
+de ejecutar la vista, así ``authenticate`` y la validación del formulario no
+llegan a correr.
+
+El estado de cada balde es ``(fichas, instante)`` en la cache. La lectura y la
+escritura no son atómicas: dos solicitudes simultáneas pueden pasar con la
+misma ficha, lo que no importa para frenar una inundación. Con ``locmem`` cada
+worker tiene sus propios baldes.
+"""
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+PREFIJO = 'limite'
+# Baldes que se aplican a cada vista, además del de la IP
+BALDES = {
+    'login': ['login_ip', 'login_usuario', 'contrasenas'],
+    'registro': ['registro_ip', 'contrasenas'],
+}
+
+
+def ip_cliente(request):
+    """IP del cliente; detrás de un proxy, la última de ``settings.IP_CLIENTE_CABECERA``"""
+    cabecera = settings.IP_CLIENTE_CABECERA
+    if cabecera and request.META.get(cabecera):
+        # El proxy agrega al final la IP que ve; las anteriores las puede inventar el cliente
+        return request.META[cabecera].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _sufijo(valor):
+    # Un valor elegido por el cliente no se usa tal cual como clave de cache
+    return hashlib.sha256(valor.strip().lower().encode()).hexdigest()[:32]
+
+
+def calcula_hash(request, accion):
+    """Si la vista calcularía un hash de contraseña con los datos de este POST"""
+    datos = request.POST
+    if accion == 'login':
+        # authenticate no busca al usuario ni hashea si falta alguno de los dos
+        return 'username' in datos and 'password' in datos
+    # El registro solo hashea al guardar un formulario válido
+    return bool(datos.get('password1')) and datos.get('password1') == datos.get('password2')
+
+
+def baldes(request, accion):
+    """Claves de cache y límites ``(ráfaga, por minuto)`` de ``accion`` para esta solicitud"""
+    sufijos = {
+        'login_ip': ip_cliente(request),
+        'registro_ip': ip_cliente(request),
+        'login_usuario': _sufijo(request.POST.get('username', '')),
+        'contrasenas': 'sitio',
+    }
+    return [
+        (f'{PREFIJO}:{nombre}:{sufijos[nombre]}', settings.LIMITES_INTENTOS[nombre])
+        for nombre in BALDES[accion]
+        if settings.LIMITES_INTENTOS.get(nombre) and (nombre != 'contrasenas' or calcula_hash(request, accion))
+    ]
+
+
+def consumir(limites, ahora=None):
+    """Toma una ficha de cada balde si todos tienen; si no, no toma ninguna.
+
+    Devuelve 0 si la solicitud puede seguir o los segundos hasta que haya
+    fichas en todos los baldes.
+    """
+    if not limites:
+        return 0
+    ahora = time.time() if ahora is None else ahora
+    guardados = cache.get_many([clave for clave, _ in limites])
+    restantes = {}
+    espera = 0
+    for clave, (rafaga, por_minuto) in limites:
+        fichas, instante = guardados.get(clave, (rafaga, ahora))
+        fichas = min(rafaga, fichas + max(0, ahora - instante) * por_minuto / 60)
+        if fichas < 1:
+            espera = max(espera, (1 - fichas) * 60 / por_minuto)
+        restantes[clave] = (fichas - 1, ahora)
+    if espera:
+        return espera
+    # Al vencer, el balde ya estaría lleno: la falta de la clave equivale a la ráfaga completa
+    vencimiento = max(rafaga * 60 / por_minuto for _, (rafaga, por_minuto) in limites)
+    cache.set_many(restantes, math.ceil(vencimiento))
+    return 0
+
+
+def limitar_intentos(accion, plantilla):
+    """Rechaza con 429 los POST que superan los límites de ``accion`` antes de ejecutar la vista"""
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if request.method == 'POST':
+                espera = math.ceil(consumir(baldes(request, accion)))
+                if espera:
+                    respuesta = render(request, plantilla, {'espera': espera}, status=429)
+                    respuesta['Retry-After'] = str(espera)
+                    return respuesta
+            return vista(request, *args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,210 @@
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core import carga, catalogos, disponibilidad, estadisticas, resumenes
+from core.models import Horario, Reserva, Servicio, Usuario
+
+PREFIJO = 'bench_'
+CLAVE = 'benchmark-clave-123'
+ESTADO_CONFIRMADO = 2
+ESTADO_CANCELADO = 3
+
+
+def _en_lotes(objetos, tamano):
+    objetos = iter(objetos)
+    while lote := list(islice(objetos, tamano)):
+        yield lote
+
+
+def turnos_historicos(dias):
+    """Inicio de cada turno hábil desde hace ``dias`` días hasta ayer, del más viejo al más nuevo"""
+    hoy = timezone.localdate()
+    for atras in range(dias, 0, -1):
+        fecha = hoy - timedelta(days=atras)
+        if fecha.weekday() < 5:
+            for indice in range(disponibilidad.TOTAL_TURNOS):
+                yield disponibilidad.inicio_turno(fecha, indice)
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra un conjunto de datos con bulk_create y mide latencia (p50/p95/p99), '
+        'solicitudes por segundo y consultas por solicitud de las vistas principales'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sembrar', action='store_true', help='Crear los datos antes de medir')
+        parser.add_argument('--usuarios', type=int, default=1000)
+        parser.add_argument('--servicios', type=int, default=20)
+        parser.add_argument('--reservas', type=int, default=20000)
+        parser.add_argument('--dias-historia', type=int, default=365 * 3)
+        parser.add_argument('--tamano-lote', type=int, default=5000)
+        parser.add_argument('--iteraciones', type=int, default=100, help='Solicitudes por vista')
+        parser.add_argument('--json', dest='salida', help='Guardar los resultados en este archivo')
+
+    def handle(self, *args, **options):
+        if options['sembrar']:
+            self.sembrar(options)
+        usuario = Usuario.objects.filter(username__startswith=PREFIJO, is_staff=False).order_by('id').first()
+        admin = Usuario.objects.filter(username=f'{PREFIJO}admin').first()
+        if usuario is None or admin is None:
+            raise CommandError('No hay datos de benchmark: ejecutar con --sembrar')
+
+        cache.clear()
+        catalogos.invalidar()
+        vistas = self.medir(usuario, admin, options['iteraciones'])
+        resultado = {
+            'commit': self.commit(),
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'datos': {
+                'usuarios': Usuario.objects.count(),
+                'servicios': Servicio.objects.count(),
+                'reservas': Reserva.objects.count(),
+            },
+            'iteraciones': options['iteraciones'],
+            'vistas': vistas,
+        }
+
+        self.stdout.write(f'{"vista":28} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"consultas":>9}')
+        for nombre, datos in vistas.items():
+            self.stdout.write(
+                f'{nombre:28} {datos["por_segundo"]:>8} {datos["p50_ms"]:>8} {datos["p95_ms"]:>8} '
+                f'{datos["p99_ms"]:>8} {datos["consultas_por_solicitud"]:>9}'
+            )
+        if options['salida']:
+            carga.guardar(resultado, options['salida'])
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
+
+    def sembrar(self, options):
+        lote = options['tamano_lote']
+        inicio = time.perf_counter()
+        # Hashear una sola vez: PBKDF2 por usuario dominaría el tiempo de siembra
+        clave = make_password(CLAVE)
+        Usuario.objects.get_or_create(
+            username=f'{PREFIJO}admin',
+            defaults={'password': clave, 'is_staff': True, 'is_superuser': True, 'tipo_usuario_id': 1}
+        )
+        ya_creados = Usuario.objects.filter(username__startswith=PREFIJO).count()
+        Usuario.objects.bulk_create(
+            (Usuario(username=f'{PREFIJO}{i}', password=clave, email=f'{PREFIJO}{i}@ejemplo.com')
+             for i in range(ya_creados, ya_creados + options['usuarios'])),
+            batch_size=lote
+        )
+        Servicio.objects.bulk_create([
+            Servicio(nombre=f'Servicio {i}', descripcion='Servicio de benchmark', duracion=30,
+                     precio=10000 + i * 100, estado_servicio_id=1)
+            for i in range(options['servicios'])
+        ], batch_size=lote)
+
+        usuarios = list(Usuario.objects.filter(username__startswith=PREFIJO, is_staff=False).values_list('id', flat=True))
+        # Servicios de un turno: así cada reserva activa ocupa solo su turno
+        duraciones = dict(Servicio.objects.filter(
+            estado_servicio=1, duracion__lte=disponibilidad.INTERVALO_MINUTOS
+        ).values_list('id', 'duracion'))
+        servicios = list(duraciones)
+        ocupados = set(Reserva.objects.filter(
+            estado_reserva_id__in=disponibilidad.ESTADOS_ACTIVOS
+        ).values_list('fecha_hora', flat=True))
+        turnos = list(turnos_historicos(options['dias_historia']))
+        if not turnos:
+            raise CommandError('--dias-historia debe abarcar al menos un día hábil')
+
+        def reservas():
+            # Solo una reserva activa por turno: la primera de cada turno queda confirmada,
+            # las demás canceladas (historial de cambios de agenda)
+            for i in range(options['reservas']):
+                fecha_hora = turnos[i % len(turnos)]
+                activa = i < len(turnos) and fecha_hora not in ocupados
+                servicio_id = servicios[i % len(servicios)]
+                yield Reserva(
+                    usuario_id=usuarios[i % len(usuarios)],
+                    servicio_id=servicio_id,
+                    fecha_hora=fecha_hora,
+                    fecha_fin=fecha_hora + timedelta(minutes=duraciones[servicio_id]),
+                    estado_reserva_id=ESTADO_CONFIRMADO if activa else ESTADO_CANCELADO
+                )
+
+        creadas = 0
+        for reservas_lote in _en_lotes(reservas(), lote):
+            Reserva.objects.bulk_create(reservas_lote)
+            creadas += len(reservas_lote)
+            self.stdout.write(f'\r{creadas} reservas', ending='')
+        self.stdout.write('')
+
+        hoy = timezone.localdate()
+        Horario.objects.bulk_create([
+            Horario(fecha=hoy + timedelta(days=dia), hora_inicio=datetime.min.time().replace(hour=hora),
+                    hora_fin=datetime.min.time().replace(hour=hora + 1), estado_horario_id=1)
+            for dia in range(disponibilidad.DIAS_ANTICIPACION) for hora in range(8, 18)
+        ], batch_size=lote)
+        # bulk_create no dispara señales: reconstruir las estadísticas y los resúmenes de una vez
+        estadisticas.recalcular_todos(tamano_lote=lote)
+        resumenes.reconstruir(tamano_lote=lote)
+        self.stdout.write(self.style.SUCCESS(f'Datos sembrados en {time.perf_counter() - inicio:.1f} s'))
+
+    def medir(self, usuario, admin, iteraciones):
+        cliente = Client(HTTP_HOST='localhost')
+        cliente.force_login(usuario)
+        cliente_admin = Client(HTTP_HOST='localhost')
+        cliente_admin.force_login(admin)
+
+        servicio_id = Servicio.objects.filter(estado_servicio=1).values_list('id', flat=True).first()
+        hoy = timezone.localdate()
+        libres = [
+            disponibilidad.inicio_turno(fecha, indice).isoformat()
+            for fecha, bitmap in disponibilidad.disponibilidad(hoy, hoy + timedelta(days=disponibilidad.DIAS_ANTICIPACION)).items()
+            for indice in range(disponibilidad.TOTAL_TURNOS) if bitmap >> indice & 1
+        ]
+        escenarios = {
+            'home': (cliente, 'get', reverse('home'), None),
+            'profile': (cliente, 'get', reverse('profile'), None),
+            'historial_reservas': (cliente, 'get', reverse('historial_reservas'), None),
+            'reservar': (cliente, 'get', reverse('reservar'), None),
+            # Cada POST toma un turno libre distinto; cuando se agotan se mide el 409
+            'crear_reserva_api': (cliente, 'post', reverse('crear_reserva_api', args=[servicio_id]),
+                                  lambda i: {'fecha_hora': libres[i % len(libres)]} if libres else {}),
+            'admin_reservas': (cliente_admin, 'get', reverse('admin:core_reserva_changelist'), None),
+            'admin_servicios': (cliente_admin, 'get', reverse('admin:core_servicio_changelist'), None),
+            'admin_horarios': (cliente_admin, 'get', reverse('admin:core_horario_changelist'), None),
+            'admin_usuarios': (cliente_admin, 'get', reverse('admin:core_usuario_changelist'), None),
+        }
+        resultados = {}
+        for nombre, (cliente_vista, metodo, url, datos) in escenarios.items():
+            # Una solicitud previa para calentar caches y catálogos, como un worker en marcha
+            getattr(cliente_vista, metodo)(url, datos(iteraciones) if datos else None)
+            latencias, consultas, codigos = [], 0, Counter()
+            inicio_total = time.perf_counter()
+            for i in range(iteraciones):
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    respuesta = getattr(cliente_vista, metodo)(url, datos(i) if datos else None)
+                    latencias.append(time.perf_counter() - inicio)
+                consultas += len(capturadas)
+                codigos[respuesta.status_code] += 1
+            resultados[nombre] = carga.resumen(
+                latencias, time.perf_counter() - inicio_total,
+                errores=sum(n for codigo, n in codigos.items() if codigo >= 500),
+                consultas_por_solicitud=round(consultas / iteraciones, 1),
+                codigos={str(codigo): n for codigo, n in sorted(codigos.items())},
+            )
+        return resultados
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,77 @@
+import random
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import busqueda, carga
+from core.models import Servicio
+
+PREFIJO = 'bench_'
+TIPOS = ['Masaje', 'Yoga', 'Meditación', 'Reiki', 'Acupuntura', 'Pilates', 'Reflexología', 'Aromaterapia',
+         'Curso de respiración', 'Taller de mindfulness', 'Drenaje linfático', 'Fisioterapia']
+ADJETIVOS = ['terapéutico', 'relajante', 'descontracturante', 'para principiantes', 'avanzado', 'grupal',
+             'intensivo', 'en línea', 'prenatal', 'deportivo', 'para adultos mayores', 'de fin de semana']
+RELLENO = ('sesión personalizada con profesionales certificados que trabajan la postura, la energía y el '
+           'equilibrio emocional en un ambiente tranquilo con música suave y aceites esenciales').split()
+CONSULTAS = ['masaje', 'meditacion', 'yoga prenatal', 'reflexologia avanzado', 'drenaje linf', 'taller mind',
+             'aceites esenciales', 'zzz']
+
+
+class Command(BaseCommand):
+    help = 'Compara la búsqueda de servicios con FTS5 contra icontains (LIKE) sobre un catálogo grande'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sembrar', type=int, default=0, metavar='N', help='Crear N servicios de prueba')
+        parser.add_argument('--iteraciones', type=int, default=50, help='Búsquedas por consulta y método')
+        parser.add_argument('--tamano-lote', type=int, default=5000)
+        parser.add_argument('--json', dest='salida', help='Guardar los resultados en este archivo')
+
+    def handle(self, *args, **options):
+        if options['sembrar']:
+            self.sembrar(options['sembrar'], options['tamano_lote'])
+        if not busqueda.fts_disponible():
+            raise CommandError('Esta base no tiene el índice FTS5 (solo SQLite con FTS5, después de migrate)')
+
+        metodos = {'fts': busqueda.buscar_fts, 'like': busqueda.buscar_icontains}
+        resultados = {}
+        self.stdout.write(f'{"consulta":24} {"método":6} {"p50 ms":>8} {"p95 ms":>8} {"resultados":>10}')
+        for consulta in CONSULTAS:
+            for nombre, buscar in metodos.items():
+                encontrados = len(buscar(consulta))
+                latencias = []
+                inicio_total = time.perf_counter()
+                for _ in range(options['iteraciones']):
+                    inicio = time.perf_counter()
+                    buscar(consulta)
+                    latencias.append(time.perf_counter() - inicio)
+                datos = carga.resumen(latencias, time.perf_counter() - inicio_total, resultados=encontrados)
+                resultados.setdefault(consulta, {})[nombre] = datos
+                self.stdout.write(
+                    f'{consulta:24} {nombre:6} {datos["p50_ms"]:>8} {datos["p95_ms"]:>8} {encontrados:>10}'
+                )
+        if options['salida']:
+            carga.guardar({'servicios': Servicio.objects.count(), 'consultas': resultados}, options['salida'])
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
+
+    def sembrar(self, cantidad, tamano_lote):
+        inicio = time.perf_counter()
+        azar = random.Random(cantidad)
+
+        def servicios():
+            for i in range(cantidad):
+                yield Servicio(
+                    nombre=f'{azar.choice(TIPOS)} {azar.choice(ADJETIVOS)} {PREFIJO}{i}',
+                    descripcion=' '.join(azar.sample(RELLENO, 12)),
+                    duracion=azar.choice([30, 45, 60, 90]),
+                    precio=azar.randrange(5000, 50000, 500),
+                    estado_servicio_id=1 if azar.random() < 0.9 else 2,
+                )
+
+        creados = 0
+        pendientes = servicios()
+        while lote := list(islice(pendientes, tamano_lote)):
+            # Los triggers indexan cada fila insertada
+            Servicio.objects.bulk_create(lote)
+            creados += len(lote)
+        self.stdout.write(f'{creados} servicios creados en {time.perf_counter() - inicio:.1f} s')
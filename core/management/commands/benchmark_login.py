@@ -0,0 +1,89 @@
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core import carga
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula una inundación de intentos de login desde muchas IPs y usuarios y mide la CPU '
+        'del proceso con y sin los límites de intentos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=15, help='Duración de la inundación')
+        parser.add_argument('--por-segundo', type=float, default=10, help='Intentos por segundo que llegan')
+        parser.add_argument('--ips', type=int, default=1000, help='IPs distintas de las que llegan los intentos')
+        parser.add_argument('--solo-con-limite', action='store_true',
+                            help='No medir sin límites (tarda lo que tarden todos los hashes)')
+        parser.add_argument('--json', dest='salida', help='Guardar los resultados en este archivo')
+
+    def handle(self, *args, **options):
+        escenarios = {'con_limite': settings.LIMITES_INTENTOS}
+        if not options['solo_con_limite']:
+            escenarios['sin_limite'] = {nombre: None for nombre in settings.LIMITES_INTENTOS}
+
+        resultados = {}
+        self.stdout.write(
+            f'{"escenario":12} {"intentos":>8} {"429":>6} {"hashes":>6} {"CPU %":>6} {"atraso s":>8} {"p50 ms":>8}'
+        )
+        for nombre, limites in escenarios.items():
+            with override_settings(LIMITES_INTENTOS=limites):
+                datos = self.inundar(options['segundos'], options['por_segundo'], options['ips'])
+            resultados[nombre] = datos
+            self.stdout.write(
+                f'{nombre:12} {datos["solicitudes"]:>8} {datos["rechazadas"]:>6} {datos["hashes"]:>6} '
+                f'{datos["cpu_porcentaje"]:>6} {datos["atraso_s"]:>8} {datos["p50_ms"]:>8}'
+            )
+        if options['salida']:
+            carga.guardar({'limites': settings.LIMITES_INTENTOS, 'escenarios': resultados}, options['salida'])
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
+
+    def inundar(self, segundos, por_segundo, ips):
+        """Envía los intentos a ritmo fijo, sin esperar las respuestas lentas (como clientes independientes).
+
+        Si el proceso no da abasto las solicitudes se atrasan respecto del ritmo de
+        llegada: ``atraso_s`` es cuánto esperaría la última en la cola de un worker.
+        """
+        cache.clear()
+        cliente = Client(HTTP_HOST='localhost')
+        url = reverse('login')
+        azar = random.Random(ips)
+        direcciones = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(ips)]
+        total = int(segundos * por_segundo)
+        estados = Counter()
+        latencias = []
+        inicio = time.perf_counter()
+        cpu_inicio = time.process_time()
+        for i in range(total):
+            llegada = inicio + i / por_segundo
+            if (pendiente := llegada - time.perf_counter()) > 0:
+                time.sleep(pendiente)
+            antes = time.perf_counter()
+            respuesta = cliente.post(
+                url,
+                {'username': f'victima{azar.randrange(10000)}', 'password': 'clave-incorrecta'},
+                REMOTE_ADDR=azar.choice(direcciones),
+            )
+            latencias.append(time.perf_counter() - antes)
+            estados[respuesta.status_code] += 1
+        duracion = time.perf_counter() - inicio
+        cpu = time.process_time() - cpu_inicio
+        return carga.resumen(
+            latencias, duracion,
+            errores=total - estados[200] - estados[429],
+            rechazadas=estados[429],
+            # Cada intento que llega a la vista calcula un hash, exista o no el usuario
+            hashes=estados[200],
+            cpu_s=round(cpu, 2),
+            # CPU usada sobre el tiempo de la inundación; 100 es un núcleo saturado
+            cpu_porcentaje=round(100 * cpu / max(duracion, segundos), 1),
+            atraso_s=round(max(0.0, duracion - segundos), 2),
+        )
@@ -0,0 +1,74 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import carga, disponibilidad
+from core.models import Servicio, Usuario
+
+
+def peticiones(cantidad, servicio_id, semilla=0):
+    """Mezcla fija de solicitudes: disponibilidad, historial y nuevas reservas"""
+    azar = random.Random(semilla)
+    hoy = timezone.localdate()
+    lista = []
+    for _ in range(cantidad):
+        tirada = azar.random()
+        if tirada < 0.6:
+            lista.append(('GET', '/api/disponibilidad/', None))
+        elif tirada < 0.9:
+            lista.append(('GET', '/api/mis-reservas/', None))
+        else:
+            # Muchas chocan con un turno ya tomado (409): también es trabajo real del endpoint
+            fecha = hoy + timedelta(days=azar.randint(1, disponibilidad.DIAS_ANTICIPACION - 1))
+            inicio = disponibilidad.inicio_turno(fecha, azar.randrange(disponibilidad.TOTAL_TURNOS))
+            lista.append(('POST', f'/api/reservar/{servicio_id}/', {'fecha_hora': inicio.isoformat()}))
+    return lista
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara solicitudes por segundo y latencia de cola entre un servidor WSGI y uno ASGI '
+        'que usan la misma base SQLite local (ver "Servidor ASGI" en el README)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://127.0.0.1:8000', help='Servidor con gunicorn (WSGI)')
+        parser.add_argument('--async-url', default='http://127.0.0.1:8001', help='Servidor con uvicorn y VISTAS_ASYNC=1')
+        parser.add_argument('--usuario', default='benchmark')
+        parser.add_argument('--clave', default='benchmark-clave-123')
+        parser.add_argument('--concurrencia', type=int, default=50)
+        parser.add_argument('--solicitudes', type=int, default=2000)
+        parser.add_argument('--json', dest='salida', help='Guardar los resultados en este archivo')
+
+    def handle(self, *args, **options):
+        usuario = Usuario.objects.filter(username=options['usuario']).first()
+        if usuario is None:
+            Usuario.objects.create_user(username=options['usuario'], password=options['clave'])
+        servicio = Servicio.objects.filter(estado_servicio=1).order_by('id').first()
+        if servicio is None:
+            raise CommandError('Se necesita al menos un servicio activo')
+
+        lista = peticiones(options['solicitudes'], servicio.id)
+        resultados = {}
+        for nombre, url in (('sync', options['sync_url']), ('async', options['async_url'])):
+            self.stdout.write(f'{nombre}: {len(lista)} solicitudes con {options["concurrencia"]} clientes contra {url}')
+            try:
+                latencias, codigos, duracion = carga.ejecutar(
+                    url, lista, options['concurrencia'], options['usuario'], options['clave']
+                )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            errores = sum(1 for codigo in codigos if codigo == 0 or codigo >= 500)
+            resultados[nombre] = carga.resumen(latencias, duracion, errores, url=url)
+
+        self.stdout.write(f'{"":6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errores":>8}')
+        for nombre, datos in resultados.items():
+            self.stdout.write(
+                f'{nombre:6} {datos["por_segundo"]:>8} {datos["p50_ms"]:>8} '
+                f'{datos["p95_ms"]:>8} {datos["p99_ms"]:>8} {datos["errores"]:>8}'
+            )
+        if options['salida']:
+            carga.guardar(resultados, options['salida'])
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+
+from core import carga
+
+ALIAS = 'contencion'
+
+
+def _escritor(ruta, opciones, transacciones, espera):
+    """Proceso hijo: transacciones de lectura y escritura como reservar_turno, sin reintentos"""
+    connections[ALIAS] = DatabaseWrapper({
+        **connections['default'].settings_dict, 'NAME': ruta, 'OPTIONS': opciones, 'CONN_MAX_AGE': None,
+    }, ALIAS)
+    latencias, fallos = [], 0
+    for _ in range(transacciones):
+        inicio = time.perf_counter()
+        try:
+            with transaction.atomic(using=ALIAS):
+                with connections[ALIAS].cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM turno WHERE ocupado = 1')
+                    time.sleep(espera)
+                    cursor.execute('INSERT INTO turno (ocupado) VALUES (1)')
+            latencias.append(time.perf_counter() - inicio)
+        except OperationalError:
+            fallos += 1
+    connections[ALIAS].close()
+    return latencias, fallos
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cuántas transacciones de escritura fallan con "database is locked" entre varios procesos, '
+        'con la configuración por defecto de SQLite y con el perfil de producción (SQLITE_PRODUCCION)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=8)
+        parser.add_argument('--transacciones', type=int, default=100, help='Transacciones por proceso')
+        parser.add_argument('--espera-ms', type=float, default=2, help='Trabajo simulado dentro de cada transacción')
+        parser.add_argument('--json', dest='salida', help='Guardar los resultados en este archivo')
+
+    def handle(self, *args, **options):
+        perfiles = {
+            'por_defecto': {},
+            'produccion': settings.SQLITE_OPCIONES_PRODUCCION,
+        }
+        resultados = {}
+        # fork: los hijos heredan la configuración de Django sin volver a cargarla
+        contexto = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directorio:
+            for nombre, opciones in perfiles.items():
+                ruta = os.path.join(directorio, f'{nombre}.sqlite3')
+                with sqlite3.connect(ruta) as conexion:
+                    conexion.execute('CREATE TABLE turno (id INTEGER PRIMARY KEY, ocupado INTEGER)')
+                argumentos = [(ruta, opciones, options['transacciones'], options['espera_ms'] / 1000)] * options['procesos']
+                inicio = time.perf_counter()
+                with contexto.Pool(options['procesos']) as pool:
+                    por_proceso = pool.starmap(_escritor, argumentos)
+                duracion = time.perf_counter() - inicio
+                latencias = [latencia for resultado, _ in por_proceso for latencia in resultado]
+                fallos = sum(fallos for _, fallos in por_proceso)
+                total = options['procesos'] * options['transacciones']
+                resultados[nombre] = carga.resumen(
+                    latencias, duracion, fallos, tasa_fallos=round(100 * fallos / total, 1)
+                )
+
+        self.stdout.write(f'{"":12} {"ok/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"fallos":>7} {"% fallos":>9}')
+        for nombre, datos in resultados.items():
+            self.stdout.write(
+                f'{nombre:12} {datos["por_segundo"]:>8} {datos["p50_ms"]!s:>8} {datos["p99_ms"]!s:>8} '
+                f'{datos["errores"]:>7} {datos["tasa_fallos"]:>9}'
+            )
+        if options['salida']:
+            carga.guardar(resultados, options['salida'])
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
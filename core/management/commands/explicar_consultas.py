@@ -0,0 +1,132 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+
+from core import disponibilidad, paginacion, resumenes
+from core.models import Horario, Reserva
+
+# Tablas grandes en las que un recorrido completo es una regresión
+TABLAS_VIGILADAS = ('core_reserva', 'core_horario', 'core_resumendiario')
+# Cada recorrido como (tabla, índice); "SCAN t USING INDEX i" recorre el índice entero, y solo se
+# acepta si es el índice esperado de la consulta (en orden y con LIMIT se corta pronto)
+PATRONES_RECORRIDO = {
+    'sqlite': re.compile(r'\bSCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)()'),
+}
+
+
+def consultas_frecuentes():
+    """Las consultas calientes de la aplicación, con valores de ejemplo y el índice que deben usar"""
+    ahora = timezone.now()
+    hoy = timezone.localdate()
+    usuario_id = reserva_id = 1
+    return [
+        # views.profile
+        ('perfil: reservas activas', Reserva.objects.filter(
+            usuario_id=usuario_id, fecha_hora__gte=ahora, estado_reserva_id__in=[1, 2]
+        ).order_by('fecha_hora')[:20], 'reserva_usuario_cursor_idx'),
+        ('perfil: historial', Reserva.objects.filter(usuario_id=usuario_id).filter(
+            Q(fecha_hora__lt=ahora) | Q(estado_reserva_id=3)
+        ).order_by('-fecha_hora')[:5], 'reserva_usuario_cursor_idx'),
+        # paginacion.paginar desde historial_reservas / reservas_api
+        ('historial por cursor', Reserva.objects.filter(usuario_id=usuario_id).filter(
+            Q(fecha_hora__lt=ahora) | Q(fecha_hora=ahora, id__lt=reserva_id)
+        ).order_by(*paginacion.ORDEN)[:21], 'reserva_usuario_cursor_idx'),
+        # reservas.reservar_turno y reservas.reservar_lote
+        ('reserva: superposiciones', disponibilidad.activas_en([(ahora, ahora + timedelta(minutes=90))]),
+         'reserva_estado_intervalo_idx'),
+        ('lote: superposiciones', disponibilidad.activas_en([
+            (ahora, ahora + timedelta(minutes=60)), (ahora + timedelta(days=1), ahora + timedelta(days=1, minutes=30))
+        ]), 'reserva_estado_intervalo_idx'),
+        # disponibilidad._calcular_ocupacion
+        ('disponibilidad: reservas', disponibilidad.activas_en([(ahora, ahora + timedelta(days=30))]),
+         'reserva_estado_intervalo_idx'),
+        ('disponibilidad: bloqueos', Horario.objects.filter(
+            fecha__range=(hoy, hoy + timedelta(days=30)),
+            estado_horario_id=disponibilidad.ESTADO_HORARIO_NO_DISPONIBLE
+        ).values_list('fecha', 'hora_inicio', 'hora_fin'), 'horario_estado_fecha_idx'),
+        # estadisticas.recalcular y estadisticas._proxima (el conteo usa el índice de la clave foránea)
+        ('estadísticas: conteo por estado', Reserva.objects.filter(
+            usuario_id=usuario_id
+        ).order_by().values_list('estado_reserva_id').annotate(n=Count('id')), None),
+        ('estadísticas: próxima reserva', Reserva.objects.filter(
+            usuario_id=usuario_id, fecha_hora__gte=ahora, estado_reserva_id__in=disponibilidad.ESTADOS_ACTIVOS
+        ).order_by('fecha_hora').values_list('id', 'fecha_hora')[:1], 'reserva_usuario_cursor_idx'),
+        # reservas.vencer_pendientes (índice de la clave foránea del estado)
+        ('vencimiento: pendientes vencidas', Reserva.objects.filter(estado_reserva_id=1).filter(
+            Q(creada__lt=ahora - timedelta(hours=48)) | Q(fecha_hora__lt=ahora)
+        ).order_by().values('id', 'usuario_id', 'servicio_id', 'estado_reserva_id', 'fecha_hora')[:1000], None),
+        # admin.HorarioChangeList
+        ('admin: reservas por horario', Reserva.objects.filter(
+            fecha_hora__gte=ahora, fecha_hora__lt=ahora + timedelta(days=7),
+            fecha_hora__date__in=[hoy]
+        ).order_by().values_list(TruncDate('fecha_hora'), ExtractHour('fecha_hora')).annotate(n=Count('id')),
+         'reserva_fecha_estado_idx'),
+        ('admin: listado de horarios', Horario.objects.order_by('fecha', 'hora_inicio')[:100],
+         'horario_fecha_inicio_unico'),
+        # views.reporte_reservas_api
+        ('reportes: resumen semanal', resumenes.reporte(hoy - timedelta(days=30), hoy + timedelta(days=30), 'semana'),
+         'resumen_diario_unico'),
+    ]
+
+
+def nombres_de_indice(indice, modelo, vendor):
+    """Cómo aparece ``indice`` en el plan: SQLite llama sqlite_autoindex_<tabla>_N al de una UniqueConstraint"""
+    nombres = re.escape(indice)
+    if vendor == 'sqlite' and any(restriccion.name == indice for restriccion in modelo._meta.constraints):
+        nombres += rf'|sqlite_autoindex_{modelo._meta.db_table}_\d+'
+    return re.compile(rf'\b(?:{nombres})\b')
+
+
+def recorridos_completos(plan, vendor, esperado=None):
+    """Tablas vigiladas que el plan recorre enteras, salvo las que recorre por el índice ``esperado`` (un patrón)"""
+    patron = PATRONES_RECORRIDO.get(vendor)
+    if patron is None:
+        return []
+    return sorted({
+        tabla for tabla, indice in patron.findall(plan)
+        if tabla in TABLAS_VIGILADAS and not (indice and esperado and esperado.fullmatch(indice))
+    })
+
+
+class Command(BaseCommand):
+    help = ('Ejecuta EXPLAIN sobre las consultas frecuentes y falla si alguna recorre una tabla completa '
+            'o no usa el índice que le corresponde')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--planes', action='store_true', help='Mostrar el plan completo de cada consulta')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PATRONES_RECORRIDO:
+            self.stdout.write(self.style.WARNING(f'No se reconocen los planes de {vendor}: solo se muestran'))
+        problemas = []
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                # Con tablas chicas Postgres prefiere recorrerlas: se pregunta si el índice se puede usar
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for nombre, queryset, indice in consultas_frecuentes():
+                plan = queryset.explain()
+                esperado = indice and nombres_de_indice(indice, queryset.model, vendor)
+                error = None
+                tablas = recorridos_completos(plan, vendor, esperado)
+                if tablas:
+                    error = f'recorre {", ".join(tablas)}'
+                elif esperado and vendor in PATRONES_RECORRIDO and not esperado.search(plan):
+                    error = f'no usa {indice}'
+                if error:
+                    problemas.append(nombre)
+                    self.stdout.write(self.style.ERROR(f'{nombre}: {error}'))
+                else:
+                    self.stdout.write(f'{nombre}: ok')
+                if options['planes'] or error:
+                    self.stdout.write(plan)
+        if problemas:
+            raise CommandError(f'{len(problemas)} consulta(s) recorren tablas completas o no usan su índice')
+        self.stdout.write(self.style.SUCCESS('Todas las consultas frecuentes usan índices'))
@@ -0,0 +1,52 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import disponibilidad, horarios
+
+
+def _fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {valor!r} (usar AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera los Horario de un período a partir de una plantilla semanal. '
+        'Se puede volver a ejecutar: los turnos existentes no se duplican ni pierden su estado'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('desde', help='Primera fecha (AAAA-MM-DD)')
+        parser.add_argument('hasta', help='Última fecha, inclusive (AAAA-MM-DD)')
+        parser.add_argument('--dias', default='lun-vie', help='Días de atención, por ejemplo lun-vie o lun,mie,vie')
+        parser.add_argument(
+            '--rangos', default=f'{disponibilidad.HORA_APERTURA:02}:00-{disponibilidad.HORA_CIERRE:02}:00',
+            help='Rangos de atención, por ejemplo 08:00-12:00,14:00-18:00'
+        )
+        parser.add_argument('--duracion', type=int, default=disponibilidad.INTERVALO_MINUTOS, help='Minutos por turno')
+        parser.add_argument(
+            '--excepto', action='append', default=[], metavar='AAAA-MM-DD',
+            help='Fecha sin atención (feriado); se puede repetir'
+        )
+        parser.add_argument('--tamano-lote', type=int, default=horarios.TAMANO_LOTE)
+
+    def handle(self, *args, **options):
+        try:
+            dias = horarios.parsear_dias(options['dias'])
+            rangos = horarios.parsear_rangos(options['rangos'])
+            inicio = time.perf_counter()
+            creados, actualizados, sin_cambios = horarios.generar(
+                _fecha(options['desde']), _fecha(options['hasta']), dias, rangos, options['duracion'],
+                excepciones=[_fecha(valor) for valor in options['excepto']],
+                tamano_lote=options['tamano_lote'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'{creados} horarios creados, {actualizados} actualizados y {sin_cambios} sin cambios '
+            f'en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,65 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import disponibilidad
+from core.models import Reserva
+from core.reservas import planificar_pendientes
+
+
+def _fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {valor!r} (usar AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Confirma en lote las reservas pendientes de un período, en orden de creación, moviendo las que '
+        'chocan al turno libre más cercano del mismo día dentro de --max-minutos. Avisa por correo a los '
+        'usuarios de las reservas movidas e informa las que no tienen lugar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=_fecha, help='Primera fecha (AAAA-MM-DD); por defecto hoy')
+        parser.add_argument('--hasta', type=_fecha,
+                            help=f'Última fecha, inclusive; por defecto hoy + {disponibilidad.DIAS_ANTICIPACION} días')
+        parser.add_argument('--max-minutos', type=int, default=settings.PLANIFICAR_MAX_MINUTOS,
+                            help='Cuánto se puede mover una reserva respecto del turno pedido; por defecto '
+                                 f'PLANIFICAR_MAX_MINUTOS ({settings.PLANIFICAR_MAX_MINUTOS})')
+        parser.add_argument('--simular', action='store_true', help='Mostrar el resultado sin guardar nada')
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+        desde = options['desde'] or hoy
+        hasta = options['hasta'] or hoy + timedelta(days=disponibilidad.DIAS_ANTICIPACION)
+        if desde > hasta:
+            raise CommandError('La fecha de inicio es posterior a la de fin')
+        if options['max_minutos'] < 0:
+            raise CommandError('--max-minutos no puede ser negativo')
+        max_corrimiento = timedelta(minutes=options['max_minutos'])
+
+        inicio = time.perf_counter()
+        asignadas, sin_lugar = planificar_pendientes(
+            Reserva.objects.filter(
+                fecha_hora__gte=timezone.make_aware(datetime.combine(desde, datetime.min.time())),
+                fecha_hora__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), datetime.min.time())),
+            ),
+            max_corrimiento=max_corrimiento,
+            simular=options['simular'],
+        )
+        movidas = sum(pedida != asignada for _, pedida, asignada in asignadas)
+        for reserva in sin_lugar:
+            self.stdout.write(
+                f'Sin lugar: #{reserva.pk} {reserva.servicio.nombre} '
+                f'{timezone.localtime(reserva.fecha_hora):%d/%m/%Y %H:%M} (usuario {reserva.usuario_id})'
+            )
+        verbo = 'se confirmarían' if options['simular'] else 'confirmadas'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(asignadas)} reservas {verbo} ({movidas} en otro turno) y {len(sin_lugar)} sin lugar '
+            f'en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,51 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import tareas
+
+
+class Command(BaseCommand):
+    help = (
+        'Trabajador de la cola de tareas: reclama lotes de tareas vencidas, las ejecuta y '
+        'reintenta las que fallan con espera exponencial'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamano-lote', type=int, default=tareas.TAMANO_LOTE)
+        parser.add_argument('--espera', type=float, default=2, help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--una-vez', action='store_true', help='Vaciar la cola una vez y terminar (para cron)')
+        parser.add_argument(
+            '--retencion-dias', type=int, default=7, help='Borrar las tareas completadas hace más de estos días'
+        )
+
+    def handle(self, *args, **options):
+        trabajador = tareas.nombre_trabajador()
+        self.detener = False
+        # SIGTERM (deploy, systemd) termina el lote en curso antes de salir
+        signal.signal(signal.SIGTERM, self.pedir_detencion)
+        borradas = tareas.purgar(options['retencion_dias'])
+        self.stdout.write(f'Trabajador {trabajador} iniciado ({borradas} tareas viejas borradas)')
+
+        totales = [0, 0]
+        while not self.detener:
+            completadas, fallidas = tareas.procesar_lote(trabajador, options['tamano_lote'])
+            totales[0] += completadas
+            totales[1] += fallidas
+            if completadas or fallidas:
+                self.stdout.write(f'{completadas} completadas, {fallidas} con error')
+                continue
+            if options['una_vez']:
+                break
+            # Como CONN_MAX_AGE en las solicitudes: no dejar conexiones vencidas abiertas entre lotes
+            close_old_connections()
+            try:
+                time.sleep(options['espera'])
+            except KeyboardInterrupt:
+                break
+        self.stdout.write(self.style.SUCCESS(f'{totales[0]} tareas completadas, {totales[1]} con error'))
+
+    def pedir_detencion(self, numero, marco):
+        self.detener = True
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core import estadisticas
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye las estadísticas de reservas por usuario desde la tabla de reservas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='Recalcular solo el usuario con este id')
+        parser.add_argument('--tamano-lote', type=int, default=1000, help='Filas por INSERT en la reconstrucción completa')
+
+    def handle(self, *args, **options):
+        if options['usuario']:
+            estadistica = estadisticas.recalcular(options['usuario'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Usuario {options["usuario"]}: {estadistica.total_reservas} reservas'
+            ))
+            return
+        total = estadisticas.recalcular_todos(tamano_lote=options['tamano_lote'])
+        self.stdout.write(self.style.SUCCESS(f'Se recalcularon las estadísticas de {total} usuarios'))
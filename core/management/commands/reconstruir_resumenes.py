@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import resumenes
+
+
+def _fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {valor!r} (usar AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los resúmenes diarios de reservas por servicio y estado desde la tabla de reservas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=_fecha, help='Primera fecha a reconstruir (AAAA-MM-DD)')
+        parser.add_argument('--hasta', type=_fecha, help='Última fecha a reconstruir, inclusive (AAAA-MM-DD)')
+        parser.add_argument('--tamano-lote', type=int, default=1000, help='Filas por INSERT')
+
+    def handle(self, *args, **options):
+        if options['desde'] and options['hasta'] and options['desde'] > options['hasta']:
+            raise CommandError('La fecha de inicio es posterior a la de fin')
+        total = resumenes.reconstruir(options['desde'], options['hasta'], tamano_lote=options['tamano_lote'])
+        self.stdout.write(self.style.SUCCESS(f'Se reconstruyeron {total} resúmenes diarios'))
@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.reservas import vencer_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        'Cancela las reservas pendientes que superaron RESERVAS_PENDIENTES_TTL_HORAS o cuyo turno ya pasó, '
+        'para liberar sus turnos. Pensado para ejecutarse desde cron'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-horas', type=float, default=None,
+                            help='Por defecto RESERVAS_PENDIENTES_TTL_HORAS')
+        parser.add_argument('--tamano-lote', type=int, default=1000, help='Filas por transacción')
+        parser.add_argument('--pausa-ms', type=float, default=50, help='Espera entre lotes')
+
+    def handle(self, *args, **options):
+        horas = options['ttl_horas'] if options['ttl_horas'] is not None else settings.RESERVAS_PENDIENTES_TTL_HORAS
+        inicio = time.perf_counter()
+        canceladas = vencer_pendientes(
+            timedelta(hours=horas), tamano_lote=options['tamano_lote'], pausa=options['pausa_ms'] / 1000
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{canceladas} reservas pendientes canceladas en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,211 @@
+"""Métricas de rendimiento por solicitud.
+
+``MetricasMiddleware`` abre una ``Medicion`` para una fracción de las
+solicitudes (``METRICAS_MUESTREO``). Mientras está abierta se acumula el
+tiempo en la base de datos (con un ``execute_wrapper`` instalado en cada
+conexión), en el render de plantillas y en el hash de contraseñas. El
+resultado sale en la cabecera ``Server-Timing`` y en histogramas por vista
+que ``/metrics`` expone en el formato de texto de Prometheus.
+
+Fuera de una medición los envoltorios solo leen una ``ContextVar``, así que
+con el muestreo bajo el costo es casi nulo. Las métricas son por proceso:
+con varios workers cada uno reporta las suyas.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+CATEGORIAS = ('db', 'plantillas', 'hash')
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_actual = ContextVar('medicion', default=None)
+_bloqueo = threading.Lock()
+_instalado = False
+
+
+def muestreo():
+    return getattr(settings, 'METRICAS_MUESTREO', 1.0)
+
+
+class Medicion:
+    __slots__ = ('tiempos', 'consultas', '_abiertas')
+
+    def __init__(self):
+        self.tiempos = dict.fromkeys(CATEGORIAS, 0.0)
+        self.consultas = 0
+        self._abiertas = set()
+
+
+def iniciar():
+    medicion = Medicion()
+    return medicion, _actual.set(medicion)
+
+
+def terminar(token):
+    _actual.reset(token)
+
+
+def _cronometrar(funcion, categoria):
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        medicion = _actual.get()
+        # Las llamadas anidadas (verify llama a encode) se cuentan una sola vez
+        if medicion is None or categoria in medicion._abiertas:
+            return funcion(*args, **kwargs)
+        medicion._abiertas.add(categoria)
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            medicion.tiempos[categoria] += time.perf_counter() - inicio
+            medicion._abiertas.discard(categoria)
+    envoltura._metricas = True
+    return envoltura
+
+
+def _instrumentar(clase, metodo, categoria):
+    original = getattr(clase, metodo)
+    if not getattr(original, '_metricas', False):
+        setattr(clase, metodo, _cronometrar(original, categoria))
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.tiempos['db'] += time.perf_counter() - inicio
+        medicion.consultas += 1
+
+
+def _al_conectar(sender, connection, **kwargs):
+    if _medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_consulta)
+
+
+def instalar():
+    """Engancha los cronómetros; se llama una vez desde CoreConfig.ready"""
+    global _instalado
+    if _instalado:
+        return
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+    from django.template.backends.django import Template
+
+    connection_created.connect(_al_conectar)
+    for conexion in connections.all(initialized_only=True):
+        _al_conectar(None, conexion)
+    _instrumentar(Template, 'render', 'plantillas')
+    for ruta in settings.PASSWORD_HASHERS:
+        hasher = import_string(ruta)
+        _instrumentar(hasher, 'encode', 'hash')
+        _instrumentar(hasher, 'verify', 'hash')
+    _instalado = True
+
+
+def server_timing(medicion, total):
+    partes = [
+        f'db;dur={medicion.tiempos["db"] * 1000:.1f};desc="{medicion.consultas} consultas"',
+        f'plantillas;dur={medicion.tiempos["plantillas"] * 1000:.1f}',
+        f'hash;dur={medicion.tiempos["hash"] * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ]
+    return ', '.join(partes)
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubetas = [0] * len(limites)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cubetas[i] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+
+# nombre: (ayuda, límites de las cubetas)
+HISTOGRAMAS = {
+    'zenteach_solicitud_segundos': ('Duración total de la solicitud', LIMITES_SEGUNDOS),
+    'zenteach_db_segundos': ('Tiempo en consultas SQL por solicitud', LIMITES_SEGUNDOS),
+    'zenteach_db_consultas': ('Consultas SQL por solicitud', LIMITES_CONSULTAS),
+    'zenteach_plantillas_segundos': ('Tiempo de render de plantillas por solicitud', LIMITES_SEGUNDOS),
+    'zenteach_hash_segundos': ('Tiempo de hash de contraseñas por solicitud', LIMITES_SEGUNDOS),
+}
+_histogramas = {}
+_solicitudes = {}
+
+
+def contar(vista, metodo, estado):
+    """Cuenta todas las solicitudes, medidas o no"""
+    clave = (vista, metodo, str(estado))
+    with _bloqueo:
+        _solicitudes[clave] = _solicitudes.get(clave, 0) + 1
+
+
+def registrar(vista, metodo, medicion, total):
+    valores = {
+        'zenteach_solicitud_segundos': total,
+        'zenteach_db_segundos': medicion.tiempos['db'],
+        'zenteach_db_consultas': medicion.consultas,
+        'zenteach_plantillas_segundos': medicion.tiempos['plantillas'],
+        'zenteach_hash_segundos': medicion.tiempos['hash'],
+    }
+    with _bloqueo:
+        for nombre, valor in valores.items():
+            clave = (nombre, vista, metodo)
+            if clave not in _histogramas:
+                _histogramas[clave] = Histograma(HISTOGRAMAS[nombre][1])
+            _histogramas[clave].observar(valor)
+
+
+def reiniciar():
+    with _bloqueo:
+        _histogramas.clear()
+        _solicitudes.clear()
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(**etiquetas):
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in etiquetas.items()) + '}'
+
+
+def exportar():
+    """Texto en formato de exposición de Prometheus (versión 0.0.4)"""
+    with _bloqueo:
+        solicitudes = sorted(_solicitudes.items())
+        histogramas = sorted(
+            (clave, list(h.cubetas), h.suma, h.cuenta, h.limites) for clave, h in _histogramas.items()
+        )
+    lineas = [
+        '# HELP zenteach_solicitudes_total Solicitudes atendidas',
+        '# TYPE zenteach_solicitudes_total counter',
+    ]
+    for (vista, metodo, estado), cantidad in solicitudes:
+        lineas.append(f'zenteach_solicitudes_total{_etiquetas(vista=vista, metodo=metodo, estado=estado)} {cantidad}')
+    for nombre, (ayuda, _) in HISTOGRAMAS.items():
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} histogram']
+        for (nombre_h, vista, metodo), cubetas, suma, cuenta, limites in histogramas:
+            if nombre_h != nombre:
+                continue
+            for limite, acumulado in zip(limites, cubetas):
+                lineas.append(f'{nombre}_bucket{_etiquetas(vista=vista, metodo=metodo, le=limite)} {acumulado}')
+            lineas.append(f'{nombre}_bucket{_etiquetas(vista=vista, metodo=metodo, le="+Inf")} {cuenta}')
+            lineas.append(f'{nombre}_sum{_etiquetas(vista=vista, metodo=metodo)} {suma}')
+            lineas.append(f'{nombre}_count{_etiquetas(vista=vista, metodo=metodo)} {cuenta}')
+    return '\n'.join(lineas) + '\n'
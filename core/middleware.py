@@ -0,0 +1,63 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metricas
+
+
+class MetricasMiddleware:
+    """Mide una muestra de las solicitudes y agrega ``Server-Timing`` a su respuesta.
+
+    Va primero en ``MIDDLEWARE`` para que el total incluya al resto de los middlewares.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metricas.instalar()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= metricas.muestreo():
+            respuesta = self.get_response(request)
+            self._contar(request, respuesta)
+            return respuesta
+        medicion, token = metricas.iniciar()
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            metricas.terminar(token)
+        return self._registrar(request, respuesta, medicion, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        if random.random() >= metricas.muestreo():
+            respuesta = await self.get_response(request)
+            self._contar(request, respuesta)
+            return respuesta
+        medicion, token = metricas.iniciar()
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            metricas.terminar(token)
+        return self._registrar(request, respuesta, medicion, time.perf_counter() - inicio)
+
+    def _vista(self, request):
+        coincidencia = getattr(request, 'resolver_match', None)
+        return coincidencia.view_name if coincidencia else 'sin_ruta'
+
+    def _contar(self, request, respuesta):
+        metricas.contar(self._vista(request), request.method, respuesta.status_code)
+
+    def _registrar(self, request, respuesta, medicion, total):
+        vista = self._vista(request)
+        metricas.contar(vista, request.method, respuesta.status_code)
+        metricas.registrar(vista, request.method, medicion, total)
+        respuesta['Server-Timing'] = metricas.server_timing(medicion, total)
+        return respuesta
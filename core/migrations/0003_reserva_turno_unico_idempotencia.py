@@ -0,0 +1,49 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_alter_usuario_tipo_usuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=255)),
+                ('huella', models.CharField(help_text='SHA-256 del método, ruta y cuerpo de la solicitud', max_length=64)),
+                ('estado_http', models.PositiveSmallIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('cuerpo', models.TextField()),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Clave de idempotencia',
+                'verbose_name_plural': 'Claves de idempotencia',
+            },
+        ),
+        migrations.AlterField(
+            model_name='usuario',
+            name='tipo_usuario',
+            field=models.ForeignKey(default=2, on_delete=django.db.models.deletion.CASCADE, related_name='usuario', to='core.tipousuario'),
+        ),
+        migrations.AddConstraint(
+            model_name='reserva',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado_reserva_id__in', [1, 2])), fields=('fecha_hora',), name='reserva_turno_activo_unico'),
+        ),
+        migrations.AddField(
+            model_name='claveidempotencia',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claves_idempotencia', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='claveidempotencia',
+            constraint=models.UniqueConstraint(fields=('usuario', 'clave'), name='clave_idempotencia_unica'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_reserva_turno_unico_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estadistica', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_reservas', models.PositiveIntegerField(default=0)),
+                ('reservas_pendientes', models.PositiveIntegerField(default=0)),
+                ('reservas_confirmadas', models.PositiveIntegerField(default=0)),
+                ('reservas_canceladas', models.PositiveIntegerField(default=0)),
+                ('proxima_fecha_hora', models.DateTimeField(blank=True, null=True)),
+                ('reservas_por_servicio', models.JSONField(default=dict, help_text='Cantidad de reservas por id de servicio')),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+                ('proxima_reserva', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.reserva')),
+            ],
+            options={
+                'verbose_name': 'Estadística de usuario',
+                'verbose_name_plural': 'Estadísticas de usuarios',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_estadisticausuario'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='reserva',
+            options={'ordering': ['-fecha_hora', '-id'], 'verbose_name': 'Reserva', 'verbose_name_plural': 'Reservas'},
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', '-fecha_hora', '-id'], name='reserva_usuario_cursor_idx'),
+        ),
+    ]
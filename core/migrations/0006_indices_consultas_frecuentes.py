@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_reserva_cursor_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(fields=['fecha', 'hora_inicio'], name='horario_fecha_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(condition=models.Q(('estado_horario_id', 2)), fields=['fecha'], name='horario_bloqueos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('estado_reserva_id__in', [1, 2])), fields=['usuario', 'fecha_hora'], name='reserva_usuario_activas_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha_hora', 'estado_reserva'], name='reserva_fecha_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def quitar_duplicados(apps, schema_editor):
+    """Deja un solo Horario por (fecha, hora_inicio), preferentemente el bloqueado"""
+    Horario = apps.get_model('core', 'Horario')
+    repetidos = Horario.objects.values('fecha', 'hora_inicio').annotate(n=Count('id')).filter(n__gt=1)
+    for turno in repetidos:
+        ids = list(Horario.objects.filter(**{
+            'fecha': turno['fecha'], 'hora_inicio': turno['hora_inicio']
+        }).order_by('-estado_horario_id', 'id').values_list('id', flat=True))
+        Horario.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_marcas_actualizacion'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_duplicados, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='horario',
+            name='horario_fecha_inicio_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='horario',
+            constraint=models.UniqueConstraint(fields=('fecha', 'hora_inicio'), name='horario_fecha_inicio_unico'),
+        ),
+    ]
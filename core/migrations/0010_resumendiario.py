@@ -0,0 +1,54 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def llenar_resumenes(apps, schema_editor):
+    """Carga inicial desde las reservas existentes; después las mantienen las señales"""
+    Reserva = apps.get_model('core', 'Reserva')
+    Servicio = apps.get_model('core', 'Servicio')
+    ResumenDiario = apps.get_model('core', 'ResumenDiario')
+    servicios = {servicio.id: servicio for servicio in Servicio.objects.all()}
+    grupos = Reserva.objects.order_by().values_list(
+        TruncDate('fecha_hora', tzinfo=timezone.get_default_timezone()), 'servicio_id', 'estado_reserva_id'
+    ).annotate(n=Count('id'))
+    ResumenDiario.objects.bulk_create([
+        ResumenDiario(
+            fecha=fecha, servicio_id=servicio_id, estado_reserva_id=estado_id, reservas=n,
+            minutos=n * servicios[servicio_id].duracion, ingresos=n * servicios[servicio_id].precio,
+        )
+        for fecha, servicio_id, estado_id, n in grupos
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_tarea'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(help_text='Día local del turno reservado')),
+                ('reservas', models.IntegerField(default=0)),
+                ('minutos', models.IntegerField(default=0, help_text='reservas × duración actual del servicio')),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, help_text='reservas × precio actual del servicio', max_digits=14)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('estado_reserva', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='core.estadoreserva')),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='core.servicio')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario',
+                'verbose_name_plural': 'Resúmenes diarios',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'servicio', 'estado_reserva'), name='resumen_diario_unico')],
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+from django.db import OperationalError, migrations
+
+# SQL copiado de core.busqueda al crear la migración: no debe cambiar aunque cambie el módulo
+SQL_INSTALAR = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS core_servicio_fts USING fts5(
+        nombre, descripcion,
+        content='core_servicio', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS core_servicio_fts_ai AFTER INSERT ON core_servicio BEGIN
+        INSERT INTO core_servicio_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_servicio_fts_ad AFTER DELETE ON core_servicio BEGIN
+        INSERT INTO core_servicio_fts(core_servicio_fts, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_servicio_fts_au AFTER UPDATE OF nombre, descripcion ON core_servicio BEGIN
+        INSERT INTO core_servicio_fts(core_servicio_fts, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+        INSERT INTO core_servicio_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    "INSERT INTO core_servicio_fts(core_servicio_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    # Indexar los servicios que ya existen
+    "INSERT INTO core_servicio_fts(core_servicio_fts) VALUES ('rebuild')",
+]
+
+SQL_DESINSTALAR = [
+    'DROP TRIGGER IF EXISTS core_servicio_fts_ad',
+    'DROP TRIGGER IF EXISTS core_servicio_fts_ai',
+    'DROP TRIGGER IF EXISTS core_servicio_fts_au',
+    'DROP TABLE IF EXISTS core_servicio_fts',
+]
+
+
+def instalar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        for sql in SQL_INSTALAR:
+            schema_editor.execute(sql)
+    except OperationalError:
+        # SQLite compilado sin FTS5: la búsqueda usa icontains
+        pass
+
+
+def desinstalar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQL_DESINSTALAR:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+    """Índice FTS5 de nombre y descripción de Servicio (solo SQLite; en otras bases no hace nada)"""
+
+    dependencies = [
+        ('core', '0010_resumendiario'),
+    ]
+
+    operations = [
+        migrations.RunPython(instalar, desinstalar),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:12
+
+import django.core.validators
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def llenar_fecha_fin(apps, schema_editor):
+    """fecha_hora + duración actual del servicio: un UPDATE por cada duración distinta"""
+    Reserva = apps.get_model('core', 'Reserva')
+    Servicio = apps.get_model('core', 'Servicio')
+    duraciones = {}
+    for servicio_id, duracion in Servicio.objects.values_list('id', 'duracion'):
+        duraciones.setdefault(duracion, []).append(servicio_id)
+    for duracion, servicio_ids in duraciones.items():
+        Reserva.objects.filter(servicio_id__in=servicio_ids).update(
+            fecha_fin=F('fecha_hora') + timedelta(minutes=duracion)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_servicio_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicio',
+            name='capacidad',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Reservas activas de este servicio que pueden coincidir en el tiempo', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='servicio',
+            name='duracion',
+            field=models.IntegerField(help_text='Duración en minutos', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(720)]),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='fecha_fin',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(llenar_fecha_fin, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reserva',
+            name='fecha_fin',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.RemoveConstraint(
+            model_name='reserva',
+            name='reserva_turno_activo_unico',
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['estado_reserva', 'fecha_hora', 'fecha_fin', 'servicio'], name='reserva_estado_intervalo_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_reserva_intervalo'),
+    ]
+
+    operations = [
+        # SQLite no usa un índice parcial cuando la condición llega como parámetro
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_usuario_activas_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='horario',
+            name='horario_bloqueos_idx',
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(fields=['estado_horario', 'fecha'], name='horario_estado_fecha_idx'),
+        ),
+    ]
@@ -1,6 +1,24 @@
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from . import catalogos
+
+# Tope de Servicio.duracion: acota hacia atrás la consulta de reservas superpuestas
+DURACION_MAXIMA_MINUTOS = 12 * 60
+
+class ValoresOriginalesMixin:
+    """Recuerda los valores leídos de la base de datos para que las señales detecten cambios"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+
 class TipoUsuario(models.Model):
     nombre = models.CharField(max_length=10,  default='docente')
     descripcion = models.TextField(max_length=200)
@@ -9,12 +27,12 @@ class TipoUsuario(models.Model):
     def __str__(self):
         return f"{self.nombre}"
     
-class Usuario(AbstractUser):
+class Usuario(ValoresOriginalesMixin, AbstractUser):
     tipo_usuario = models.ForeignKey(TipoUsuario, on_delete=models.CASCADE, related_name='usuario', default=2)
     fecha_registro = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.get_full_name()} ({self.tipo_usuario})"
+        return f"{self.get_full_name()} ({catalogos.nombre(TipoUsuario, self.tipo_usuario_id)})"
     
 class EstadoServicio(models.Model):
     nombre = models.CharField(max_length=10,  default='pendiente')
@@ -24,12 +42,20 @@ class EstadoServicio(models.Model):
     def __str__(self):
         return f"{self.nombre}"
 
-class Servicio(models.Model):
+class Servicio(ValoresOriginalesMixin, models.Model):
     nombre = models.CharField(max_length=100)
     descripcion = models.TextField()
-    duracion = models.IntegerField(help_text="Duración en minutos")
+    duracion = models.IntegerField(
+        help_text="Duración en minutos",
+        validators=[MinValueValidator(1), MaxValueValidator(DURACION_MAXIMA_MINUTOS)]
+    )
+    capacidad = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1)],
+        help_text="Reservas activas de este servicio que pueden coincidir en el tiempo"
+    )
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     estado_servicio = models.ForeignKey(EstadoServicio, on_delete=models.CASCADE, related_name='servicio')
+    actualizado = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.nombre
@@ -46,20 +72,70 @@ class EstadoReserva(models.Model):
     def __str__(self):
         return f"{self.nombre}"
     
-class Reserva(models.Model):
+class Reserva(ValoresOriginalesMixin, models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='reservas')
     servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, related_name='reservas')
     fecha_hora = models.DateTimeField()
+    # Se fija con la duración del servicio al reservar; cambiar la duración no mueve las reservas hechas
+    fecha_fin = models.DateTimeField(editable=False)
     creada = models.DateTimeField(auto_now_add=True)
+    # Los QuerySet.update() deben fijarla a mano: la API la usa para Last-Modified
+    actualizada = models.DateTimeField(auto_now=True)
     estado_reserva = models.ForeignKey(EstadoReserva, on_delete=models.CASCADE, related_name='reserva')
 
     def __str__(self):
         return f"{self.usuario.get_full_name()} - {self.servicio.nombre} - {self.fecha_hora}"
 
+    @property
+    def nombre_estado(self):
+        return catalogos.nombre(EstadoReserva, self.estado_reserva_id)
+
+    def get_estado_display(self):
+        return self.nombre_estado.capitalize()
+
+    def calcular_fin(self):
+        return self.fecha_hora + timedelta(minutes=self.servicio.duracion)
+
+    def save(self, *args, **kwargs):
+        originales = getattr(self, '_valores_originales', {})
+        movida = any(
+            campo in originales and originales[campo] != getattr(self, campo) for campo in ('fecha_hora', 'servicio_id')
+        )
+        if self.fecha_fin is None or movida:
+            self.fecha_fin = self.calcular_fin()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'fecha_fin'}
+        super().save(*args, **kwargs)
+
+    def clean(self):
+        # Los formularios (admin) validan lo mismo que reservas.reservar_turno
+        from . import disponibilidad
+        if self.fecha_hora is None or self.servicio_id is None:
+            return
+        if self.estado_reserva_id in disponibilidad.ESTADOS_ACTIVOS:
+            inicio, fin = self.fecha_hora, self.calcular_fin()
+            agenda = disponibilidad.agenda([(inicio, fin)], excluir=self.pk)
+            if not disponibilidad.admite(agenda, self.servicio, inicio, fin):
+                raise ValidationError({'fecha_hora': 'El horario se superpone con otras reservas activas'})
+
     class Meta:
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
-        ordering = ['-fecha_hora']
+        # id desempata reservas con la misma fecha_hora (canceladas) para la paginación por cursor
+        ordering = ['-fecha_hora', '-id']
+        indexes = [
+            # También responde las próximas reservas activas del perfil y las estadísticas
+            models.Index(fields=['usuario', '-fecha_hora', '-id'], name='reserva_usuario_cursor_idx'),
+            # Conflictos y conteos por rango de fechas en cualquier estado (admin de horarios)
+            models.Index(fields=['fecha_hora', 'estado_reserva'], name='reserva_fecha_estado_idx'),
+            # Superposiciones: un recorrido por fecha_hora en cada estado activo, respondido solo
+            # desde el índice. No es parcial: Django pasa los valores del IN como parámetros y
+            # SQLite no puede comprobar que cumplen la condición de un índice parcial
+            models.Index(
+                fields=['estado_reserva', 'fecha_hora', 'fecha_fin', 'servicio'],
+                name='reserva_estado_intervalo_idx'
+            ),
+        ]
         
 class EstadoHorario(models.Model):
     nombre = models.CharField(max_length=10,  default='disponible')
@@ -69,15 +145,126 @@ class EstadoHorario(models.Model):
     def __str__(self):
         return f"{self.nombre}"
     
-class Horario(models.Model):
+class Horario(ValoresOriginalesMixin, models.Model):
     fecha = models.DateField()
     hora_inicio = models.TimeField()
     hora_fin = models.TimeField()
     estado_horario = models.ForeignKey(EstadoHorario, on_delete=models.CASCADE, related_name='horario')
+    actualizado = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.fecha} {self.hora_inicio}-{self.hora_fin}"
 
+    @property
+    def disponible(self):
+        return catalogos.nombre(EstadoHorario, self.estado_horario_id) == 'si'
+
     class Meta:
         verbose_name = "Horario"
         verbose_name_plural = "Horarios"
+        constraints = [
+            # Un turno por fecha y hora de inicio: permite regenerar la grilla con upserts
+            models.UniqueConstraint(fields=['fecha', 'hora_inicio'], name='horario_fecha_inicio_unico'),
+        ]
+        indexes = [
+            # Disponibilidad solo lee los bloqueos. No es parcial por lo mismo que reserva_estado_intervalo_idx
+            models.Index(fields=['estado_horario', 'fecha'], name='horario_estado_fecha_idx'),
+        ]
+
+class ClaveIdempotencia(models.Model):
+    """Respuesta guardada para un Idempotency-Key, que se repite si el cliente reintenta"""
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='claves_idempotencia')
+    clave = models.CharField(max_length=255)
+    huella = models.CharField(max_length=64, help_text="SHA-256 del método, ruta y cuerpo de la solicitud")
+    estado_http = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    cuerpo = models.TextField()
+    creada = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.clave} ({self.estado_http})"
+
+    class Meta:
+        verbose_name = "Clave de idempotencia"
+        verbose_name_plural = "Claves de idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'clave'], name='clave_idempotencia_unica'),
+        ]
+
+class EstadisticaUsuario(models.Model):
+    """Resumen de las reservas de un usuario, mantenido por las señales de Reserva"""
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name='estadistica')
+    total_reservas = models.PositiveIntegerField(default=0)
+    reservas_pendientes = models.PositiveIntegerField(default=0)
+    reservas_confirmadas = models.PositiveIntegerField(default=0)
+    reservas_canceladas = models.PositiveIntegerField(default=0)
+    proxima_reserva = models.ForeignKey(Reserva, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    proxima_fecha_hora = models.DateTimeField(null=True, blank=True)
+    reservas_por_servicio = models.JSONField(default=dict, help_text="Cantidad de reservas por id de servicio")
+    actualizada = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.usuario} - {self.total_reservas} reservas"
+
+    class Meta:
+        verbose_name = "Estadística de usuario"
+        verbose_name_plural = "Estadísticas de usuarios"
+
+class ResumenDiario(models.Model):
+    """Reservas, minutos e ingresos por día, servicio y estado, mantenido por las señales de Reserva"""
+    fecha = models.DateField(help_text="Día local del turno reservado")
+    servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, related_name='resumenes')
+    estado_reserva = models.ForeignKey(EstadoReserva, on_delete=models.CASCADE, related_name='resumenes')
+    # Sin CHECK >= 0: una diferencia mal aplicada no debe impedir guardar la reserva
+    reservas = models.IntegerField(default=0)
+    minutos = models.IntegerField(default=0, help_text="reservas × duración actual del servicio")
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                   help_text="reservas × precio actual del servicio")
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.fecha} - {self.servicio_id} - {self.estado_reserva_id}: {self.reservas}"
+
+    class Meta:
+        verbose_name = "Resumen diario"
+        verbose_name_plural = "Resúmenes diarios"
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'servicio', 'estado_reserva'], name='resumen_diario_unico'),
+        ]
+
+class Tarea(models.Model):
+    """Trabajo diferido que ejecuta ``manage.py procesar_tareas`` fuera de la solicitud"""
+    PENDIENTE = 'pendiente'
+    EN_CURSO = 'en_curso'
+    COMPLETADA = 'completada'
+    FALLIDA = 'fallida'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_CURSO, 'En curso'),
+        (COMPLETADA, 'Completada'),
+        (FALLIDA, 'Fallida'),
+    ]
+
+    nombre = models.CharField(max_length=200, help_text="Función registrada con @tareas.tarea")
+    argumentos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=5)
+    disponible_desde = models.DateTimeField(help_text="No se ejecuta antes de este momento (espera entre reintentos)")
+    bloqueada_hasta = models.DateTimeField(null=True, blank=True, help_text="Vencimiento del reclamo de un trabajador")
+    trabajador = models.CharField(max_length=100, blank=True)
+    ultimo_error = models.TextField(blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    terminada = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.get_estado_display()})"
+
+    class Meta:
+        verbose_name = "Tarea"
+        verbose_name_plural = "Tareas"
+        indexes = [
+            # El trabajador solo busca las pendientes y las reclamadas por trabajadores caídos
+            models.Index(fields=['disponible_desde'], condition=models.Q(estado='pendiente'), name='tarea_pendientes_idx'),
+            models.Index(fields=['bloqueada_hasta'], condition=models.Q(estado='en_curso'), name='tarea_en_curso_idx'),
+        ]
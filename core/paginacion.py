@@ -0,0 +1,62 @@
+"""Paginación por cursor (keyset) sobre ``(fecha_hora, id)``.
+
+En lugar de ``OFFSET``, cada página continúa desde la última fila vista con
+``WHERE (fecha_hora, id) < (cursor)``. Con el índice compuesto de ``Reserva``
+el costo de una página es el mismo sin importar cuán atrás esté.
+
+El cursor es opaco para el cliente: va firmado para que no se pueda fabricar
+ni depender de su contenido.
+"""
+from datetime import datetime
+
+from django.core import signing
+from django.db.models import Q
+
+ORDEN = ('-fecha_hora', '-id')
+SAL_CURSOR = 'core.paginacion.cursor'
+TAMANO_PAGINA = 20
+TAMANO_MAXIMO = 100
+
+
+class CursorInvalido(ValueError):
+    """El cursor no fue generado por este servidor o está dañado"""
+
+
+def codificar_cursor(reserva):
+    return signing.dumps([reserva.fecha_hora.isoformat(), reserva.id], salt=SAL_CURSOR)
+
+
+def decodificar_cursor(cursor):
+    try:
+        fecha_hora, reserva_id = signing.loads(cursor, salt=SAL_CURSOR)
+        return datetime.fromisoformat(fecha_hora), int(reserva_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise CursorInvalido('El cursor no es válido')
+
+
+def _desde_cursor(queryset, cursor):
+    queryset = queryset.order_by(*ORDEN)
+    if cursor:
+        fecha_hora, reserva_id = decodificar_cursor(cursor)
+        queryset = queryset.filter(
+            Q(fecha_hora__lt=fecha_hora) | Q(fecha_hora=fecha_hora, id__lt=reserva_id)
+        )
+    return queryset
+
+
+def _cortar(filas, tamano):
+    # Se pide una fila de más: indica si hay otra página sin hacer un COUNT
+    if len(filas) <= tamano:
+        return filas, None
+    filas = filas[:tamano]
+    return filas, codificar_cursor(filas[-1])
+
+
+def paginar(queryset, cursor=None, tamano=TAMANO_PAGINA):
+    """Devuelve ``(filas, siguiente_cursor)``; ``siguiente_cursor`` es None en la última página"""
+    return _cortar(list(_desde_cursor(queryset, cursor)[:tamano + 1]), tamano)
+
+
+async def apaginar(queryset, cursor=None, tamano=TAMANO_PAGINA):
+    """Versión asíncrona de ``paginar``"""
+    return _cortar([fila async for fila in _desde_cursor(queryset, cursor)[:tamano + 1]], tamano)
@@ -0,0 +1,403 @@
+"""Creación de reservas segura ante concurrencia.
+
+Cada reserva ocupa ``[fecha_hora, fecha_fin)`` según la duración del
+servicio. Se acepta si en ningún instante de ese intervalo supera la
+capacidad del servicio (``Servicio.capacidad``) ni la de la sala
+(``settings.CAPACIDAD_SALA``). La verificación (una consulta por rango y un
+``IndiceIntervalos`` en memoria) va en la misma transacción que la inserción,
+después de ``disponibilidad.bloquear_agenda``: SQLite serializa las
+escrituras (una transacción que leyó antes de que otra insertara falla con la
+base bloqueada al escribir y se reintenta entera) y en Postgres un advisory
+lock hace esperar a la siguiente verificación hasta el commit.
+"""
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, OperationalError
+from django.db.models import Q
+from django.utils import timezone
+
+from . import avisos, disponibilidad, estadisticas, resumenes
+from .intervalos import IndiceIntervalos
+from .models import Reserva, Servicio
+from .signals import reservas_creadas_en_bloque
+
+ESTADO_PENDIENTE = 1
+ESTADO_CONFIRMADO = 2
+ESTADO_CANCELADO = 3
+REINTENTOS_BLOQUEO = 8
+ESPERA_BLOQUEO = 0.05
+LIMITE_LOTE = 100
+
+
+class TurnoOcupado(ValidationError):
+    """El intervalo de la reserva supera la capacidad del servicio o de la sala"""
+
+
+def validar_horario(fecha_hora, now=None):
+    """Validar que el horario cumpla con las reglas de negocio"""
+    try:
+        fecha_hora_local = timezone.localtime(fecha_hora)
+        now = now or timezone.now()
+        # Validación de fecha pasada con margen de 5 minutos
+        if fecha_hora_local < now - disponibilidad.MARGEN_PASADO:
+            raise ValidationError('No se pueden hacer reservas en el pasado')
+        # Validar que no sea más de 30 días en el futuro
+        if fecha_hora_local > now + timedelta(days=disponibilidad.DIAS_ANTICIPACION):
+            raise ValidationError('No se pueden hacer reservas con más de 30 días de anticipación')
+        # Validar horario de atención (8 AM - 6 PM)
+        hora = fecha_hora_local.hour
+        minuto = fecha_hora_local.minute
+        if hora < disponibilidad.HORA_APERTURA or (hora >= disponibilidad.HORA_CIERRE and minuto > 0):
+            raise ValidationError('El horario de atención es de 8:00 AM a 6:00 PM')
+        # Validar que no sea en fin de semana
+        if fecha_hora_local.weekday() >= 5:
+            raise ValidationError('No se atiende los fines de semana')
+        # Validar que sea en intervalos de 30 minutos
+        if minuto % disponibilidad.INTERVALO_MINUTOS:
+            raise ValidationError('Las reservas deben ser en intervalos de 30 minutos')
+        return True
+    except ValidationError:
+        raise
+    except Exception as e:
+        raise ValidationError(f'Error al validar el horario: {str(e)}')
+
+
+def parsear_fecha_hora(valor):
+    """Convierte el valor ISO del formulario en un datetime aware (zona local si no trae zona)"""
+    try:
+        fecha_hora = datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise ValidationError('La fecha y hora no tienen un formato válido')
+    if timezone.is_naive(fecha_hora):
+        fecha_hora = timezone.make_aware(fecha_hora)
+    return fecha_hora
+
+
+def _base_bloqueada(error):
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+def _con_reintentos(escritura):
+    """Ejecuta ``escritura`` en una transacción, reintentando si SQLite está bloqueada"""
+    for intento in range(REINTENTOS_BLOQUEO):
+        try:
+            with transaction.atomic():
+                return escritura()
+        except OperationalError as e:
+            if not _base_bloqueada(e) or intento == REINTENTOS_BLOQUEO - 1:
+                raise
+            # Espera exponencial con jitter para que los escritores no reintenten a la vez
+            time.sleep(random.uniform(0, ESPERA_BLOQUEO * 2 ** intento))
+
+
+def _verificar_capacidad(reservas):
+    """Lanza TurnoOcupado si las ``reservas`` (sin guardar) no entran juntas en la agenda actual"""
+    intervalos = [(reserva.fecha_hora, reserva.fecha_fin) for reserva in reservas]
+    agenda = disponibilidad.agenda(intervalos)
+    for reserva in reservas:
+        if not disponibilidad.admite(agenda, reserva.servicio, reserva.fecha_hora, reserva.fecha_fin):
+            raise TurnoOcupado('El horario seleccionado no está disponible')
+        agenda.agregar(reserva.fecha_hora, reserva.fecha_fin, reserva.servicio_id)
+
+
+def reservar_turno(usuario, servicio, fecha_hora, estado_reserva_id=ESTADO_PENDIENTE):
+    """Inserta la reserva o lanza TurnoOcupado si se superpone con reservas activas más allá de la capacidad"""
+    def crear():
+        reserva = Reserva(
+            usuario=usuario,
+            servicio=servicio,
+            fecha_hora=fecha_hora,
+            fecha_fin=fecha_hora + timedelta(minutes=servicio.duracion),
+            estado_reserva_id=estado_reserva_id
+        )
+        if estado_reserva_id in disponibilidad.ESTADOS_ACTIVOS:
+            _verificar_capacidad([reserva])
+        reserva.save(force_insert=True)
+        # Los correos los envía el trabajador de tareas, fuera de la solicitud
+        avisos.reservas_creadas([reserva])
+        return reserva
+
+    return _con_reintentos(crear)
+
+
+def _error(resultado, mensaje, conflicto=False):
+    resultado.update(success=False, error=mensaje)
+    if conflicto:
+        resultado['conflicto'] = True
+
+
+def reservar_lote(usuario, items, todo_o_nada=True):
+    """Valida y crea varias reservas de una vez.
+
+    ``items`` es una lista de dicts con ``servicio`` (id) y ``fecha_hora`` (ISO).
+    Devuelve los resultados por ítem, en el mismo orden, y las reservas creadas.
+    Con ``todo_o_nada`` no se crea ninguna si alguna falla; si no, se crean las
+    que sean válidas.
+    """
+    ahora = timezone.now()
+    resultados = []
+    candidatos = {}
+
+    # Reglas de negocio: solo cálculo en memoria, sin consultas
+    for indice, item in enumerate(items):
+        resultado = {'indice': indice}
+        resultados.append(resultado)
+        if not isinstance(item, dict):
+            _error(resultado, 'Cada reserva debe ser un objeto con servicio y fecha_hora')
+            continue
+        resultado.update(servicio=item.get('servicio'), fecha_hora=item.get('fecha_hora'))
+        try:
+            servicio_id = int(item.get('servicio'))
+            fecha_hora = parsear_fecha_hora(item.get('fecha_hora'))
+            validar_horario(fecha_hora, ahora)
+        except (TypeError, ValueError):
+            _error(resultado, 'El servicio debe ser un id numérico')
+            continue
+        except ValidationError as e:
+            _error(resultado, e.messages[0])
+            continue
+        candidatos[indice] = (servicio_id, fecha_hora)
+
+    # Una consulta para los servicios y otra para las reservas activas que se superponen con el lote
+    servicios = Servicio.objects.filter(
+        id__in={servicio_id for servicio_id, _ in candidatos.values()},
+        estado_servicio=1
+    ).in_bulk()
+    for indice, (servicio_id, _) in list(candidatos.items()):
+        if servicio_id not in servicios:
+            _error(resultados[indice], 'El servicio no existe o no está activo')
+            del candidatos[indice]
+    intervalos = {
+        indice: (fecha_hora, fecha_hora + timedelta(minutes=servicios[servicio_id].duracion))
+        for indice, (servicio_id, fecha_hora) in candidatos.items()
+    }
+    activas = list(disponibilidad.activas_en(intervalos.values()))
+    en_base = IndiceIntervalos(activas)
+    con_lote = IndiceIntervalos(activas)
+
+    for indice, (servicio_id, _) in list(candidatos.items()):
+        servicio = servicios[servicio_id]
+        inicio, fin = intervalos[indice]
+        if not disponibilidad.admite(en_base, servicio, inicio, fin):
+            _error(resultados[indice], 'El horario seleccionado no está disponible', conflicto=True)
+        elif not disponibilidad.admite(con_lote, servicio, inicio, fin):
+            _error(resultados[indice], 'El horario se superpone con otra reserva del lote', conflicto=True)
+        else:
+            con_lote.agregar(inicio, fin, servicio_id)
+            continue
+        del candidatos[indice]
+
+    if todo_o_nada and len(candidatos) < len(items):
+        for indice in candidatos:
+            _error(resultados[indice], 'No se creó porque otras reservas del lote tienen errores')
+        return resultados, []
+
+    nuevas = {
+        indice: Reserva(
+            usuario=usuario,
+            servicio=servicios[servicio_id],
+            fecha_hora=fecha_hora,
+            fecha_fin=intervalos[indice][1],
+            estado_reserva_id=ESTADO_PENDIENTE
+        )
+        for indice, (servicio_id, fecha_hora) in candidatos.items()
+    }
+    try:
+        def crear():
+            # Repetir la verificación dentro de la transacción que inserta
+            _verificar_capacidad(list(nuevas.values()))
+            creadas = Reserva.objects.bulk_create(list(nuevas.values()))
+            # bulk_create no dispara post_save: aplicar a mano sus efectos (cache, estadísticas) en la misma
+            # transacción, así un reintento los vuelve a aplicar junto con la inserción
+            reservas_creadas_en_bloque(creadas)
+            avisos.reservas_creadas(creadas)
+            return creadas
+
+        _con_reintentos(crear)
+    except TurnoOcupado:
+        # Otra solicitud tomó algún turno entre la validación y la inserción
+        if todo_o_nada:
+            for resultado in (resultados[indice] for indice in nuevas):
+                _error(resultado, 'El lote no se pudo crear porque algún horario dejó de estar disponible', conflicto=True)
+            return resultados, []
+        for indice, reserva in list(nuevas.items()):
+            try:
+                nuevas[indice] = reservar_turno(usuario, reserva.servicio, reserva.fecha_hora)
+            except TurnoOcupado as e:
+                _error(resultados[indice], e.messages[0], conflicto=True)
+                del nuevas[indice]
+
+    for indice, reserva in nuevas.items():
+        resultados[indice].update(success=True, id=reserva.id, fecha_hora=reserva.fecha_hora.isoformat())
+    return resultados, list(nuevas.values())
+
+
+def vencer_pendientes(ttl, ahora=None, tamano_lote=1000, pausa=0):
+    """Cancela las reservas pendientes creadas hace más de ``ttl`` o cuyo turno ya pasó.
+
+    Trabaja por lotes de ``tamano_lote`` filas, cada uno en su propia
+    transacción corta (un SELECT, un UPDATE por id y el ajuste agrupado de
+    las estadísticas y los resúmenes), para no retener el bloqueo de
+    escritura de SQLite mientras recorre millones de filas. Las filas actualizadas dejan de
+    cumplir el filtro, así que no hace falta un cursor. El UPDATE vuelve a
+    exigir que sigan pendientes: si otro proceso confirmó o canceló alguna
+    entre el SELECT y el UPDATE, los ajustes cuentan solo las que canceló este.
+    Devuelve la cantidad de reservas canceladas.
+    """
+    ahora = ahora or timezone.now()
+    vencidas = Reserva.objects.filter(estado_reserva_id=ESTADO_PENDIENTE).filter(
+        Q(creada__lt=ahora - ttl) | Q(fecha_hora__lt=ahora)
+    ).order_by().values('id', *estadisticas.CAMPOS_DATOS)
+
+    def cancelar_lote():
+        leidas = list(vencidas[:tamano_lote])
+        ids = [reserva['id'] for reserva in leidas]
+        marca = timezone.now()
+        actualizadas = Reserva.objects.filter(id__in=ids, estado_reserva_id=ESTADO_PENDIENTE).update(
+            estado_reserva_id=ESTADO_CANCELADO, actualizada=marca
+        )
+        canceladas = leidas
+        if actualizadas != len(leidas):
+            # Otro proceso cambió algunas después del SELECT: la marca identifica las que canceló este UPDATE
+            propias = set(Reserva.objects.filter(
+                id__in=ids, estado_reserva_id=ESTADO_CANCELADO, actualizada=marca
+            ).values_list('id', flat=True))
+            canceladas = [reserva for reserva in leidas if reserva['id'] in propias]
+        # Estadísticas y resúmenes en la misma transacción, como las señales de post_save
+        estadisticas.registrar_cambios_de_estado(canceladas, ESTADO_CANCELADO)
+        resumenes.registrar_cambios([
+            (reserva, dict(reserva, estado_reserva_id=ESTADO_CANCELADO)) for reserva in canceladas
+        ])
+        return leidas, canceladas
+
+    total = 0
+    while True:
+        leidas, canceladas = _con_reintentos(cancelar_lote)
+        if not leidas:
+            break
+        disponibilidad.invalidar([reserva['fecha_hora'] for reserva in canceladas])
+        total += len(canceladas)
+        if pausa:
+            # Deja pasar a las escrituras de las solicitudes entre lote y lote
+            time.sleep(pausa)
+    return total
+
+
+def _turnos_por_cercania(fecha_hora, turnos, max_corrimiento=None):
+    """``turnos`` del más cercano al más lejano de ``fecha_hora`` (el anterior primero si empatan)"""
+    if max_corrimiento is not None:
+        turnos = [turno for turno in turnos if abs(turno - fecha_hora) <= max_corrimiento]
+    return sorted(turnos, key=lambda turno: (abs(turno - fecha_hora), turno))
+
+
+def _asignar_turnos(reservas, ahora, max_corrimiento=None):
+    """Asigna a cada reserva pendiente, en orden, el turno libre más cercano al pedido en el mismo día.
+
+    Devuelve ``(asignadas, sin_lugar)``: pares ``(reserva, fecha_hora)`` y las
+    reservas que no entran en ningún turno.
+    """
+    if not reservas:
+        return [], []
+    disponibilidad.bloquear_agenda()
+    fechas = {timezone.localtime(reserva.fecha_hora).date() for reserva in reservas}
+    desde, hasta = min(fechas), max(fechas)
+    bloqueados = disponibilidad.turnos_bloqueados(desde, hasta)
+    turnos = {}
+    for fecha, bloqueado in bloqueados.items():
+        habilitados = disponibilidad.mascara_vigencia(fecha, ahora) & ~bloqueado
+        # En UTC, como los que vienen de la base: comparar datetimes con el mismo tzinfo no consulta la zona
+        turnos[fecha] = [
+            disponibilidad.inicio_turno(fecha, turno).astimezone(dt_timezone.utc)
+            for turno in range(disponibilidad.TOTAL_TURNOS) if habilitados >> turno & 1
+        ]
+
+    # Una consulta para todo el período; las pendientes que se planifican todavía no ocupan lugar
+    activas = Counter()
+    for inicio, fin, servicio_id, cantidad in disponibilidad.activas_en([(
+        disponibilidad.inicio_turno(desde, 0),
+        disponibilidad.inicio_turno(hasta, disponibilidad.TOTAL_TURNOS - 1) + disponibilidad.DURACION_MAXIMA,
+    )]):
+        activas[inicio, fin, servicio_id] += cantidad
+    activas.subtract((reserva.fecha_hora, reserva.fecha_fin, reserva.servicio_id) for reserva in reservas)
+    agenda = IndiceIntervalos(
+        (inicio, fin, servicio_id, cantidad)
+        for (inicio, fin, servicio_id), cantidad in activas.items() if cantidad > 0
+    )
+
+    asignadas, sin_lugar = [], []
+    for reserva in reservas:
+        fecha = timezone.localtime(reserva.fecha_hora).date()
+        duracion = timedelta(minutes=reserva.servicio.duracion)
+        for inicio in _turnos_por_cercania(reserva.fecha_hora, turnos[fecha], max_corrimiento):
+            fin = inicio + duracion
+            if (not (bloqueados[fecha] and disponibilidad.mascara_intervalo(inicio, fin) & bloqueados[fecha])
+                    and disponibilidad.admite(agenda, reserva.servicio, inicio, fin)):
+                agenda.agregar(inicio, fin, reserva.servicio_id)
+                asignadas.append((reserva, inicio))
+                break
+        else:
+            sin_lugar.append(reserva)
+    return asignadas, sin_lugar
+
+
+def _confirmar_asignadas(asignadas):
+    """Guarda los turnos asignados y confirma las reservas con ``bulk_update`` (sin señales)"""
+    ahora = timezone.now()
+    filas, cambios, movidas = [], [], set()
+    for reserva, fecha_hora in asignadas:
+        anterior = estadisticas.datos_reserva(reserva)
+        if fecha_hora != reserva.fecha_hora:
+            movidas.add(reserva.usuario_id)
+            reserva.fecha_hora = fecha_hora
+            reserva.fecha_fin = reserva.calcular_fin()
+        reserva.estado_reserva_id = ESTADO_CONFIRMADO
+        reserva.actualizada = ahora
+        filas.append(dict(anterior, id=reserva.pk))
+        cambios.append((anterior, estadisticas.datos_reserva(reserva)))
+    Reserva.objects.bulk_update(
+        [reserva for reserva, _ in asignadas],
+        ['fecha_hora', 'fecha_fin', 'estado_reserva', 'actualizada']
+    )
+    # Estadísticas y resúmenes en la misma transacción, como en vencer_pendientes
+    estadisticas.registrar_cambios_de_estado(filas, ESTADO_CONFIRMADO)
+    # Un cambio de horario puede adelantar la próxima reserva del usuario
+    for usuario_id in movidas:
+        estadisticas.recalcular(usuario_id, ahora)
+    resumenes.registrar_cambios(cambios)
+
+
+def planificar_pendientes(pendientes, ahora=None, max_corrimiento=timedelta(0), simular=False):
+    """Confirma en lote las reservas pendientes de ``pendientes`` en turnos sin conflictos.
+
+    Las reservas se toman en orden de creación. Cada una queda en su turno si
+    entra, o si no en el turno habilitado más cercano del mismo día a lo sumo
+    ``max_corrimiento`` de distancia (por defecto ninguno: solo se confirman
+    las que entran en su turno; ``None`` permite todo el día). A cada usuario
+    con reservas movidas se le encola un aviso. Para entrar, la reserva no puede superar la capacidad
+    del servicio ni la de la sala, contando las confirmadas, las pendientes
+    que no se planifican y las ya asignadas. El cálculo es voraz y en memoria.
+    La lectura y todas las escrituras van en una sola transacción. Las que no
+    entran quedan pendientes. Devuelve ``(asignadas, sin_lugar)``: ternas
+    ``(reserva, fecha_hora pedida, fecha_hora asignada)`` y las reservas sin
+    turno. Con ``simular`` no guarda nada.
+    """
+    ahora = ahora or timezone.now()
+    reservas = pendientes.filter(estado_reserva_id=ESTADO_PENDIENTE).select_related('servicio').order_by('creada', 'id')
+
+    def planificar():
+        asignadas, sin_lugar = _asignar_turnos(list(reservas), ahora, max_corrimiento)
+        resultado = [(reserva, reserva.fecha_hora, fecha_hora) for reserva, fecha_hora in asignadas]
+        if not simular:
+            _confirmar_asignadas(asignadas)
+            avisos.turnos_cambiados([(reserva, pedida) for reserva, pedida, asignada in resultado if pedida != asignada])
+        return resultado, sin_lugar
+
+    asignadas, sin_lugar = _con_reintentos(planificar)
+    if not simular:
+        disponibilidad.invalidar([fecha_hora for _, pedida, asignada in asignadas for fecha_hora in (pedida, asignada)])
+    return asignadas, sin_lugar
@@ -0,0 +1,160 @@
+"""Resúmenes de reservas por día, servicio y estado para los reportes.
+
+Cada alta, cambio o baja de una reserva suma o resta una unidad en la fila
+``(fecha, servicio, estado)`` que le corresponde, dentro de la misma
+transacción, así los reportes de ocupación e ingresos leen unas pocas filas
+por día en lugar de agrupar toda la tabla de reservas. Los minutos y los
+ingresos son siempre ``reservas`` por la duración y el precio actuales del
+servicio (no hay un precio histórico por reserva con el que reconstruirlos):
+si el servicio cambia, ``recalcular_servicio`` los vuelve a multiplicar.
+``reconstruir`` regenera las filas desde las reservas.
+"""
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Reserva, ResumenDiario, Servicio
+
+ESTADOS_ACTIVOS = (1, 2)
+TAMANO_LOTE = 500
+AGRUPACIONES = {
+    'dia': F('fecha'),
+    'semana': TruncWeek('fecha'),
+    'mes': TruncMonth('fecha'),
+}
+
+
+def fecha_local(fecha_hora):
+    return timezone.localtime(fecha_hora, timezone.get_default_timezone()).date()
+
+
+def _clave(datos):
+    return fecha_local(datos['fecha_hora']), datos['servicio_id'], datos['estado_reserva_id']
+
+
+def registrar_cambios(cambios):
+    """Aplica una lista de cambios ``(anterior, actual)``.
+
+    ``anterior`` y ``actual`` son los datos de la reserva (ver
+    ``estadisticas.datos_reserva``) antes y después del cambio, ``None`` si no
+    existía o se borró. Las diferencias se agrupan por fila; las filas
+    afectadas se bloquean, se recalculan en memoria y se guardan con un solo
+    upsert, así la cantidad de consultas no depende de cuántas reservas
+    cambiaron.
+    """
+    deltas = Counter()
+    for anterior, actual in cambios:
+        if anterior:
+            deltas[_clave(anterior)] -= 1
+        if actual:
+            deltas[_clave(actual)] += 1
+    deltas = {clave: n for clave, n in deltas.items() if n}
+    if not deltas:
+        return
+    ahora = timezone.now()
+    fechas, servicio_ids, estado_ids = (set(valores) for valores in zip(*deltas))
+    with transaction.atomic():
+        # Solo las sumas necesitan la fila; ignore_conflicts cubre las que ya existen
+        ResumenDiario.objects.bulk_create([
+            ResumenDiario(fecha=fecha, servicio_id=servicio_id, estado_reserva_id=estado_id)
+            for (fecha, servicio_id, estado_id), n in deltas.items() if n > 0
+        ], ignore_conflicts=True)
+        actuales = {
+            (fecha, servicio_id, estado_id): reservas
+            for fecha, servicio_id, estado_id, reservas in ResumenDiario.objects.select_for_update().filter(
+                fecha__in=fechas, servicio_id__in=servicio_ids, estado_reserva_id__in=estado_ids
+            ).values_list('fecha', 'servicio_id', 'estado_reserva_id', 'reservas')
+        }
+        servicios = Servicio.objects.only('duracion', 'precio').in_bulk(servicio_ids)
+        filas = []
+        for (fecha, servicio_id, estado_id), n in deltas.items():
+            reservas = actuales.get((fecha, servicio_id, estado_id))
+            if reservas is None:
+                # Una resta sin fila previa: no hay base, lo corrige reconstruir_resumenes
+                continue
+            reservas += n
+            servicio = servicios[servicio_id]
+            filas.append(ResumenDiario(
+                fecha=fecha, servicio_id=servicio_id, estado_reserva_id=estado_id, reservas=reservas,
+                minutos=reservas * servicio.duracion, ingresos=reservas * servicio.precio, actualizado=ahora,
+            ))
+        ResumenDiario.objects.bulk_create(
+            filas,
+            batch_size=TAMANO_LOTE,
+            update_conflicts=True,
+            unique_fields=['fecha', 'servicio', 'estado_reserva'],
+            update_fields=['reservas', 'minutos', 'ingresos', 'actualizado'],
+        )
+
+
+def registrar_cambio(anterior, actual):
+    registrar_cambios([(anterior, actual)])
+
+
+def recalcular_servicio(servicio):
+    """Vuelve a calcular minutos e ingresos del servicio tras cambiar su duración o precio"""
+    ResumenDiario.objects.filter(servicio=servicio).update(
+        minutos=F('reservas') * servicio.duracion,
+        ingresos=F('reservas') * servicio.precio,
+        actualizado=timezone.now(),
+    )
+
+
+def reconstruir(desde=None, hasta=None, tamano_lote=1000):
+    """Regenera los resúmenes de ``desde`` a ``hasta`` (todos si no se indican) con una consulta agrupada.
+
+    La lectura va en la misma transacción que el reemplazo: un cambio de
+    reserva que se confirme entre las dos no queda afuera ni contado dos veces.
+    """
+    zona = timezone.get_default_timezone()
+    reservas = Reserva.objects.order_by()
+    resumenes = ResumenDiario.objects.all()
+    if desde:
+        reservas = reservas.filter(fecha_hora__gte=timezone.make_aware(datetime.combine(desde, time.min), zona))
+        resumenes = resumenes.filter(fecha__gte=desde)
+    if hasta:
+        limite = datetime.combine(hasta + timedelta(days=1), time.min)
+        reservas = reservas.filter(fecha_hora__lt=timezone.make_aware(limite, zona))
+        resumenes = resumenes.filter(fecha__lte=hasta)
+    with transaction.atomic():
+        servicios = {servicio.pk: servicio for servicio in Servicio.objects.only('duracion', 'precio')}
+        grupos = reservas.values_list(
+            TruncDate('fecha_hora', tzinfo=zona), 'servicio_id', 'estado_reserva_id'
+        ).annotate(n=Count('id'))
+        nuevos = [
+            ResumenDiario(
+                fecha=fecha, servicio_id=servicio_id, estado_reserva_id=estado_id, reservas=n,
+                minutos=n * servicios[servicio_id].duracion, ingresos=n * servicios[servicio_id].precio,
+            )
+            for fecha, servicio_id, estado_id, n in grupos
+        ]
+        resumenes.delete()
+        ResumenDiario.objects.bulk_create(nuevos, batch_size=tamano_lote)
+    return len(nuevos)
+
+
+def reporte(desde, hasta, agrupar='dia', servicio_id=None):
+    """Reservas, minutos e ingresos por período, servicio y estado, leídos solo de los resúmenes"""
+    resumenes = ResumenDiario.objects.filter(fecha__range=(desde, hasta)).exclude(reservas=0)
+    if servicio_id:
+        resumenes = resumenes.filter(servicio_id=servicio_id)
+    return resumenes.values(
+        'servicio_id', 'estado_reserva_id', periodo=AGRUPACIONES[agrupar], servicio_nombre=F('servicio__nombre')
+    ).annotate(
+        total_reservas=Sum('reservas'), total_minutos=Sum('minutos'), total_ingresos=Sum('ingresos')
+    ).order_by('periodo', 'servicio_nombre', 'estado_reserva_id')
+
+
+def totales_por_servicio(resumenes):
+    """Conteos por estado, minutos activos e ingresos confirmados de cada servicio, para el admin"""
+    return resumenes.order_by().values('servicio__nombre').annotate(
+        pendientes=Sum('reservas', filter=Q(estado_reserva_id=1), default=0),
+        confirmadas=Sum('reservas', filter=Q(estado_reserva_id=2), default=0),
+        canceladas=Sum('reservas', filter=Q(estado_reserva_id=3), default=0),
+        minutos_activos=Sum('minutos', filter=Q(estado_reserva_id__in=ESTADOS_ACTIVOS), default=0),
+        ingresos_confirmados=Sum('ingresos', filter=Q(estado_reserva_id=2), default=0),
+    ).order_by('servicio__nombre')
@@ -1,34 +1,60 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import Usuario, Servicio, Reserva, Horario, Categoria, Recurso
+from .models import Usuario, Servicio, Reserva, Horario
+from .reservas import validar_horario
+
+class CamposDinamicosMixin:
+    """Permite pedir solo algunos campos con ``?fields=id,nombre``"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        pedidos = request.query_params.get('fields') if request is not None else None
+        if not pedidos:
+            return
+        pedidos = {campo.strip() for campo in pedidos.split(',') if campo.strip()}
+        desconocidos = pedidos - set(self.fields)
+        if desconocidos:
+            raise serializers.ValidationError({
+                'fields': f'Campos desconocidos: {", ".join(sorted(desconocidos))}'
+            })
+        for campo in set(self.fields) - pedidos:
+            self.fields.pop(campo)
 
 class UsuarioSerializer(serializers.ModelSerializer):
     class Meta:
         model = Usuario
-        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'tipo')
+        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'tipo_usuario')
         extra_kwargs = {'password': {'write_only': True}}
 
-class ServicioSerializer(serializers.ModelSerializer):
+class ServicioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Servicio
         fields = '__all__'
 
-class ReservaSerializer(serializers.ModelSerializer):
+class ReservaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    servicio = serializers.PrimaryKeyRelatedField(queryset=Servicio.objects.filter(estado_servicio=1))
+    servicio_nombre = serializers.CharField(source='servicio.nombre', read_only=True)
+    estado = serializers.CharField(source='nombre_estado', read_only=True)
+
     class Meta:
         model = Reserva
-        fields = '__all__'
-        read_only_fields = ('creada',)
+        fields = (
+            'id', 'usuario', 'servicio', 'servicio_nombre', 'fecha_hora', 'fecha_fin',
+            'estado_reserva', 'estado', 'creada', 'actualizada'
+        )
+        read_only_fields = ('usuario', 'estado_reserva', 'creada', 'actualizada')
 
-class HorarioSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Horario
-        fields = '__all__'
+    def validate_fecha_hora(self, valor):
+        try:
+            validar_horario(valor)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return valor
 
-class CategoriaSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Categoria
-        fields = '__all__'
+class HorarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    disponible = serializers.BooleanField(read_only=True)
 
-class RecursoSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Recurso
-        fields = '__all__'
\ No newline at end of file
+        model = Horario
+        fields = '__all__'
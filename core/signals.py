@@ -0,0 +1,154 @@
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import autenticacion, busqueda, catalogos, disponibilidad, destacados, estadisticas, resumenes
+from .models import Reserva, Horario, Servicio, Usuario
+
+
+def _recordar_valores(instance, *campos):
+    instance._valores_originales = {campo: getattr(instance, campo) for campo in campos}
+
+
+def _datos_anteriores(instance):
+    """Datos de la reserva antes de este save, o None si no se conocen (instancia diferida o creada a mano)"""
+    originales = getattr(instance, '_valores_originales', {})
+    if all(campo in originales for campo in estadisticas.CAMPOS_DATOS):
+        return {campo: originales[campo] for campo in estadisticas.CAMPOS_DATOS}
+    return None
+
+
+@receiver(post_save, sender=Reserva)
+def actualizar_disponibilidad_reserva(sender, instance, created, **kwargs):
+    originales = getattr(instance, '_valores_originales', {})
+    if not created and _datos_anteriores(instance) == estadisticas.datos_reserva(instance):
+        # Ni el turno, ni el servicio (la duración) ni el estado cambiaron
+        return
+    fechas = [instance.fecha_hora]
+    anterior = originales.get('fecha_hora')
+    if anterior is not None and anterior != instance.fecha_hora:
+        # La reserva cambió de turno: el turno anterior puede haber quedado libre
+        fechas.append(anterior)
+    disponibilidad.invalidar(fechas)
+
+
+@receiver(post_save, sender=Reserva)
+def actualizar_destacados_reserva(sender, instance, created, **kwargs):
+    servicio_anterior = getattr(instance, '_valores_originales', {}).get('servicio_id')
+    if created:
+        destacados.ajustar(instance.servicio_id, 1)
+    elif servicio_anterior is not None and servicio_anterior != instance.servicio_id:
+        destacados.ajustar(servicio_anterior, -1)
+        destacados.ajustar(instance.servicio_id, 1)
+
+
+@receiver(post_save, sender=Reserva)
+def actualizar_estadisticas_reserva(sender, instance, created, **kwargs):
+    actual = estadisticas.datos_reserva(instance)
+    if created:
+        estadisticas.registrar_cambio(None, actual, instance.pk)
+        return
+    anterior = _datos_anteriores(instance)
+    if anterior is None:
+        estadisticas.recalcular(instance.usuario_id)
+    elif anterior != actual:
+        estadisticas.registrar_cambio(anterior, actual, instance.pk)
+
+
+@receiver(post_save, sender=Reserva)
+def actualizar_resumenes_reserva(sender, instance, created, **kwargs):
+    actual = estadisticas.datos_reserva(instance)
+    anterior = None if created else _datos_anteriores(instance)
+    if created or anterior is not None:
+        resumenes.registrar_cambio(anterior, actual)
+    else:
+        # Sin los valores previos solo se puede rehacer el día actual; si la
+        # reserva cambió de día, el anterior queda desfasado hasta reconstruir_resumenes
+        fecha = resumenes.fecha_local(instance.fecha_hora)
+        resumenes.reconstruir(fecha, fecha)
+
+
+@receiver(post_save, sender=Reserva)
+def recordar_valores_reserva(sender, instance, **kwargs):
+    # Se registra al final para que los receptores anteriores vean los valores previos
+    _recordar_valores(instance, *estadisticas.CAMPOS_DATOS)
+
+
+@receiver(post_delete, sender=Reserva)
+def liberar_turno_reserva(sender, instance, **kwargs):
+    disponibilidad.invalidar([instance.fecha_hora])
+    destacados.ajustar(instance.servicio_id, -1)
+    origen = kwargs.get('origin')
+    # Si se está borrando el usuario, su estadística se borra en cascada con él
+    if not (isinstance(origen, Usuario) and origen.pk == instance.usuario_id):
+        estadisticas.registrar_cambio(estadisticas.datos_reserva(instance), None, instance.pk)
+    resumenes.registrar_cambio(estadisticas.datos_reserva(instance), None)
+
+
+def reservas_creadas_en_bloque(reservas):
+    """Efectos de post_save para reservas insertadas con bulk_create, que no dispara señales"""
+    reservas = list(reservas)
+    disponibilidad.invalidar([reserva.fecha_hora for reserva in reservas])
+    for servicio_id in {reserva.servicio_id for reserva in reservas}:
+        destacados.ajustar(servicio_id, 1)
+    estadisticas.registrar_cambios([
+        (None, estadisticas.datos_reserva(reserva), reserva.pk) for reserva in reservas
+    ])
+    resumenes.registrar_cambios([(None, estadisticas.datos_reserva(reserva)) for reserva in reservas])
+
+
+def reservas_modificadas_en_bloque(afectadas, estado_nuevo):
+    """Efectos de post_save tras pasar reservas a ``estado_nuevo`` con QuerySet.update().
+
+    ``afectadas`` son los dicts de ``values(*estadisticas.CAMPOS_DATOS)`` leídos antes del UPDATE.
+    """
+    disponibilidad.invalidar([reserva['fecha_hora'] for reserva in afectadas])
+    for usuario_id in {reserva['usuario_id'] for reserva in afectadas}:
+        estadisticas.recalcular(usuario_id)
+    resumenes.registrar_cambios([(reserva, dict(reserva, estado_reserva_id=estado_nuevo)) for reserva in afectadas])
+
+
+@receiver([post_save, post_delete], sender=Servicio)
+def actualizar_destacados_servicio(sender, instance, **kwargs):
+    destacados.marcar_desactualizado()
+
+
+@receiver(post_save, sender=Servicio)
+def actualizar_resumenes_servicio(sender, instance, created, **kwargs):
+    originales = getattr(instance, '_valores_originales', {})
+    if not created and (originales.get('duracion') != instance.duracion or originales.get('precio') != instance.precio):
+        resumenes.recalcular_servicio(instance)
+    _recordar_valores(instance, 'duracion', 'precio')
+
+
+@receiver([post_save, post_delete], sender=Horario)
+def actualizar_disponibilidad_horario(sender, instance, **kwargs):
+    fechas = [instance.fecha]
+    anterior = getattr(instance, '_valores_originales', {}).get('fecha')
+    if anterior is not None:
+        fechas.append(anterior)
+    disponibilidad.invalidar(fechas)
+    _recordar_valores(instance, 'fecha')
+
+
+@receiver([post_save, post_delete], sender=Usuario)
+def invalidar_usuario_en_cache(sender, instance, **kwargs):
+    autenticacion.invalidar(instance)
+    _recordar_valores(instance, 'password')
+
+
+@receiver(post_migrate)
+def reponer_indice_busqueda(sender, using, **kwargs):
+    # Reconstruir core_servicio en una migración de SQLite borra sus triggers; si se
+    # volvió a una migración anterior a la del índice, no se crea de nuevo
+    if sender.name == 'core':
+        busqueda.reponer(connections[using])
+
+
+def invalidar_catalogo(sender, **kwargs):
+    catalogos.invalidar(sender)
+
+
+for modelo in catalogos.modelos():
+    post_save.connect(invalidar_catalogo, sender=modelo)
+    post_delete.connect(invalidar_catalogo, sender=modelo)
@@ -0,0 +1,163 @@
+"""Cola de tareas en la base de datos, sin broker externo.
+
+``encolar`` inserta la tarea en la misma transacción que el trabajo que la
+origina: aparece recién con el commit y, si la transacción se revierte, no
+existe. (Un ``transaction.on_commit`` dejaría una ventana en la que la reserva
+ya está confirmada pero la inserción de la tarea puede fallar, por ejemplo
+con la base bloqueada.) ``manage.py procesar_tareas``
+reclama lotes de tareas vencidas y las ejecuta; una tarea que falla vuelve a
+quedar pendiente con espera exponencial hasta agotar ``max_intentos``.
+
+El reclamo marca las tareas como ``en_curso`` con un vencimiento
+(``bloqueada_hasta``) y suma un intento: si el trabajador muere a mitad de
+un lote, otro las vuelve a tomar cuando vence, salvo que ya hayan agotado
+``max_intentos``, en cuyo caso quedan fallidas sin volver a ejecutarse (una
+tarea que tumba al trabajador no lo hace para siempre). Por eso las tareas
+deben tolerar ejecutarse más de una vez. El resultado se guarda solo si el
+reclamo sigue siendo de quien la ejecutó: si venció y otro trabajador la
+tomó, gana el reclamo más nuevo.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .models import Tarea
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 10
+MAX_INTENTOS = 5
+ESPERA_BASE = timedelta(seconds=30)
+ESPERA_MAXIMA = timedelta(hours=1)
+DURACION_RECLAMO = timedelta(minutes=5)
+
+_registro = {}
+
+
+class TareaDesconocida(LookupError):
+    """No hay ninguna función registrada con ese nombre"""
+
+
+def tarea(funcion):
+    """Registra ``funcion`` para que el trabajador pueda ejecutarla por nombre"""
+    funcion.nombre_tarea = f'{funcion.__module__}.{funcion.__qualname__}'
+    _registro[funcion.nombre_tarea] = funcion
+    return funcion
+
+
+def encolar(funcion, *, max_intentos=MAX_INTENTOS, **argumentos):
+    """Agrega la tarea dentro de la transacción actual; el trabajador la ve después del commit"""
+    if getattr(funcion, 'nombre_tarea', None) not in _registro:
+        raise TareaDesconocida(f'{funcion!r} no está registrada con @tarea')
+    return Tarea.objects.create(
+        nombre=funcion.nombre_tarea,
+        argumentos=argumentos,
+        max_intentos=max_intentos,
+        disponible_desde=timezone.now(),
+    )
+
+
+def nombre_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def espera(intentos):
+    """Espera antes del reintento número ``intentos``, con jitter para no reintentar todas juntas"""
+    base = min(ESPERA_BASE * 2 ** (intentos - 1), ESPERA_MAXIMA)
+    return base * random.uniform(0.5, 1)
+
+
+def reclamar(trabajador, tamano_lote=TAMANO_LOTE, ahora=None):
+    """Marca hasta ``tamano_lote`` tareas vencidas como propias y las devuelve"""
+    ahora = ahora or timezone.now()
+    reclamo_vencido = Q(estado=Tarea.EN_CURSO, bloqueada_hasta__lt=ahora)
+    reintentable = reclamo_vencido & Q(intentos__lt=F('max_intentos'))
+    vencidas = Tarea.objects.filter(
+        Q(estado=Tarea.PENDIENTE, disponible_desde__lte=ahora) | reintentable
+    ).order_by('disponible_desde', 'id')
+    with transaction.atomic():
+        # El último intento no terminó (el trabajador murió con ella): no se vuelve a ejecutar
+        agotadas = Tarea.objects.filter(reclamo_vencido, intentos__gte=F('max_intentos')).update(
+            estado=Tarea.FALLIDA, bloqueada_hasta=None, terminada=ahora,
+            ultimo_error=Concat(Value('El reclamo venció sin resultado en el último intento (trabajador '),
+                                F('trabajador'), Value(')')),
+        )
+        if agotadas:
+            logger.error('%s tareas fallidas: su último intento no terminó antes de que venciera el reclamo', agotadas)
+        if connection.features.has_select_for_update_skip_locked:
+            # Postgres: cada trabajador salta las filas que otro está reclamando
+            vencidas = vencidas.select_for_update(skip_locked=True)
+        ids = list(vencidas.values_list('id', flat=True)[:tamano_lote])
+        # En SQLite la transacción de escritura es exclusiva; el filtro repetido
+        # descarta las tareas que otro trabajador reclamó entre la lectura y el UPDATE
+        Tarea.objects.filter(Q(estado=Tarea.PENDIENTE) | reintentable, id__in=ids).update(
+            estado=Tarea.EN_CURSO, trabajador=trabajador, bloqueada_hasta=ahora + DURACION_RECLAMO,
+            # Se cuenta al reclamar: una tarea que tumba al trabajador también agota sus intentos
+            intentos=F('intentos') + 1,
+        )
+    return list(Tarea.objects.filter(id__in=ids, estado=Tarea.EN_CURSO, trabajador=trabajador).order_by('id'))
+
+
+def ejecutar(tarea_pendiente):
+    """Ejecuta una tarea reclamada y guarda el resultado; devuelve True si terminó bien"""
+    try:
+        funcion = _registro.get(tarea_pendiente.nombre)
+        if funcion is None:
+            raise TareaDesconocida(f'No hay ninguna tarea registrada como {tarea_pendiente.nombre}')
+        funcion(**tarea_pendiente.argumentos)
+    except Exception as e:
+        tarea_pendiente.ultimo_error = traceback.format_exc()
+        if isinstance(e, TareaDesconocida) or tarea_pendiente.intentos >= tarea_pendiente.max_intentos:
+            tarea_pendiente.estado = Tarea.FALLIDA
+            tarea_pendiente.terminada = timezone.now()
+            logger.error('Tarea %s (%s) fallida tras %s intentos', tarea_pendiente.pk, tarea_pendiente.nombre,
+                         tarea_pendiente.intentos, exc_info=True)
+        else:
+            tarea_pendiente.estado = Tarea.PENDIENTE
+            tarea_pendiente.disponible_desde = timezone.now() + espera(tarea_pendiente.intentos)
+            logger.warning('Tarea %s (%s) falló, se reintentará', tarea_pendiente.pk, tarea_pendiente.nombre)
+        exito = False
+    else:
+        tarea_pendiente.estado = Tarea.COMPLETADA
+        tarea_pendiente.terminada = timezone.now()
+        exito = True
+    tarea_pendiente.bloqueada_hasta = None
+    # Trabajador e intentos identifican este reclamo: si venció y otro la tomó, su resultado es el que vale
+    guardada = Tarea.objects.filter(
+        pk=tarea_pendiente.pk, estado=Tarea.EN_CURSO,
+        trabajador=tarea_pendiente.trabajador, intentos=tarea_pendiente.intentos
+    ).update(**{
+        campo: getattr(tarea_pendiente, campo)
+        for campo in ('estado', 'disponible_desde', 'bloqueada_hasta', 'ultimo_error', 'terminada')
+    })
+    if not guardada:
+        logger.warning('Tarea %s (%s): el reclamo venció antes de terminar, no se guarda este resultado',
+                       tarea_pendiente.pk, tarea_pendiente.nombre)
+    return exito
+
+
+def procesar_lote(trabajador=None, tamano_lote=TAMANO_LOTE):
+    """Reclama y ejecuta un lote; devuelve (completadas, fallidas)"""
+    trabajador = trabajador or nombre_trabajador()
+    completadas = fallidas = 0
+    for tarea_pendiente in reclamar(trabajador, tamano_lote):
+        if ejecutar(tarea_pendiente):
+            completadas += 1
+        else:
+            fallidas += 1
+    return completadas, fallidas
+
+
+def purgar(dias):
+    """Borra las tareas completadas hace más de ``dias`` días; las fallidas quedan para revisarlas"""
+    limite = timezone.now() - timedelta(days=dias)
+    borradas, _ = Tarea.objects.filter(estado=Tarea.COMPLETADA, terminada__lt=limite).delete()
+    return borradas
@@ -1,3 +1,1889 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+from io import StringIO
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.management.base import SystemCheckError
+from django.db import OperationalError, connection, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    autenticacion, avisos, busqueda, carga, catalogos, checks, disponibilidad, destacados, estadisticas, horarios, limites,
+    metricas, paginacion, resumenes,
+    tareas, views_async
+)
+from .intervalos import IndiceIntervalos
+from .models import (
+    Usuario, Servicio, Reserva, Horario, ClaveIdempotencia, EstadisticaUsuario, EstadoReserva, TipoUsuario, Tarea,
+    ResumenDiario
+)
+from .reservas import planificar_pendientes, reservar_lote, reservar_turno, vencer_pendientes, TurnoOcupado
+
+
+def proximo_lunes(dias_minimos=2):
+    """Primer lunes a partir de ``dias_minimos`` días desde hoy (siempre dentro de la ventana de 30 días)"""
+    fecha = timezone.localdate() + timedelta(days=dias_minimos)
+    return fecha + timedelta(days=(7 - fecha.weekday()) % 7)
+
+
+def turno(fecha, hora, minuto=0):
+    return timezone.make_aware(datetime.combine(fecha, time(hora, minuto)))
+
+
+class BaseReservaTestCase(TestCase):
+    fixtures = ['initial_data']
+
+    def setUp(self):
+        cache.clear()
+        # Los rollbacks de cada test no disparan señales: empezar con el catálogo vacío
+        catalogos.invalidar()
+        self.usuario = Usuario.objects.create_user(username='ana', password='clave-segura-123')
+        self.servicio = Servicio.objects.create(
+            nombre='Masaje', descripcion='Masaje terapéutico', duracion=60,
+            precio=25000, estado_servicio_id=1
+        )
+        self.lunes = proximo_lunes()
+
+    def reservar(self, fecha_hora, estado=1, **kwargs):
+        return Reserva.objects.create(
+            usuario=kwargs.get('usuario', self.usuario),
+            servicio=kwargs.get('servicio', self.servicio),
+            fecha_hora=fecha_hora,
+            estado_reserva_id=estado
+        )
+
+
+class DisponibilidadTests(BaseReservaTestCase):
+
+    def test_grilla_respeta_horario_de_atencion(self):
+        libres = disponibilidad.disponibilidad(self.lunes, self.lunes + timedelta(days=6))
+        self.assertEqual(libres[self.lunes], disponibilidad.GRILLA_COMPLETA)
+        self.assertEqual(disponibilidad.turnos_libres(libres[self.lunes])[0], '08:00')
+        self.assertEqual(disponibilidad.turnos_libres(libres[self.lunes])[-1], '18:00')
+        # Sábado y domingo no tienen turnos
+        self.assertEqual(libres[self.lunes + timedelta(days=5)], 0)
+        self.assertEqual(libres[self.lunes + timedelta(days=6)], 0)
+
+    def test_reserva_activa_ocupa_y_cancelacion_libera(self):
+        indice = disponibilidad.indice_turno(time(10, 30))
+        disponibilidad.disponibilidad(self.lunes, self.lunes)
+
+        reserva = self.reservar(turno(self.lunes, 10, 30))
+        libres = disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes]
+        self.assertFalse(libres >> indice & 1)
+
+        reserva.estado_reserva_id = 3
+        reserva.save()
+        libres = disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes]
+        self.assertTrue(libres >> indice & 1)
+
+    def test_mover_reserva_libera_turno_anterior(self):
+        reserva = self.reservar(turno(self.lunes, 9))
+        martes = self.lunes + timedelta(days=1)
+        disponibilidad.disponibilidad(self.lunes, martes)
+
+        reserva = Reserva.objects.get(pk=reserva.pk)
+        reserva.fecha_hora = turno(martes, 9)
+        reserva.save()
+        libres = disponibilidad.disponibilidad(self.lunes, martes)
+        indice = disponibilidad.indice_turno(time(9))
+        self.assertTrue(libres[self.lunes] >> indice & 1)
+        self.assertFalse(libres[martes] >> indice & 1)
+
+    def test_reserva_descarta_el_dia_otra_vez_al_confirmarse(self):
+        indice = disponibilidad.indice_turno(time(9))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.reservar(turno(self.lunes, 9))
+                # Otro proceso recalcula el día antes del commit, sin ver la reserva
+                cache.set(disponibilidad.clave_cache(self.lunes), 0)
+        libres = disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes]
+        self.assertFalse(libres >> indice & 1)
+
+    def test_guardar_sin_cambios_no_descarta_el_dia(self):
+        reserva = Reserva.objects.get(pk=self.reservar(turno(self.lunes, 9)).pk)
+        disponibilidad.disponibilidad(self.lunes, self.lunes)
+        reserva.save()
+        self.assertIsNotNone(cache.get(disponibilidad.clave_cache(self.lunes)))
+
+    def test_horario_no_disponible_bloquea_turnos(self):
+        Horario.objects.create(
+            fecha=self.lunes, hora_inicio=time(12), hora_fin=time(14), estado_horario_id=2
+        )
+        horas = disponibilidad.turnos_libres(disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes])
+        self.assertNotIn('12:00', horas)
+        self.assertNotIn('13:30', horas)
+        self.assertIn('14:00', horas)
+
+    def test_rango_completo_en_una_pasada_y_luego_desde_cache(self):
+        hasta = self.lunes + timedelta(days=13)
+        # Una consulta para reservas y otra para horarios, sin importar cuántos días
+        with self.assertNumQueries(2):
+            disponibilidad.disponibilidad(self.lunes, hasta)
+        with self.assertNumQueries(0):
+            disponibilidad.disponibilidad(self.lunes, hasta)
+
+    def test_api_disponibilidad(self):
+        self.reservar(turno(self.lunes, 8))
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('disponibilidad_api'), {
+            'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat()
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        dia = respuesta.json()['dias'][0]
+        self.assertEqual(dia['fecha'], self.lunes.isoformat())
+        # El masaje dura 60 minutos: también ocupa el turno de las 08:30
+        self.assertNotIn('08:00', dia['horas'])
+        self.assertNotIn('08:30', dia['horas'])
+        self.assertIn('09:00', dia['horas'])
+
+        respuesta = self.client.get(reverse('disponibilidad_api'), {'desde': 'mañana'})
+        self.assertEqual(respuesta.status_code, 400)
+
+
+class CrearReservaApiTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        self.url = reverse('crear_reserva_api', args=[self.servicio.id])
+        self.fecha_hora = turno(self.lunes, 11).isoformat()
+
+    def test_turno_ocupado_devuelve_409(self):
+        primera = self.client.post(self.url, {'fecha_hora': self.fecha_hora})
+        self.assertEqual(primera.status_code, 200)
+        segunda = self.client.post(self.url, {'fecha_hora': self.fecha_hora})
+        self.assertEqual(segunda.status_code, 409)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_turno_cancelado_se_puede_volver_a_reservar(self):
+        self.reservar(turno(self.lunes, 11), estado=3)
+        respuesta = self.client.post(self.url, {'fecha_hora': self.fecha_hora})
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_idempotency_key_repite_la_respuesta(self):
+        cabeceras = {'HTTP_IDEMPOTENCY_KEY': 'reserva-abc'}
+        primera = self.client.post(self.url, {'fecha_hora': self.fecha_hora}, **cabeceras)
+        reintento = self.client.post(self.url, {'fecha_hora': self.fecha_hora}, **cabeceras)
+        self.assertEqual(reintento.status_code, 200)
+        self.assertEqual(reintento['Idempotent-Replayed'], 'true')
+        self.assertEqual(reintento.json(), primera.json())
+        self.assertEqual(Reserva.objects.count(), 1)
+        self.assertEqual(ClaveIdempotencia.objects.count(), 1)
+
+    def test_idempotency_key_con_otra_solicitud_devuelve_422(self):
+        cabeceras = {'HTTP_IDEMPOTENCY_KEY': 'reserva-abc'}
+        self.client.post(self.url, {'fecha_hora': self.fecha_hora}, **cabeceras)
+        otra = self.client.post(self.url, {'fecha_hora': turno(self.lunes, 12).isoformat()}, **cabeceras)
+        self.assertEqual(otra.status_code, 422)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+
+class ReservaConcurrenteTests(TransactionTestCase):
+    fixtures = ['initial_data']
+    hilos = 200
+
+    def test_reservas_concurrentes_en_el_mismo_turno(self):
+        usuario = Usuario.objects.create_user(username='ana', password='clave-segura-123')
+        servicio = Servicio.objects.create(
+            nombre='Yoga', descripcion='Clase grupal', duracion=30, precio=10000, estado_servicio_id=1
+        )
+        fecha_hora = turno(proximo_lunes(), 15)
+        barrera = threading.Barrier(self.hilos)
+        resultados = []
+
+        def reservar():
+            try:
+                barrera.wait()
+                reservar_turno(usuario, servicio, fecha_hora)
+                resultados.append('ok')
+            except TurnoOcupado:
+                resultados.append('ocupado')
+            except Exception as e:
+                resultados.append(repr(e))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar) for _ in range(self.hilos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(resultados.count('ok'), 1, resultados)
+        self.assertEqual(resultados.count('ocupado'), self.hilos - 1, set(resultados))
+        self.assertEqual(Reserva.objects.filter(fecha_hora=fecha_hora).count(), 1)
+
+    @override_settings(CAPACIDAD_SALA=3)
+    def test_reservas_concurrentes_respetan_la_capacidad(self):
+        usuario = Usuario.objects.create_user(username='ana', password='clave-segura-123')
+        servicio = Servicio.objects.create(
+            nombre='Yoga', descripcion='Clase grupal', duracion=60, precio=10000, estado_servicio_id=1, capacidad=3
+        )
+        lunes = proximo_lunes()
+        # La mitad pide las 15:00 y la otra mitad las 15:30: con 60 minutos todas se superponen
+        turnos = [turno(lunes, 15, 30 * (i % 2)) for i in range(self.hilos // 4)]
+        barrera = threading.Barrier(len(turnos))
+        resultados = []
+
+        def reservar(fecha_hora):
+            try:
+                barrera.wait()
+                reservar_turno(usuario, servicio, fecha_hora)
+                resultados.append('ok')
+            except TurnoOcupado:
+                resultados.append('ocupado')
+            except Exception as e:
+                resultados.append(repr(e))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar, args=(fecha_hora,)) for fecha_hora in turnos]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(resultados.count('ok'), 3, resultados)
+        self.assertEqual(resultados.count('ocupado'), len(turnos) - 3, set(resultados))
+        agenda = disponibilidad.agenda([(turno(lunes, 15), turno(lunes, 17))])
+        self.assertEqual(agenda.simultaneos(turno(lunes, 15), turno(lunes, 17)), 3)
+
+
+class ReservasLoteApiTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('home'))
+        self.url = reverse('crear_reservas_lote_api')
+
+    def enviar(self, items, modo='todo_o_nada'):
+        return self.client.post(
+            self.url, {'modo': modo, 'reservas': items}, content_type='application/json'
+        )
+
+    def serie(self, dias):
+        return [
+            {'servicio': self.servicio.id, 'fecha_hora': turno(self.lunes + timedelta(days=d), 9).isoformat()}
+            for d in dias
+        ]
+
+    def test_crea_todo_el_lote(self):
+        respuesta = self.enviar(self.serie(range(5)))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['creadas'], 5)
+        self.assertEqual(Reserva.objects.count(), 5)
+
+    def test_todo_o_nada_no_crea_nada_si_hay_conflicto(self):
+        self.reservar(turno(self.lunes + timedelta(days=1), 9))
+        respuesta = self.enviar(self.serie(range(3)))
+        self.assertEqual(respuesta.status_code, 409)
+        resultados = respuesta.json()['resultados']
+        self.assertTrue(resultados[1]['conflicto'])
+        self.assertFalse(resultados[0]['success'])
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_parcial_crea_las_validas(self):
+        self.reservar(turno(self.lunes + timedelta(days=1), 9))
+        items = self.serie(range(3)) + [{'servicio': self.servicio.id, 'fecha_hora': 'ayer'}]
+        respuesta = self.enviar(items, modo='parcial')
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual(datos['creadas'], 2)
+        self.assertEqual([r['success'] for r in datos['resultados']], [True, False, True, False])
+
+    def test_reintento_vuelve_a_aplicar_los_efectos_del_lote(self):
+        registrar_cambios = resumenes.registrar_cambios
+        pendiente = [True]
+
+        def bloqueada_una_vez(cambios):
+            # La base se bloquea mientras el lote ajusta los resúmenes: la inserción se deshace y se reintenta
+            if pendiente:
+                pendiente.clear()
+                raise OperationalError('database is locked')
+            return registrar_cambios(cambios)
+
+        with mock.patch('core.resumenes.registrar_cambios', side_effect=bloqueada_una_vez), \
+                mock.patch('core.reservas.time.sleep'):
+            respuesta = self.enviar(self.serie(range(3)))
+        self.assertEqual(respuesta.json()['creadas'], 3)
+        self.assertEqual(EstadisticaUsuario.objects.get(usuario=self.usuario).reservas_pendientes, 3)
+        self.assertEqual(sum(ResumenDiario.objects.values_list('reservas', flat=True)), 3)
+
+    def test_consultas_constantes_sin_importar_el_tamano(self):
+        estadisticas.recalcular(self.usuario.pk)
+        with CaptureQueriesContext(connection) as chico:
+            self.enviar(self.serie(range(2)))
+        with CaptureQueriesContext(connection) as grande:
+            self.enviar(self.serie(range(7, 12)))
+        self.assertEqual(len(chico), len(grande))
+
+
+class ServiciosDestacadosTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.yoga = Servicio.objects.create(
+            nombre='Yoga', descripcion='Clase grupal', duracion=30, precio=10000, estado_servicio_id=1
+        )
+        self.reservar(turno(self.lunes, 8), servicio=self.yoga)
+        cache.clear()
+
+    def nombres(self):
+        return [s['nombre'] for s in destacados.servicios_destacados()]
+
+    def test_home_no_consulta_la_base_con_cache_caliente(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(reverse('home'))
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_nueva_reserva_marca_el_ranking_al_confirmarse(self):
+        self.assertEqual(self.nombres(), ['Yoga', 'Masaje'])
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.reservar(turno(self.lunes, 9))
+                self.reservar(turno(self.lunes, 10))
+                # Antes del commit sigue vigente el ranking anterior
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.nombres(), ['Yoga', 'Masaje'])
+        self.assertEqual(self.nombres(), ['Masaje', 'Yoga'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.nombres(), ['Masaje', 'Yoga'])
+
+    def test_recalculo_anterior_al_cambio_no_queda_vigente(self):
+        version = cache.get(destacados.CLAVE_VERSION, 0)
+        destacados.marcar_desactualizado()
+        # Un proceso que empezó a calcular antes del cambio guarda su resultado con la versión vieja
+        destacados._recalcular(version)
+        with self.assertNumQueries(1):
+            self.nombres()
+        with self.assertNumQueries(0):
+            self.nombres()
+
+    def test_borrar_reserva_fuera_del_ranking_no_lo_marca(self):
+        reserva = self.reservar(turno(self.lunes, 9))
+        cache.clear()
+        with mock.patch.object(destacados, 'CANTIDAD', 1):
+            self.assertEqual(self.nombres(), ['Masaje'])
+            version = cache.get(destacados.CLAVE_VERSION)
+            with self.captureOnCommitCallbacks(execute=True):
+                Reserva.objects.filter(servicio=self.yoga).delete()
+            self.assertEqual(cache.get(destacados.CLAVE_VERSION), version)
+            with self.captureOnCommitCallbacks(execute=True):
+                reserva.delete()
+            self.assertNotEqual(cache.get(destacados.CLAVE_VERSION), version)
+
+    def test_cambio_de_servicio_fuerza_recalculo(self):
+        self.nombres()
+        self.yoga.estado_servicio_id = 2
+        self.yoga.save()
+        self.assertEqual(self.nombres(), ['Masaje'])
+
+    def test_valor_vencido_se_sirve_mientras_otro_recalcula(self):
+        self.nombres()
+        destacados.marcar_desactualizado()
+        cache.add(destacados.CLAVE_BLOQUEO, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.nombres(), ['Yoga', 'Masaje'])
+
+
+class EstadisticaUsuarioTests(BaseReservaTestCase):
+
+    def assertEstadisticaCoincide(self):
+        guardada = EstadisticaUsuario.objects.get(usuario=self.usuario)
+        recalculada = estadisticas.recalcular(self.usuario.pk)
+        for campo in ('total_reservas', 'reservas_pendientes', 'reservas_confirmadas',
+                      'reservas_canceladas', 'proxima_reserva_id', 'reservas_por_servicio'):
+            self.assertEqual(getattr(guardada, campo), getattr(recalculada, campo), campo)
+        return guardada
+
+    def test_se_mantiene_al_crear_modificar_y_borrar(self):
+        primera = self.reservar(turno(self.lunes, 10))
+        segunda = self.reservar(turno(self.lunes, 9))
+        self.assertEqual(self.assertEstadisticaCoincide().proxima_reserva_id, segunda.id)
+
+        segunda = Reserva.objects.get(pk=segunda.pk)
+        segunda.estado_reserva_id = 3
+        segunda.save()
+        estadistica = self.assertEstadisticaCoincide()
+        self.assertEqual(estadistica.reservas_canceladas, 1)
+        self.assertEqual(estadistica.proxima_reserva_id, primera.id)
+
+        primera.delete()
+        estadistica = self.assertEstadisticaCoincide()
+        self.assertEqual(estadistica.total_reservas, 1)
+        self.assertIsNone(estadistica.proxima_reserva_id)
+
+    def test_lote_y_acciones_en_bloque(self):
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('crear_reservas_lote_api'), {'reservas': [
+            {'servicio': self.servicio.id, 'fecha_hora': turno(self.lunes, h).isoformat()} for h in (8, 9, 10)
+        ]}, content_type='application/json')
+        self.assertEqual(self.assertEstadisticaCoincide().reservas_pendientes, 3)
+
+    def test_accion_del_admin_solo_recalcula_las_que_cambio(self):
+        otro = Usuario.objects.create_user(username='luis', password='clave-segura-123')
+        propia = self.reservar(turno(self.lunes, 8))
+        ajena = self.reservar(turno(self.lunes + timedelta(days=1), 8), usuario=otro)
+        self.client.force_login(Usuario.objects.create_superuser(username='admin', password='clave-segura-123'))
+
+        def confirmar_y_seguir():
+            # Otro proceso confirma la de luis justo antes del UPDATE de la acción (sin señales)
+            Reserva.objects.filter(pk=ajena.pk).update(estado_reserva_id=2)
+            return timezone.now()
+
+        with mock.patch('core.admin.timezone', mock.Mock(now=confirmar_y_seguir)), \
+                mock.patch('core.signals.estadisticas.recalcular') as recalcular, \
+                mock.patch('core.signals.disponibilidad.invalidar') as invalidar:
+            self.client.post(reverse('admin:core_reserva_changelist'), {
+                'action': 'cancelar_reservas', '_selected_action': [propia.id, ajena.id],
+            })
+        recalcular.assert_called_once_with(self.usuario.pk)
+        invalidar.assert_called_once_with([propia.fecha_hora])
+        self.assertEqual(Reserva.objects.get(pk=ajena.pk).estado_reserva_id, 2)
+
+    def test_comando_recalcula_todos(self):
+        otro = Usuario.objects.create_user(username='luis', password='clave-segura-123')
+        self.reservar(turno(self.lunes, 8))
+        self.reservar(turno(self.lunes, 9), usuario=otro, estado=2)
+        EstadisticaUsuario.objects.all().delete()
+        call_command('recalcular_estadisticas', stdout=StringIO())
+        self.assertEqual(EstadisticaUsuario.objects.get(usuario=otro).reservas_confirmadas, 1)
+        self.assertEqual(EstadisticaUsuario.objects.get(usuario=self.usuario).proxima_fecha_hora, turno(self.lunes, 8))
+
+    def test_recalcular_todos_con_reservas_simultaneas(self):
+        otro = Usuario.objects.create_user(username='luis', password='clave-segura-123')
+        # Con capacidad mayor que 1, dos usuarios pueden tener su próxima reserva en el mismo turno
+        propia = self.reservar(turno(self.lunes, 8))
+        ajena = self.reservar(turno(self.lunes, 8), usuario=otro)
+        self.reservar(turno(self.lunes, 8), usuario=otro)
+        EstadisticaUsuario.objects.all().delete()
+        call_command('recalcular_estadisticas', stdout=StringIO())
+        self.assertEqual(EstadisticaUsuario.objects.get(usuario=self.usuario).proxima_reserva_id, propia.pk)
+        self.assertEqual(EstadisticaUsuario.objects.get(usuario=otro).proxima_reserva_id, ajena.pk)
+        self.assertEqual(estadisticas.recalcular(otro.pk).proxima_reserva_id, ajena.pk)
+
+    def test_perfil_con_consultas_acotadas(self):
+        for hora in range(8, 18):
+            self.reservar(turno(self.lunes, hora))
+        self.client.force_login(self.usuario)
+        catalogos.todos(EstadoReserva)
+        # Sesión, usuario, estadística, reservas activas e historial
+        with self.assertNumQueries(5):
+            respuesta = self.client.get(reverse('profile'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['estadisticas']['total_reservas'], 10)
+
+
+class CatalogosTests(BaseReservaTestCase):
+
+    def calentar_catalogos(self):
+        # calentar() cierra las conexiones; dentro de un TestCase basta con cargarlos
+        for modelo in catalogos.modelos():
+            catalogos.todos(modelo)
+
+    def test_lecturas_sin_consultas_con_catalogo_caliente(self):
+        self.calentar_catalogos()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogos.id_por_nombre(EstadoReserva, 'cancelado'), 3)
+            self.assertEqual(catalogos.obtener(TipoUsuario, 2).nombre, 'docente')
+            self.assertEqual(str(self.usuario), ' (docente)')
+
+    def test_senal_invalida_el_catalogo(self):
+        self.calentar_catalogos()
+        estado = EstadoReserva.objects.get(pk=2)
+        estado.nombre = 'aprobado'
+        estado.save()
+        self.assertEqual(catalogos.nombre(EstadoReserva, 2), 'aprobado')
+
+    def test_fila_nueva_de_otro_proceso_se_encuentra(self):
+        self.calentar_catalogos()
+        # Simula una fila creada por otro worker sin pasar por las señales de este proceso
+        EstadoReserva.objects.bulk_create([EstadoReserva(pk=9, nombre='expirado', descripcion='')])
+        self.assertEqual(catalogos.id_por_nombre(EstadoReserva, 'expirado'), 9)
+        with self.assertRaises(EstadoReserva.DoesNotExist):
+            catalogos.obtener(EstadoReserva, 99)
+
+    def test_guardar_reserva_no_consulta_el_estado(self):
+        self.calentar_catalogos()
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(reverse('guardar_reserva'), {
+                'fecha': turno(self.lunes, 16).replace(tzinfo=None).isoformat(),
+                'usuario': self.usuario.id,
+                'servicio': self.servicio.id,
+                'estado_reserva': 1,
+            })
+        self.assertEqual(Reserva.objects.get().estado_reserva_id, 1)
+        self.assertFalse([q for q in consultas if 'FROM "core_estadoreserva"' in q['sql']])
+
+
+class AdminListadosTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = Usuario.objects.create_superuser(username='admin', password='clave-segura-123')
+        self.client.force_login(self.admin)
+        # La primera solicitud deja el usuario de la sesión en cache
+        self.client.get(reverse('home'))
+        for modelo in catalogos.modelos():
+            catalogos.todos(modelo)
+
+    def consultas_listado(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def crear_filas(self, desde, hasta):
+        for i in range(desde, hasta):
+            servicio = Servicio.objects.create(nombre=f'Servicio {i}', descripcion='', duracion=30, precio=1000, estado_servicio_id=1)
+            fecha = self.lunes + timedelta(days=7 * (i // 10))
+            self.reservar(turno(fecha, 8 + i % 10), servicio=servicio)
+            Horario.objects.create(fecha=fecha, hora_inicio=time(8 + i % 10), hora_fin=time(9 + i % 10), estado_horario_id=1)
+
+    def test_consultas_constantes_al_crecer_las_filas(self):
+        urls = [reverse(f'admin:core_{modelo}_changelist') for modelo in ('servicio', 'reserva', 'horario')]
+        self.crear_filas(0, 2)
+        pocas = [self.consultas_listado(url) for url in urls]
+        self.crear_filas(2, 25)
+        self.assertEqual([self.consultas_listado(url) for url in urls], pocas)
+
+    def test_conteos_del_listado(self):
+        self.reservar(turno(self.lunes, 10))
+        self.reservar(turno(self.lunes, 10, 30), estado=3)
+        self.reservar(turno(self.lunes, 12))
+        Horario.objects.create(fecha=self.lunes, hora_inicio=time(10), hora_fin=time(12), estado_horario_id=1)
+        respuesta = self.client.get(reverse('admin:core_servicio_changelist'))
+        self.assertContains(respuesta, '3 (2 activas)')
+        respuesta = self.client.get(reverse('admin:core_horario_changelist'))
+        self.assertContains(respuesta, '2 reservas')
+
+
+class PaginacionReservasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        # Reservas canceladas en el mismo turno: el id desempata el orden
+        for hora in range(8, 13):
+            for _ in range(3):
+                self.reservar(turno(self.lunes, hora), estado=3)
+
+    def recorrer(self, limite):
+        vistas, cursor = [], None
+        while True:
+            parametros = {'limite': limite}
+            if cursor:
+                parametros['cursor'] = cursor
+            datos = self.client.get(reverse('reservas_api'), parametros).json()
+            vistas.extend(reserva['id'] for reserva in datos['reservas'])
+            cursor = datos['siguiente']
+            if cursor is None:
+                return vistas
+
+    def test_recorre_todas_en_orden_sin_repetir(self):
+        esperado = list(Reserva.objects.filter(usuario=self.usuario).values_list('id', flat=True))
+        self.assertEqual(self.recorrer(4), esperado)
+        self.assertEqual(self.recorrer(15), esperado)
+
+    def test_consultas_constantes_en_paginas_profundas(self):
+        primera = self.client.get(reverse('reservas_api'), {'limite': 2}).json()
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('reservas_api'), {'limite': 2, 'cursor': primera['siguiente']})
+        self.assertNotIn('OFFSET', consultas[-1]['sql'])
+        profundo = paginacion.codificar_cursor(Reserva.objects.order_by('id')[1])
+        with self.assertNumQueries(len(consultas)):
+            self.client.get(reverse('reservas_api'), {'limite': 2, 'cursor': profundo})
+
+    def test_cursor_invalido(self):
+        respuesta = self.client.get(reverse('reservas_api'), {'cursor': 'inventado'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.client.get(reverse('historial_reservas'), {'cursor': 'x'}).status_code, 400)
+
+    def test_vista_html_con_cargar_mas(self):
+        respuesta = self.client.get(reverse('historial_reservas'))
+        self.assertEqual(len(respuesta.context['reservas']), 15)
+        self.assertIsNone(respuesta.context['siguiente'])
+        for hora in range(13, 16):
+            for _ in range(3):
+                self.reservar(turno(self.lunes, hora), estado=3)
+        respuesta = self.client.get(reverse('historial_reservas'))
+        self.assertContains(respuesta, 'Cargar más')
+        resto = self.client.get(reverse('historial_reservas'), {'cursor': respuesta.context['siguiente']})
+        self.assertEqual(len(resto.context['reservas']), 4)
+
+
+class ExplicarConsultasTests(TestCase):
+
+    def test_consultas_frecuentes_usan_indices(self):
+        salida = StringIO()
+        call_command('explicar_consultas', stdout=salida)
+        self.assertIn('usan índices', salida.getvalue())
+
+    def test_detecta_recorrido_completo(self):
+        from .management.commands.explicar_consultas import nombres_de_indice, recorridos_completos
+        esperado = nombres_de_indice('horario_fecha_inicio_unico', Horario, 'sqlite')
+        self.assertEqual(recorridos_completos('2 0 0 SCAN core_reserva', 'sqlite'), ['core_reserva'])
+        # Recorrer un índice entero solo se acepta si es el esperado
+        plan = 'SCAN core_horario USING INDEX sqlite_autoindex_core_horario_1'
+        self.assertEqual(recorridos_completos(plan, 'sqlite', esperado), [])
+        self.assertEqual(recorridos_completos(plan, 'sqlite'), ['core_horario'])
+        plan = 'SCAN core_horario USING COVERING INDEX horario_estado_fecha_idx'
+        self.assertEqual(recorridos_completos(plan, 'sqlite', esperado), ['core_horario'])
+        self.assertEqual(recorridos_completos('Seq Scan on core_reserva  (cost=0.00..1.01)', 'postgresql'), ['core_reserva'])
+
+    def test_falla_si_no_usa_el_indice_esperado(self):
+        from .management.commands import explicar_consultas
+        consultas = [('bloqueos', Horario.objects.filter(fecha=timezone.localdate()), 'horario_estado_fecha_idx')]
+        salida = StringIO()
+        with mock.patch.object(explicar_consultas, 'consultas_frecuentes', return_value=consultas):
+            with self.assertRaises(CommandError):
+                call_command('explicar_consultas', stdout=salida)
+        self.assertIn('no usa horario_estado_fecha_idx', salida.getvalue())
+
+
+class ApiRestTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        otro = Usuario.objects.create_user(username='luis', password='clave-segura-123')
+        self.reservar(turno(self.lunes, 8))
+        self.reservar(turno(self.lunes, 9), estado=2)
+        self.reservar(turno(self.lunes, 10), usuario=otro)
+
+    def test_reservas_propias_con_campos_pedidos(self):
+        respuesta = self.client.get(reverse('api-reserva-list'), {'fields': 'id,servicio_nombre,estado'})
+        self.assertEqual(respuesta.status_code, 200)
+        resultados = respuesta.json()['results']
+        self.assertEqual(len(resultados), 2)
+        self.assertEqual(resultados[0], {
+            'id': resultados[0]['id'], 'servicio_nombre': 'Masaje', 'estado': 'confirmado'
+        })
+        respuesta = self.client.get(reverse('api-reserva-list'), {'fields': 'id,clave'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_listado_sin_cambios_responde_304(self):
+        respuesta = self.client.get(reverse('api-reserva-list'))
+        etag = respuesta['ETag']
+        self.assertTrue(respuesta.has_header('Last-Modified'))
+        # Solo la lectura de la página (con su servicio), sin agregar toda la tabla ni serializar
+        with CaptureQueriesContext(connection) as consultas:
+            no_modificada = self.client.get(reverse('api-reserva-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(no_modificada.status_code, 304)
+        self.assertEqual(len([q for q in consultas if 'FROM "core_reserva"' in q['sql']]), 1)
+        self.assertFalse([q for q in consultas if 'COUNT(' in q['sql']])
+
+        reserva = Reserva.objects.filter(usuario=self.usuario).first()
+        reserva.estado_reserva_id = 3
+        reserva.save()
+        self.assertEqual(self.client.get(reverse('api-reserva-list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cambio_del_servicio_cambia_el_etag(self):
+        respuesta = self.client.get(reverse('api-reserva-list'))
+        self.servicio.nombre = 'Masaje descontracturante'
+        self.servicio.save()
+        respuesta = self.client.get(reverse('api-reserva-list'), HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['results'][0]['servicio_nombre'], 'Masaje descontracturante')
+        detalle = self.client.get(reverse('api-reserva-detail', args=[respuesta.json()['results'][0]['id']]))
+        self.servicio.nombre = 'Masaje'
+        self.servicio.save()
+        self.assertEqual(self.client.get(
+            reverse('api-reserva-detail', args=[respuesta.json()['results'][0]['id']]), HTTP_IF_NONE_MATCH=detalle['ETag']
+        ).status_code, 200)
+
+    def test_accion_masiva_del_admin_cambia_el_etag(self):
+        etag = self.client.get(reverse('api-reserva-list'))['ETag']
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.post(reverse('admin:core_reserva_changelist'), {
+            'action': 'cancelar_reservas',
+            '_selected_action': list(Reserva.objects.filter(estado_reserva_id=1).values_list('id', flat=True)),
+        })
+        self.usuario.is_staff = self.usuario.is_superuser = False
+        self.usuario.save()
+        self.assertEqual(self.client.get(reverse('api-reserva-list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_crear_reserva(self):
+        datos = {'servicio': self.servicio.id, 'fecha_hora': turno(self.lunes, 11).isoformat()}
+        respuesta = self.client.post(reverse('api-reserva-list'), datos, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta.json()['estado'], 'pendiente')
+        repetida = self.client.post(reverse('api-reserva-list'), datos, content_type='application/json')
+        self.assertEqual(repetida.status_code, 409)
+        fuera_de_horario = dict(datos, fecha_hora=turno(self.lunes, 7).isoformat())
+        self.assertEqual(self.client.post(reverse('api-reserva-list'), fuera_de_horario, content_type='application/json').status_code, 400)
+
+    def test_servicios_y_horarios(self):
+        Servicio.objects.create(nombre='Inactivo', descripcion='', duracion=30, precio=1000, estado_servicio_id=2)
+        Horario.objects.create(fecha=self.lunes, hora_inicio=time(8), hora_fin=time(9), estado_horario_id=2)
+        servicios = self.client.get(reverse('api-servicio-list'), {'fields': 'nombre'}).json()
+        self.assertEqual(servicios, [{'nombre': 'Masaje'}])
+        horarios = self.client.get(reverse('api-horario-list')).json()
+        self.assertEqual([h['disponible'] for h in horarios], [False])
+        detalle = self.client.get(reverse('api-horario-detail', args=[horarios[0]['id']]))
+        self.assertEqual(self.client.get(
+            reverse('api-horario-detail', args=[horarios[0]['id']]), HTTP_IF_NONE_MATCH=detalle['ETag']
+        ).status_code, 304)
+
+
+class ExportacionReservasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.otro_servicio = Servicio.objects.create(nombre='Yoga', descripcion='', duracion=60, precio=20000, estado_servicio_id=1)
+        self.reservar(turno(self.lunes, 8))
+        self.reservar(turno(self.lunes, 9), servicio=self.otro_servicio)
+        self.reservar(turno(self.lunes + timedelta(days=1), 9), estado=3)
+        self.staff = Usuario.objects.create_user(username='contadora', password='clave-segura-123', is_staff=True)
+
+    def descargar(self, **parametros):
+        self.client.force_login(self.staff)
+        respuesta = self.client.get(reverse('exportar_reservas'), parametros)
+        self.assertTrue(respuesta.streaming)
+        return respuesta, b''.join(respuesta.streaming_content).decode('utf-8-sig')
+
+    def test_csv_con_filtros(self):
+        respuesta, contenido = self.descargar(desde=self.lunes.isoformat(), hasta=self.lunes.isoformat())
+        self.assertIn('attachment', respuesta['Content-Disposition'])
+        lineas = contenido.splitlines()
+        self.assertTrue(lineas[0].startswith('id,fecha_hora,estado,servicio_id,servicio,precio'))
+        self.assertEqual(len(lineas), 3)
+        _, contenido = self.descargar(servicio=self.otro_servicio.id)
+        self.assertIn('Yoga,20000.00', contenido)
+        self.assertNotIn('Masaje', contenido)
+
+    def test_ndjson(self):
+        _, contenido = self.descargar(formato='ndjson')
+        filas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual([fila['estado'] for fila in filas], ['pendiente', 'pendiente', 'cancelado'])
+        self.assertEqual(filas[0]['usuario'], 'ana')
+
+    def test_solo_staff_y_filtros_validos(self):
+        self.client.force_login(self.usuario)
+        self.assertEqual(self.client.get(reverse('exportar_reservas')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('exportar_reservas'), {'desde': 'ayer'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar_reservas'), {'formato': 'xlsx'}).status_code, 400)
+
+    def test_accion_del_admin(self):
+        self.staff.is_superuser = True
+        self.staff.save()
+        self.client.force_login(self.staff)
+        respuesta = self.client.post(reverse('admin:core_reserva_changelist'), {
+            'action': 'exportar_csv',
+            '_selected_action': list(Reserva.objects.filter(servicio=self.servicio).values_list('id', flat=True)),
+        })
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8-sig')
+        self.assertEqual(len(contenido.splitlines()), 3)
+
+
+class VistasAsyncTests(BaseReservaTestCase):
+
+    def solicitud(self, metodo, ruta, datos=None, cabeceras=None):
+        request = getattr(AsyncRequestFactory(), metodo)(ruta, datos or {}, headers=cabeceras)
+        request.user = self.usuario
+
+        async def auser():
+            return self.usuario
+        request.auser = auser
+        return request
+
+    async def test_crear_reserva_y_conflicto(self):
+        datos = {'fecha_hora': turno(self.lunes, 11).isoformat()}
+        respuesta = await views_async.crear_reserva_api(self.solicitud('post', '/', datos), self.servicio.id)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(await Reserva.objects.filter(fecha_hora=turno(self.lunes, 11)).aexists())
+        repetida = await views_async.crear_reserva_api(self.solicitud('post', '/', datos), self.servicio.id)
+        self.assertEqual(repetida.status_code, 409)
+
+    async def test_crear_reserva_idempotente(self):
+        datos = {'fecha_hora': turno(self.lunes, 12).isoformat()}
+        for _ in range(2):
+            respuesta = await views_async.crear_reserva_api(
+                self.solicitud('post', '/', datos, {'Idempotency-Key': 'clave-1'}), self.servicio.id
+            )
+            self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Idempotent-Replayed'], 'true')
+        self.assertEqual(await Reserva.objects.acount(), 1)
+
+    async def test_disponibilidad_igual_que_la_sincronica(self):
+        await Reserva.objects.acreate(
+            usuario=self.usuario, servicio=self.servicio, fecha_hora=turno(self.lunes, 9), estado_reserva_id=1
+        )
+        parametros = {'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat()}
+        respuesta = await views_async.disponibilidad_api(self.solicitud('get', '/', parametros))
+        dia = json.loads(respuesta.content)['dias'][0]
+        self.assertNotIn('09:00', dia['horas'])
+        self.assertEqual(dia['libres'], disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes])
+
+    async def test_historial_paginado(self):
+        for hora in range(8, 11):
+            await Reserva.objects.acreate(
+                usuario=self.usuario, servicio=self.servicio, fecha_hora=turno(self.lunes, hora), estado_reserva_id=3
+            )
+        catalogos.invalidar()
+        primera = json.loads((await views_async.reservas_api(self.solicitud('get', '/', {'limite': 2}))).content)
+        self.assertEqual(len(primera['reservas']), 2)
+        self.assertEqual(primera['reservas'][0]['estado'], 'cancelado')
+        resto = json.loads((await views_async.reservas_api(
+            self.solicitud('get', '/', {'limite': 2, 'cursor': primera['siguiente']})
+        )).content)
+        self.assertEqual([datetime.fromisoformat(r['fecha_hora']) for r in resto['reservas']], [turno(self.lunes, 8)])
+        self.assertIsNone(resto['siguiente'])
+
+
+class CargaTests(TestCase):
+
+    def test_resumen_con_percentiles(self):
+        datos = carga.resumen([i / 1000 for i in range(100, 0, -1)], duracion=2, errores=1)
+        self.assertEqual(datos['solicitudes'], 100)
+        self.assertEqual(datos['por_segundo'], 50)
+        self.assertEqual((datos['p50_ms'], datos['p95_ms'], datos['p99_ms']), (50, 95, 99))
+        self.assertIsNone(carga.resumen([], duracion=1)['p99_ms'])
+
+
+class ContencionSqliteTests(TestCase):
+
+    def test_perfil_de_produccion_no_falla(self):
+        salida = StringIO()
+        ruta = f'{tempfile.mkdtemp()}/resultados.json'
+        call_command('contencion_sqlite', procesos=3, transacciones=10, espera_ms=1, salida=ruta, stdout=salida)
+        with open(ruta) as archivo:
+            resultados = json.load(archivo)
+        self.assertEqual(resultados['produccion']['errores'], 0)
+        self.assertEqual(resultados['produccion']['solicitudes'], 30)
+
+
+class BenchmarkTests(TestCase):
+    fixtures = ['initial_data']
+
+    def test_siembra_y_mide_todas_las_vistas(self):
+        ruta = f'{tempfile.mkdtemp()}/benchmark.json'
+        call_command(
+            'benchmark', sembrar=True, usuarios=3, servicios=2, reservas=60, dias_historia=7,
+            iteraciones=2, salida=ruta, stdout=StringIO()
+        )
+        with open(ruta) as archivo:
+            resultado = json.load(archivo)
+        self.assertGreaterEqual(resultado['datos']['reservas'], 60)
+        for nombre, datos in resultado['vistas'].items():
+            self.assertEqual(datos['errores'], 0, nombre)
+            self.assertEqual(datos['solicitudes'], 2)
+        self.assertEqual(resultado['vistas']['reservar']['codigos'], {'200': 2})
+
+
+class MetricasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metricas.reiniciar()
+
+    def test_server_timing_con_consultas(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('profile'))
+        self.assertEqual(respuesta.status_code, 200)
+        cabecera = respuesta['Server-Timing']
+        self.assertRegex(cabecera, r'db;dur=[\d.]+;desc="[1-9]\d* consultas"')
+        self.assertIn('plantillas;dur=', cabecera)
+        self.assertIn('total;dur=', cabecera)
+
+    def test_hash_de_contrasena_en_login(self):
+        respuesta = self.client.post(reverse('login'), {'username': 'ana', 'password': 'clave-segura-123'})
+        duracion = float(respuesta['Server-Timing'].split('hash;dur=')[1].split(',')[0])
+        self.assertGreater(duracion, 0)
+
+    @override_settings(METRICAS_MUESTREO=0)
+    def test_sin_muestreo_solo_cuenta(self):
+        respuesta = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', respuesta)
+        texto = metricas.exportar()
+        self.assertIn('zenteach_solicitudes_total{vista="home",metodo="GET",estado="200"} 1', texto)
+        self.assertNotIn('zenteach_solicitud_segundos_bucket', texto)
+
+    def test_metrics_solo_staff(self):
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+
+        admin = Usuario.objects.create_user(username='admin', password='x', is_staff=True)
+        self.client.force_login(admin)
+        respuesta = self.client.get(reverse('metricas'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = respuesta.content.decode()
+        self.assertIn('zenteach_solicitud_segundos_bucket{vista="home",metodo="GET",le="+Inf"} 1', texto)
+        self.assertIn('# TYPE zenteach_db_consultas histogram', texto)
+
+    @override_settings(METRICAS_TOKEN='secreto')
+    def test_metrics_con_token(self):
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+        respuesta = self.client.get(reverse('metricas'), headers={'Authorization': 'Bearer secreto'})
+        self.assertEqual(respuesta.status_code, 200)
+
+
+class RecursosEstaticosTests(BaseReservaTestCase):
+
+    def plantillas_con(self, html):
+        directorio = tempfile.mkdtemp()
+        with open(f'{directorio}/pagina.html', 'w') as archivo:
+            archivo.write(html)
+        return override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates', 'DIRS': [directorio],
+        }])
+
+    def test_plantillas_del_proyecto_sin_cdn(self):
+        self.assertEqual(checks.plantillas_sin_cdn(None), [])
+
+    def test_cdn_hace_fallar_collectstatic(self):
+        html = '<p>\n<script src="https://unpkg.com/vue@3/dist/vue.global.js"></script>'
+        with self.plantillas_con(html):
+            errores = checks.plantillas_sin_cdn(None)
+            self.assertEqual([error.id for error in errores], ['core.E001'])
+            self.assertIn('pagina.html:2', errores[0].msg)
+            with self.assertRaises(SystemCheckError):
+                call_command('collectstatic', interactive=False, skip_checks=False, stdout=StringIO())
+
+    def test_enlaces_externos_permitidos(self):
+        with self.plantillas_con('<a href="https://www.ejemplo.com">Ayuda</a>'):
+            self.assertEqual(checks.plantillas_sin_cdn(None), [])
+
+    def test_reservar_usa_script_propio(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('reservar'))
+        self.assertContains(respuesta, '/static/js/reservar.js')
+        self.assertContains(respuesta, reverse('crear_reserva_api', args=[self.servicio.id]))
+        self.assertNotContains(respuesta, 'unpkg.com')
+
+
+class GenerarHorariosTests(BaseReservaTestCase):
+
+    def generar(self, *extra):
+        salida = StringIO()
+        hasta = self.lunes + timedelta(days=13)
+        call_command('generar_horarios', self.lunes.isoformat(), hasta.isoformat(), '--rangos', '08:00-10:00,14:00-15:00',
+                     '--duracion', '60', *extra, stdout=salida)
+        return salida.getvalue()
+
+    def test_expande_plantilla_semanal(self):
+        self.generar('--excepto', (self.lunes + timedelta(days=2)).isoformat())
+        # Dos semanas de lunes a viernes, menos un feriado, con tres turnos por día
+        self.assertEqual(Horario.objects.count(), 9 * 3)
+        self.assertFalse(Horario.objects.filter(fecha=self.lunes + timedelta(days=2)).exists())
+        self.assertFalse(Horario.objects.filter(fecha=self.lunes + timedelta(days=5)).exists())
+        self.assertEqual(
+            list(Horario.objects.filter(fecha=self.lunes).values_list('hora_inicio', 'hora_fin')),
+            [(time(8), time(9)), (time(9), time(10)), (time(14), time(15))]
+        )
+
+    def test_volver_a_generar_no_duplica_ni_desbloquea(self):
+        self.generar()
+        Horario.objects.filter(fecha=self.lunes, hora_inicio=time(8)).update(estado_horario_id=2)
+        self.assertIn('0 horarios creados, 0 actualizados y 30 sin cambios', self.generar())
+        self.assertEqual(Horario.objects.count(), 30)
+        self.assertEqual(Horario.objects.get(fecha=self.lunes, hora_inicio=time(8)).estado_horario_id, 2)
+
+    def test_actualiza_hora_de_fin(self):
+        self.generar()
+        self.assertIn('30 horarios creados, 30 actualizados', self.generar('--duracion', '30'))
+        self.assertEqual(Horario.objects.get(fecha=self.lunes, hora_inicio=time(8)).hora_fin, time(8, 30))
+
+    def test_invalida_la_disponibilidad_en_cache(self):
+        disponibilidad.ocupacion(self.lunes, self.lunes)
+        horarios.guardar([Horario(fecha=self.lunes, hora_inicio=time(8), hora_fin=time(9), estado_horario_id=2)])
+        self.assertIsNone(cache.get(disponibilidad.clave_cache(self.lunes)))
+
+    def test_accion_admin_repite_la_seleccion(self):
+        self.client.force_login(Usuario.objects.create_superuser(username='admin', password='x'))
+        plantilla = [
+            Horario.objects.create(fecha=self.lunes, hora_inicio=time(9), hora_fin=time(10), estado_horario_id=1),
+            Horario.objects.create(fecha=self.lunes + timedelta(days=3), hora_inicio=time(15), hora_fin=time(16),
+                                   estado_horario_id=1),
+        ]
+        datos = {'action': 'repetir_semanalmente', '_selected_action': [horario.pk for horario in plantilla]}
+        url = reverse('admin:core_horario_changelist')
+        self.assertContains(self.client.post(url, datos), 'Repetir hasta')
+
+        hasta = self.lunes + timedelta(days=20)
+        respuesta = self.client.post(url, {**datos, 'aplicar': '1', 'hasta': hasta.isoformat(),
+                                           'excepciones': (self.lunes + timedelta(days=7)).isoformat()})
+        self.assertRedirects(respuesta, url)
+        self.assertEqual(
+            sorted(Horario.objects.values_list('fecha', 'hora_inicio')),
+            [(self.lunes, time(9)), (self.lunes + timedelta(days=3), time(15)),
+             (self.lunes + timedelta(days=10), time(15)), (self.lunes + timedelta(days=14), time(9)),
+             (self.lunes + timedelta(days=17), time(15))]
+        )
+
+
+FALLOS_PENDIENTES = []
+
+
+@tareas.tarea
+def tarea_inestable(valor):
+    if FALLOS_PENDIENTES:
+        FALLOS_PENDIENTES.pop()
+        raise RuntimeError('falla transitoria')
+
+
+@override_settings(ADMINS=[('Recepción', 'recepcion@zenteach.local')])
+class TareasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.usuario.email = 'ana@ejemplo.com'
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+
+    def procesar(self):
+        call_command('procesar_tareas', una_vez=True, stdout=StringIO())
+
+    def test_reserva_encola_y_el_trabajador_envia_los_correos(self):
+        url = reverse('crear_reserva_api', args=[self.servicio.id])
+        respuesta = self.client.post(url, {'fecha_hora': turno(self.lunes, 10).isoformat()})
+        self.assertEqual(respuesta.status_code, 200)
+        # La solicitud no envía nada: solo deja las tareas en la cola
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Tarea.objects.filter(estado=Tarea.PENDIENTE).count(), 2)
+
+        self.procesar()
+        self.assertEqual(Tarea.objects.filter(estado=Tarea.COMPLETADA).count(), 2)
+        self.assertEqual(sorted(correo.to[0] for correo in mail.outbox), ['ana@ejemplo.com', 'recepcion@zenteach.local'])
+        self.assertIn('Masaje: ', next(correo.body for correo in mail.outbox if correo.to == ['ana@ejemplo.com']))
+
+    def test_reserva_rechazada_no_encola(self):
+        self.reservar(turno(self.lunes, 10))
+        url = reverse('crear_reserva_api', args=[self.servicio.id])
+        self.assertEqual(self.client.post(url, {'fecha_hora': turno(self.lunes, 10).isoformat()}).status_code, 409)
+        self.assertFalse(Tarea.objects.exists())
+
+    def test_lote_envia_un_solo_correo(self):
+        items = [{'servicio': self.servicio.id, 'fecha_hora': turno(self.lunes + timedelta(days=d), 9).isoformat()}
+                 for d in (0, 1, 2)]
+        self.client.post(reverse('crear_reservas_lote_api'), {'reservas': items}, content_type='application/json')
+        self.procesar()
+        confirmaciones = [correo for correo in mail.outbox if correo.to == ['ana@ejemplo.com']]
+        self.assertEqual(len(confirmaciones), 1)
+        self.assertEqual(confirmaciones[0].subject, 'ZenTeach - 3 reservas recibidas')
+
+    def test_reintento_con_espera_y_luego_fallida(self):
+        FALLOS_PENDIENTES[:] = [1]
+        tarea = tareas.encolar(tarea_inestable, max_intentos=2, valor=1)
+        with self.assertLogs('core.tareas', 'WARNING'):
+            self.assertEqual(tareas.procesar_lote(), (0, 1))
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.PENDIENTE, 1))
+        self.assertGreater(tarea.disponible_desde, timezone.now() + tareas.ESPERA_BASE / 3)
+        # Todavía en espera: el siguiente lote no la toma
+        self.assertEqual(tareas.procesar_lote(), (0, 0))
+
+        Tarea.objects.filter(pk=tarea.pk).update(disponible_desde=timezone.now())
+        self.assertEqual(tareas.procesar_lote(), (1, 0))
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.COMPLETADA, 2))
+
+        FALLOS_PENDIENTES[:] = [1, 1]
+        otra = tareas.encolar(tarea_inestable, max_intentos=1, valor=2)
+        with self.assertLogs('core.tareas', 'ERROR'):
+            tareas.procesar_lote()
+        otra.refresh_from_db()
+        self.assertEqual(otra.estado, Tarea.FALLIDA)
+        self.assertIn('falla transitoria', otra.ultimo_error)
+        FALLOS_PENDIENTES.clear()
+
+    def test_reclama_tareas_de_un_trabajador_caido(self):
+        tarea = tareas.encolar(tarea_inestable, valor=1)
+        self.assertEqual([t.pk for t in tareas.reclamar('caido')], [tarea.pk])
+        # Reclamada y todavía vigente: otro trabajador no la toma
+        self.assertEqual(tareas.reclamar('otro'), [])
+        Tarea.objects.filter(pk=tarea.pk).update(bloqueada_hasta=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tareas.procesar_lote('otro'), (1, 0))
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.trabajador, tarea.intentos), ('otro', 2))
+
+    def test_tarea_que_tumba_al_trabajador_agota_sus_intentos(self):
+        tarea = tareas.encolar(tarea_inestable, max_intentos=2, valor=1)
+        vencer = lambda: Tarea.objects.filter(pk=tarea.pk).update(bloqueada_hasta=timezone.now() - timedelta(seconds=1))
+        # Dos trabajadores mueren con la tarea en curso
+        self.assertEqual(len(tareas.reclamar('caido-1')), 1)
+        vencer()
+        self.assertEqual(len(tareas.reclamar('caido-2')), 1)
+        vencer()
+        with self.assertLogs('core.tareas', 'ERROR'):
+            self.assertEqual(tareas.procesar_lote('otro'), (0, 0))
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.FALLIDA, 2))
+        self.assertIn('caido-2', tarea.ultimo_error)
+
+    def test_resultado_de_un_reclamo_vencido_no_se_guarda(self):
+        tarea = tareas.encolar(tarea_inestable, valor=1)
+        [lenta] = tareas.reclamar('lento')
+        Tarea.objects.filter(pk=tarea.pk).update(bloqueada_hasta=timezone.now() - timedelta(seconds=1))
+        [rapida] = tareas.reclamar('rapido')
+        FALLOS_PENDIENTES[:] = [1]
+        with self.assertLogs('core.tareas', 'WARNING'):
+            self.assertFalse(tareas.ejecutar(rapida))
+        # El trabajador lento termina después: su resultado no pisa el del reclamo vigente
+        with self.assertLogs('core.tareas', 'WARNING') as registro:
+            self.assertTrue(tareas.ejecutar(lenta))
+        self.assertIn('no se guarda este resultado', registro.output[0])
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.trabajador), (Tarea.PENDIENTE, 'rapido'))
+        FALLOS_PENDIENTES.clear()
+
+    def test_tarea_desconocida_falla_sin_reintentos(self):
+        Tarea.objects.create(nombre='core.no_existe', disponible_desde=timezone.now())
+        with self.assertLogs('core.tareas', 'ERROR'):
+            tareas.procesar_lote()
+        self.assertEqual(Tarea.objects.get().estado, Tarea.FALLIDA)
+
+
+class VencerReservasTests(BaseReservaTestCase):
+
+    def test_cancela_pendientes_vencidas_por_lotes(self):
+        vieja = self.reservar(turno(self.lunes, 9))
+        Reserva.objects.filter(pk=vieja.pk).update(creada=timezone.now() - timedelta(hours=49))
+        pasada = self.reservar(timezone.now() - timedelta(hours=1))
+        reciente = self.reservar(turno(self.lunes, 10))
+        confirmada = self.reservar(turno(self.lunes, 11), estado=2)
+        Reserva.objects.filter(pk=confirmada.pk).update(creada=timezone.now() - timedelta(days=10))
+        self.assertEqual(estadisticas.obtener(self.usuario).reservas_pendientes, 3)
+        disponibilidad.ocupacion(self.lunes, self.lunes)
+
+        salida = StringIO()
+        call_command('vencer_reservas', tamano_lote=1, pausa_ms=0, stdout=salida)
+        self.assertIn('2 reservas pendientes canceladas', salida.getvalue())
+        estados = dict(Reserva.objects.values_list('id', 'estado_reserva_id'))
+        self.assertEqual(
+            [estados[r.pk] for r in (vieja, pasada, reciente, confirmada)], [3, 3, 1, 2]
+        )
+        estadistica = EstadisticaUsuario.objects.get(usuario=self.usuario)
+        self.assertEqual((estadistica.reservas_pendientes, estadistica.reservas_canceladas), (1, 2))
+        # La próxima reserva era la vencida: pasa a la siguiente activa
+        self.assertEqual(estadistica.proxima_reserva_id, reciente.pk)
+        # El turno liberado vuelve a estar disponible
+        self.assertIsNone(cache.get(disponibilidad.clave_cache(self.lunes)))
+        self.assertTrue(reservar_turno(self.usuario, self.servicio, turno(self.lunes, 9)))
+
+        call_command('vencer_reservas', stdout=salida)
+        self.assertIn('0 reservas pendientes canceladas', salida.getvalue())
+
+    def test_ttl_configurable(self):
+        reserva = self.reservar(turno(self.lunes, 9))
+        Reserva.objects.filter(pk=reserva.pk).update(creada=timezone.now() - timedelta(hours=3))
+        call_command('vencer_reservas', ttl_horas=4, stdout=StringIO())
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).estado_reserva_id, 1)
+        call_command('vencer_reservas', ttl_horas=2, stdout=StringIO())
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).estado_reserva_id, 3)
+
+    def test_confirmada_entre_el_select_y_el_update_no_se_cancela(self):
+        ahora = timezone.now()
+        vencidas = [self.reservar(ahora - timedelta(hours=hora)) for hora in (1, 2)]
+        estadisticas.recalcular(self.usuario.pk)
+        confirmada = vencidas[0]
+        ahora_real = timezone.now
+        pendiente = [True]
+
+        def confirmar_y_seguir():
+            # Otro proceso confirma una de las leídas justo antes del UPDATE (sin señales)
+            if pendiente:
+                pendiente.clear()
+                Reserva.objects.filter(pk=confirmada.pk).update(estado_reserva_id=2)
+                estadisticas.recalcular(self.usuario.pk)
+            return ahora_real()
+
+        with mock.patch('core.reservas.timezone.now', side_effect=confirmar_y_seguir):
+            self.assertEqual(vencer_pendientes(timedelta(hours=48), ahora=ahora), 1)
+        self.assertEqual(Reserva.objects.get(pk=confirmada.pk).estado_reserva_id, 2)
+        self.assertEqual(Reserva.objects.get(pk=vencidas[1].pk).estado_reserva_id, 3)
+        estadistica = EstadisticaUsuario.objects.get(usuario=self.usuario)
+        self.assertEqual(
+            (estadistica.reservas_pendientes, estadistica.reservas_confirmadas, estadistica.reservas_canceladas),
+            (0, 1, 1)
+        )
+        resumenes = dict(ResumenDiario.objects.exclude(reservas=0).values_list('estado_reserva_id', 'reservas'))
+        self.assertEqual(resumenes.get(3), 1)
+
+
+class ResumenesTests(BaseReservaTestCase):
+
+    def resumenes_actuales(self):
+        return sorted(
+            ResumenDiario.objects.exclude(reservas=0).values_list(
+                'fecha', 'servicio_id', 'estado_reserva_id', 'reservas', 'minutos', 'ingresos'
+            )
+        )
+
+    def test_cambios_incrementales_coinciden_con_reconstruir(self):
+        facial = Servicio.objects.create(nombre='Facial', descripcion='', duracion=30, precio=12000, estado_servicio_id=1)
+        martes = self.lunes + timedelta(days=1)
+        movida = self.reservar(turno(self.lunes, 9))
+        cancelada = self.reservar(turno(self.lunes, 10))
+        borrada = self.reservar(turno(self.lunes, 11), servicio=facial)
+        self.reservar(turno(martes, 9), estado=2)
+        movida.fecha_hora = turno(martes, 10)
+        movida.servicio = facial
+        movida.save()
+        cancelada.estado_reserva_id = 3
+        cancelada.save()
+        borrada.delete()
+        reservar_lote(self.usuario, [
+            {'servicio': self.servicio.id, 'fecha_hora': turno(martes, hora).isoformat()} for hora in (11, 12)
+        ])
+        vieja = self.reservar(turno(self.lunes, 14))
+        Reserva.objects.filter(pk=vieja.pk).update(creada=timezone.now() - timedelta(days=3))
+        vencer_pendientes(timedelta(hours=48))
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('admin:core_reserva_changelist'), {
+            'action': 'confirmar_reservas',
+            '_selected_action': list(Reserva.objects.filter(fecha_hora=turno(martes, 11)).values_list('id', flat=True)),
+        })
+        self.servicio.precio = 30000
+        self.servicio.save()
+
+        incrementales = self.resumenes_actuales()
+        self.assertIn((martes, self.servicio.id, 2, 2, 120, 60000), incrementales)
+        self.assertIn((martes, facial.id, 1, 1, 30, 12000), incrementales)
+        self.assertIn((self.lunes, self.servicio.id, 3, 2, 120, 60000), incrementales)
+        self.assertNotIn(facial.id, [fila[1] for fila in incrementales if fila[0] == self.lunes])
+        call_command('reconstruir_resumenes', stdout=StringIO())
+        self.assertEqual(self.resumenes_actuales(), incrementales)
+
+    def test_accion_del_admin_cuenta_solo_las_que_cambio_su_update(self):
+        reservas = [self.reservar(turno(self.lunes, hora)) for hora in (9, 10, 11)]
+        cancelada = reservas[0]
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+
+        def cancelar_y_seguir():
+            # Otro proceso cancela una de las leídas justo antes del UPDATE de la acción
+            cancelada.estado_reserva_id = 3
+            cancelada.save()
+            return timezone.now()
+
+        # Solo el timezone de core.admin: los middlewares también piden la hora
+        with mock.patch('core.admin.timezone', mock.Mock(now=cancelar_y_seguir)):
+            self.client.post(reverse('admin:core_reserva_changelist'), {
+                'action': 'confirmar_reservas',
+                '_selected_action': [reserva.id for reserva in reservas],
+            })
+        self.assertEqual(Reserva.objects.get(pk=cancelada.pk).estado_reserva_id, 3)
+        incrementales = self.resumenes_actuales()
+        self.assertEqual([fila[2:4] for fila in incrementales], [(2, 2), (3, 1)])
+        call_command('reconstruir_resumenes', stdout=StringIO())
+        self.assertEqual(self.resumenes_actuales(), incrementales)
+
+    def test_accion_del_admin_es_atomica(self):
+        reserva = self.reservar(turno(self.lunes, 9))
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+        with mock.patch('core.admin.reservas_modificadas_en_bloque', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('admin:core_reserva_changelist'), {
+                    'action': 'cancelar_reservas', '_selected_action': [reserva.id],
+                })
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).estado_reserva_id, 1)
+
+    def test_reconstruir_un_rango_no_toca_el_resto(self):
+        martes = self.lunes + timedelta(days=1)
+        self.reservar(turno(self.lunes, 9))
+        self.reservar(turno(martes, 9))
+        ResumenDiario.objects.update(reservas=99)
+        salida = StringIO()
+        call_command('reconstruir_resumenes', '--desde', martes.isoformat(), '--hasta', martes.isoformat(), stdout=salida)
+        self.assertIn('Se reconstruyeron 1 resúmenes', salida.getvalue())
+        self.assertEqual(dict(ResumenDiario.objects.values_list('fecha', 'reservas')), {self.lunes: 99, martes: 1})
+
+    def test_reporte_api_solo_lee_los_resumenes(self):
+        self.reservar(turno(self.lunes, 9), estado=2)
+        self.reservar(turno(self.lunes, 10), estado=2)
+        self.reservar(turno(self.lunes + timedelta(days=2), 9))
+        url = reverse('reporte_reservas_api')
+        self.client.force_login(self.usuario)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.usuario.is_staff = True
+        self.usuario.save()
+        self.assertEqual(self.client.get(url, {'agrupar': 'anio'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'desde': '2026-13-01'}).status_code, 400)
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url, {'agrupar': 'semana', 'servicio': self.servicio.id})
+        self.assertFalse([q for q in consultas if 'core_reserva"' in q['sql']])
+        self.assertEqual(respuesta.json()['resultados'], [
+            {'periodo': self.lunes.isoformat(), 'servicio_id': self.servicio.id, 'servicio': 'Masaje',
+             'estado': 'pendiente', 'reservas': 1, 'minutos': 60, 'ingresos': '25000.00'},
+            {'periodo': self.lunes.isoformat(), 'servicio_id': self.servicio.id, 'servicio': 'Masaje',
+             'estado': 'confirmado', 'reservas': 2, 'minutos': 120, 'ingresos': '50000.00'},
+        ])
+
+    def test_tablero_del_admin(self):
+        self.reservar(turno(self.lunes, 9), estado=2)
+        self.reservar(turno(self.lunes, 10))
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('admin:core_resumendiario_changelist'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse([q for q in consultas if 'core_reserva"' in q['sql']])
+        self.assertEqual(list(respuesta.context['totales']), [{
+            'servicio__nombre': 'Masaje', 'pendientes': 1, 'confirmadas': 1, 'canceladas': 0,
+            'minutos_activos': 120, 'ingresos_confirmados': 25000,
+        }])
+        self.assertContains(respuesta, 'Totales por servicio')
+
+
+class BusquedaServiciosTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        self.relajante = Servicio.objects.create(
+            nombre='Masaje relajante', descripcion='Con aceites esenciales', duracion=60, precio=20000,
+            estado_servicio_id=1
+        )
+        self.reflexologia = Servicio.objects.create(
+            nombre='Reflexología', descripcion='Incluye masajes de pies', duracion=45, precio=18000,
+            estado_servicio_id=1
+        )
+        Servicio.objects.create(
+            nombre='Masaje descontinuado', descripcion='', duracion=30, precio=1000, estado_servicio_id=2
+        )
+
+    def buscar(self, texto, **parametros):
+        respuesta = self.client.get(reverse('api-servicio-buscar'), {'q': texto, **parametros})
+        self.assertEqual(respuesta.status_code, 200)
+        return [servicio['nombre'] for servicio in respuesta.json()['results']]
+
+    def test_prefijos_tildes_y_relevancia(self):
+        self.assertTrue(busqueda.fts_disponible())
+        encontrados = self.buscar('MASAJ')
+        # El nombre pesa más que la descripción; los inactivos no aparecen
+        self.assertEqual(set(encontrados[:2]), {'Masaje', 'Masaje relajante'})
+        self.assertEqual(encontrados[2:], ['Reflexología'])
+        self.assertEqual(self.buscar('reflexologia'), ['Reflexología'])
+        self.assertEqual(self.buscar('masaje aceites'), ['Masaje relajante'])
+        self.assertEqual(self.buscar('masaje OR yoga'), [])
+        self.assertEqual(len(self.buscar('masaje', limite=1)), 1)
+        self.assertEqual(self.client.get(reverse('api-servicio-buscar'), {'q': ' ¿? '}).status_code, 400)
+
+        self.usuario.is_staff = True
+        self.usuario.save()
+        self.assertIn('Masaje descontinuado', self.buscar('masaje'))
+
+    def test_indice_sigue_escrituras_sin_senales(self):
+        Servicio.objects.filter(pk=self.reflexologia.pk).update(nombre='Shiatsu')
+        self.assertEqual(self.buscar('reflexologia'), [])
+        self.assertEqual(self.buscar('shiatsu'), ['Shiatsu'])
+        Servicio.objects.filter(pk=self.reflexologia.pk).delete()
+        self.assertEqual(self.buscar('shiatsu'), [])
+
+    def test_admin_busca_con_el_indice(self):
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('admin:core_servicio_changelist'), {'q': 'reflexologia'})
+        self.assertContains(respuesta, 'Reflexología')
+        self.assertNotContains(respuesta, 'Masaje relajante')
+        self.assertTrue([q for q in consultas if 'MATCH' in q['sql']])
+        self.assertFalse([q for q in consultas if 'LIKE' in q['sql']])
+
+    def test_post_migrate_repone_triggers_solo_si_el_indice_existe(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {busqueda.TABLA}_ai')
+        busqueda.reponer(connection)
+        self.assertIn('Masaje relajante', [s.nombre for s in busqueda.buscar('relajante')])
+        Servicio.objects.create(nombre='Shiatsu', descripcion='', duracion=30, precio=1000, estado_servicio_id=1)
+        self.assertEqual(self.buscar('shiatsu'), ['Shiatsu'])
+
+        # Como después de migrate core 0010: sin la tabla no se vuelve a crear nada
+        with connection.cursor() as cursor:
+            for trigger in sorted(busqueda.TRIGGERS):
+                cursor.execute(f'DROP TRIGGER {trigger}')
+            cursor.execute(f'DROP TABLE {busqueda.TABLA}')
+        busqueda.reponer(connection)
+        self.assertNotIn(busqueda.TABLA, connection.introspection.table_names())
+
+    def test_sin_fts_usa_icontains(self):
+        with mock.patch.object(busqueda, 'fts_disponible', return_value=False):
+            self.assertEqual(self.buscar('masaje'), ['Masaje', 'Masaje relajante', 'Reflexología'])
+            self.assertEqual(self.buscar('relajante aceites'), ['Masaje relajante'])
+
+
+class SesionesYUsuarioEnCacheTests(BaseReservaTestCase):
+    TABLAS_AUTENTICACION = ('"django_session"', 'FROM "core_usuario"', '"core_tipousuario"')
+
+    def consultas_de_autenticacion(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return [q['sql'] for q in consultas if any(tabla in q['sql'] for tabla in self.TABLAS_AUTENTICACION)]
+
+    def test_vistas_autenticadas_sin_consultas_de_sesion_ni_usuario(self):
+        for motor in ('django.contrib.sessions.backends.cached_db', 'django.contrib.sessions.backends.signed_cookies'):
+            with self.subTest(motor=motor), override_settings(SESSION_ENGINE=motor):
+                cache.clear()
+                # Cliente nuevo: SessionMiddleware elige el motor al cargarse
+                self.client = self.client_class()
+                self.client.force_login(self.usuario)
+                # La primera solicitud carga el usuario (el login acaba de guardarlo) y lo deja en cache
+                self.client.get(reverse('profile'))
+                for vista in ('profile', 'historial_reservas', 'nueva_reserva'):
+                    self.assertEqual(self.consultas_de_autenticacion(reverse(vista)), [])
+                clave = autenticacion.clave_cache(self.usuario.pk, self.usuario.get_session_auth_hash())
+                self.assertEqual(cache.get(clave).tipo_usuario.nombre, 'docente')
+
+    def test_guardar_el_usuario_invalida_la_cache(self):
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('profile'))
+        self.usuario.email = 'ana@ejemplo.com'
+        self.usuario.save()
+        self.assertContains(self.client.get(reverse('profile')), 'ana@ejemplo.com')
+
+        # Otra contraseña cambia el hash de autenticación: la sesión vieja se cierra
+        self.usuario.set_password('otra-clave-segura-456')
+        self.usuario.save()
+        self.assertRedirects(self.client.get(reverse('profile')), f"{reverse('login')}?next={reverse('profile')}")
+
+    def test_usuario_desactivado_pierde_la_sesion(self):
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('profile'))
+        self.usuario.is_active = False
+        self.usuario.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 302)
+
+    def test_contrasena_cambiada_sin_senales_no_reutiliza_la_cache(self):
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('profile'))
+        hash_viejo = self.usuario.get_session_auth_hash()
+        self.assertIsNotNone(cache.get(autenticacion.clave_cache(self.usuario.pk, hash_viejo)))
+
+        # update() no manda post_save: la entrada vieja queda, pero solo sirve al hash viejo
+        self.usuario.set_password('otra-clave-segura-456')
+        Usuario.objects.filter(pk=self.usuario.pk).update(password=self.usuario.password)
+        otro = self.client_class()
+        otro.force_login(Usuario.objects.get(pk=self.usuario.pk))
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(otro.get(reverse('profile')).status_code, 200)
+        self.assertTrue([q for q in consultas if 'FROM "core_usuario"' in q['sql']])
+        self.assertIsNotNone(cache.get(autenticacion.clave_cache(self.usuario.pk, self.usuario.get_session_auth_hash())))
+
+    def test_guardar_borra_la_entrada_del_hash_anterior(self):
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('profile'))
+        hash_viejo = self.usuario.get_session_auth_hash()
+        # Otra instancia leída de la base, como la de un formulario de cambio de contraseña
+        usuario = Usuario.objects.get(pk=self.usuario.pk)
+        usuario.set_password('otra-clave-segura-456')
+        usuario.save()
+        self.assertIsNone(cache.get(autenticacion.clave_cache(self.usuario.pk, hash_viejo)))
+
+    def test_aviso_de_cached_db_con_cache_local(self):
+        self.assertEqual(checks.sesiones_con_cache_compartida(None), [])
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db'):
+            self.assertEqual([aviso.id for aviso in checks.sesiones_con_cache_compartida(None)], ['core.W001'])
+
+    def test_aviso_de_usuario_en_cache_local_con_varios_workers(self):
+        with override_settings(WORKERS=4):
+            self.assertEqual([aviso.id for aviso in checks.sesiones_con_cache_compartida(None)], ['core.W001'])
+        with override_settings(WORKERS=4, USUARIO_CACHE_TIMEOUT=0):
+            self.assertEqual(checks.sesiones_con_cache_compartida(None), [])
+
+
+@override_settings(LIMITES_INTENTOS={
+    'login_ip': (10, 10), 'login_usuario': (3, 2), 'registro_ip': (2, 2), 'contrasenas': (100, 100),
+})
+class LimiteIntentosTests(BaseReservaTestCase):
+
+    def intentar(self, usuario='ana', ip='10.0.0.1', **extra):
+        return self.client.post(reverse('login'), {'username': usuario, 'password': 'incorrecta'},
+                                REMOTE_ADDR=ip, **extra)
+
+    def test_rechaza_sin_autenticar_al_agotar_el_balde_del_usuario(self):
+        for _ in range(3):
+            self.assertEqual(self.intentar().status_code, 200)
+        with mock.patch('core.views.authenticate') as autenticar:
+            respuesta = self.intentar(ip='10.0.0.2')
+        autenticar.assert_not_called()
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertIn(int(respuesta['Retry-After']), range(1, 31))
+        self.assertContains(respuesta, 'Demasiados intentos', status_code=429)
+        # Otro usuario desde otra IP no comparte el balde (se ignoran mayúsculas y espacios)
+        self.assertEqual(self.intentar(usuario=' ANA ', ip='10.0.0.3').status_code, 429)
+        self.assertEqual(self.intentar(usuario='beto', ip='10.0.0.3').status_code, 200)
+
+    def test_balde_por_ip_con_usuarios_distintos(self):
+        for i in range(10):
+            self.assertEqual(self.intentar(usuario=f'usuario{i}').status_code, 200)
+        self.assertEqual(self.intentar(usuario='otro').status_code, 429)
+        self.assertEqual(self.intentar(usuario='otro', ip='10.0.0.9').status_code, 200)
+
+    def test_login_correcto_y_get_no_se_limitan_de_mas(self):
+        for _ in range(20):
+            self.assertEqual(self.client.get(reverse('login'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+        respuesta = self.client.post(reverse('login'), {'username': 'ana', 'password': 'clave-segura-123'})
+        self.assertRedirects(respuesta, reverse('home'))
+
+    def test_registro_limitado_por_ip(self):
+        datos = {'username': 'nuevo', 'email': 'n@ejemplo.com', 'first_name': 'N', 'last_name': 'U',
+                 'password1': 'corta', 'password2': 'otra'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('register'), datos).status_code, 200)
+        datos.update(password1='clave-muy-segura-456', password2='clave-muy-segura-456')
+        respuesta = self.client.post(reverse('register'), datos)
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertIn(int(respuesta['Retry-After']), range(1, 31))
+        self.assertFalse(Usuario.objects.filter(username='nuevo').exists())
+
+    @override_settings(LIMITES_INTENTOS={
+        'login_ip': (10, 10), 'login_usuario': None, 'registro_ip': (2, 2), 'contrasenas': (2, 6),
+    })
+    def test_balde_comun_acota_hashes_con_ips_y_usuarios_distintos(self):
+        self.assertEqual(self.intentar(usuario='a', ip='10.0.0.1').status_code, 200)
+        self.assertEqual(self.intentar(usuario='b', ip='10.0.0.2').status_code, 200)
+        respuesta = self.intentar(usuario='c', ip='10.0.0.3')
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertIn(int(respuesta['Retry-After']), range(1, 11))
+        # El registro comparte el balde de hashes, pero solo cuando llegaría a calcular uno
+        self.assertEqual(self.client.post(reverse('register'), {}, REMOTE_ADDR='10.0.0.4').status_code, 200)
+        datos = {'password1': 'clave-muy-segura-456', 'password2': 'clave-muy-segura-456'}
+        self.assertEqual(self.client.post(reverse('register'), datos, REMOTE_ADDR='10.0.0.4').status_code, 429)
+
+    def test_consumir_recarga_y_no_toma_fichas_si_algun_balde_esta_vacio(self):
+        baldes = [('limite:prueba:a', (2, 6)), ('limite:prueba:b', (1, 6))]
+        self.assertEqual(limites.consumir(baldes, ahora=100), 0)
+        # 'b' recargó 0,1 fichas: faltan 9 s y 'a' conserva la suya
+        self.assertAlmostEqual(limites.consumir(baldes, ahora=101), 9)
+        self.assertEqual(limites.consumir(baldes[:1], ahora=101), 0)
+        self.assertAlmostEqual(limites.consumir(baldes[:1], ahora=101), 9)
+        self.assertEqual(limites.consumir(baldes, ahora=110), 0)
+        self.assertEqual(limites.consumir([], ahora=110), 0)
+
+    @override_settings(IP_CLIENTE_CABECERA='HTTP_X_FORWARDED_FOR')
+    def test_ip_de_la_cabecera_del_proxy(self):
+        # El cliente no puede cambiar de balde inventando las primeras IPs de la cabecera
+        for i in range(10):
+            self.intentar(usuario=f'usuario{i}', HTTP_X_FORWARDED_FOR=f'1.1.1.{i}, 10.0.0.7')
+        respuesta = self.intentar(usuario='otro', ip='192.168.0.1', HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.7')
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertEqual(self.intentar(usuario='otro', HTTP_X_FORWARDED_FOR='10.0.0.8').status_code, 200)
+
+    @override_settings(LIMITES_INTENTOS={
+        'login_ip': (10, 10), 'login_usuario': (5, 2), 'registro_ip': (5, 2), 'contrasenas': (1, 1),
+    })
+    def test_benchmark_login(self):
+        salida = StringIO()
+        with tempfile.NamedTemporaryFile(suffix='.json') as archivo:
+            call_command('benchmark_login', '--segundos', '1', '--por-segundo', '5', '--solo-con-limite',
+                         '--json', archivo.name, stdout=salida)
+            datos = json.load(open(archivo.name))['escenarios']['con_limite']
+        self.assertEqual(datos['solicitudes'], 5)
+        self.assertEqual(datos['hashes'], 1)
+        self.assertEqual(datos['rechazadas'], 4)
+        self.assertEqual(datos['errores'], 0)
+        self.assertIn('con_limite', salida.getvalue())
+
+
+class SuperposicionReservasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.largo = Servicio.objects.create(
+            nombre='Taller', descripcion='Taller de respiración', duracion=90, precio=30000, estado_servicio_id=1
+        )
+        self.client.force_login(self.usuario)
+
+    def crear(self, servicio, hora, minuto=0):
+        return self.client.post(
+            reverse('crear_reserva_api', args=[servicio.id]),
+            {'fecha_hora': turno(self.lunes, hora, minuto).isoformat()}
+        )
+
+    def test_indice_intervalos(self):
+        h = lambda hora, minuto=0: turno(self.lunes, hora, minuto)
+        indice = IndiceIntervalos([(h(10), h(11, 30), 'a', 1), (h(9), h(10), 'b', 1)])
+        indice.agregar(h(11), h(12), 'a')
+        self.assertEqual(len(indice), 3)
+        # Un intervalo que termina cuando empieza el otro no se superpone
+        self.assertEqual(indice.solapados(h(8), h(9)), [])
+        self.assertEqual([clave for _, _, clave, _ in indice.solapados(h(9, 30), h(10, 30))], ['b', 'a'])
+        self.assertEqual(indice.simultaneos(h(9), h(12)), 2)
+        self.assertEqual(indice.simultaneos(h(9), h(11)), 1)
+        self.assertEqual(indice.simultaneos(h(9), h(12), clave='b'), 1)
+        self.assertEqual(indice.simultaneos(h(12), h(13)), 0)
+        # Las reservas agrupadas cuentan por su cantidad
+        indice.agregar(h(9, 30), h(10), 'b', cantidad=3)
+        self.assertEqual(indice.simultaneos(h(9), h(10), clave='b'), 4)
+        # Un intervalo repetido suma a la cantidad del que ya estaba
+        indice.agregar(h(9, 30), h(10), 'b')
+        self.assertEqual((len(indice), indice.simultaneos(h(9), h(10), clave='b')), (4, 5))
+
+    def test_rechaza_reserva_que_se_superpone_por_la_duracion(self):
+        self.assertEqual(self.crear(self.largo, 10).status_code, 200)
+        reserva = Reserva.objects.get()
+        self.assertEqual(reserva.fecha_fin, turno(self.lunes, 11, 30))
+        self.assertEqual(self.crear(self.servicio, 10, 30).status_code, 409)
+        # El masaje de 60 minutos a las 09:00 termina justo cuando empieza el taller
+        self.assertEqual(self.crear(self.servicio, 9).status_code, 200)
+        self.assertEqual(self.crear(self.servicio, 11, 30).status_code, 200)
+        self.assertEqual(self.crear(self.largo, 8).status_code, 409)
+
+    @override_settings(CAPACIDAD_SALA=3)
+    def test_capacidad_por_servicio_y_por_sala(self):
+        self.servicio.capacidad = 2
+        self.servicio.save()
+        self.assertEqual(self.crear(self.servicio, 10).status_code, 200)
+        self.assertEqual(self.crear(self.servicio, 10, 30).status_code, 200)
+        # Masajes de 10:00 y 10:30 coinciden de 10:30 a 11:00: el tercero supera su capacidad
+        self.assertEqual(self.crear(self.servicio, 10).status_code, 409)
+        self.assertEqual(self.crear(self.servicio, 11).status_code, 200)
+        # El taller tiene su propia capacidad, pero la sala llega a 3 reservas a la vez
+        self.assertEqual(self.crear(self.largo, 9, 30).status_code, 200)
+        self.assertEqual(self.crear(Servicio.objects.create(
+            nombre='Reiki', descripcion='Reiki', duracion=30, precio=1000, estado_servicio_id=1
+        ), 10, 30).status_code, 409)
+
+    def test_lote_distingue_superposicion_con_la_base_y_dentro_del_lote(self):
+        self.reservar(turno(self.lunes, 10))
+        respuesta = self.client.post(reverse('crear_reservas_lote_api'), {'modo': 'parcial', 'reservas': [
+            {'servicio': self.largo.id, 'fecha_hora': turno(self.lunes, 9).isoformat()},
+            {'servicio': self.servicio.id, 'fecha_hora': turno(self.lunes, 14).isoformat()},
+            {'servicio': self.largo.id, 'fecha_hora': turno(self.lunes, 13, 30).isoformat()},
+            {'servicio': self.largo.id, 'fecha_hora': turno(self.lunes, 15).isoformat()},
+        ]}, content_type='application/json')
+        resultados = respuesta.json()['resultados']
+        self.assertEqual(resultados[0]['error'], 'El horario seleccionado no está disponible')
+        self.assertTrue(resultados[1]['success'])
+        self.assertEqual(resultados[2]['error'], 'El horario se superpone con otra reserva del lote')
+        self.assertTrue(resultados[3]['success'])
+        self.assertEqual(
+            set(Reserva.objects.values_list('fecha_fin', flat=True)),
+            {turno(self.lunes, 11), turno(self.lunes, 15), turno(self.lunes, 16, 30)}
+        )
+
+    def test_lote_verifica_de_nuevo_al_insertar(self):
+        items = [{'servicio': self.largo.id, 'fecha_hora': turno(self.lunes, 9).isoformat()}]
+        original = disponibilidad.activas_en
+        llamadas = []
+
+        def otra_solicitud_gana(rangos, excluir=None):
+            activas = list(original(rangos, excluir))
+            if not llamadas:
+                # Entre la validación y la inserción otra solicitud reserva las 10:00
+                self.reservar(turno(self.lunes, 10))
+            llamadas.append(activas)
+            return activas
+
+        with mock.patch.object(disponibilidad, 'activas_en', otra_solicitud_gana):
+            respuesta = self.client.post(reverse('crear_reservas_lote_api'), {'reservas': items},
+                                         content_type='application/json')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertTrue(respuesta.json()['resultados'][0]['conflicto'])
+        self.assertEqual(len(llamadas), 2)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_consulta_de_superposiciones_usa_el_indice(self):
+        martes = self.lunes + timedelta(days=1)
+        for rangos in ([(turno(self.lunes, 10), turno(self.lunes, 11))],
+                       [(turno(self.lunes, 10), turno(self.lunes, 11)), (turno(martes, 9), turno(martes, 10))]):
+            plan = disponibilidad.activas_en(rangos).explain()
+            # Cada rango es una búsqueda acotada por fecha_hora en el índice de cobertura
+            self.assertEqual(plan.count('COVERING INDEX reserva_estado_intervalo_idx'), len(rangos), plan)
+            self.assertEqual(plan.count('fecha_hora>? AND fecha_hora<?'), len(rangos), plan)
+
+    def test_disponibilidad_por_servicio(self):
+        self.reservar(turno(self.lunes, 10))
+        Horario.objects.create(fecha=self.lunes, hora_inicio=time(15), hora_fin=time(16), estado_horario_id=2)
+        libres = disponibilidad.disponibilidad_servicio(self.largo, self.lunes, self.lunes)
+        horas = disponibilidad.turnos_libres(libres[self.lunes])
+        # El taller de 90 minutos no puede empezar a las 09:00 ni 09:30 (choca con el masaje de 10 a 11)
+        self.assertIn('08:30', horas)
+        self.assertNotIn('09:00', horas)
+        self.assertNotIn('10:30', horas)
+        self.assertIn('11:00', horas)
+        # Ni terminar dentro de un bloqueo
+        self.assertNotIn('14:00', horas)
+        self.assertIn('13:30', horas)
+
+        respuesta = self.client.get(reverse('disponibilidad_api'), {
+            'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat(), 'servicio': self.largo.id
+        })
+        self.assertEqual(respuesta.json()['dias'][0]['horas'], horas)
+        self.assertEqual(self.client.get(reverse('disponibilidad_api'), {'servicio': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('disponibilidad_api'), {'servicio': 999}).status_code, 404)
+
+    def test_formulario_del_admin_valida_superposicion(self):
+        reserva = self.reservar(turno(self.lunes, 10))
+        otra = Reserva(usuario=self.usuario, servicio=self.largo, fecha_hora=turno(self.lunes, 9), estado_reserva_id=1)
+        with self.assertRaises(ValidationError):
+            otra.full_clean()
+        # La reserva no choca consigo misma al editarla
+        reserva.full_clean()
+        otra.estado_reserva_id = 3
+        otra.full_clean()
+
+    def test_cambiar_servicio_recalcula_fin(self):
+        reserva = self.reservar(turno(self.lunes, 10))
+        self.assertEqual(reserva.fecha_fin, turno(self.lunes, 11))
+        reserva = Reserva.objects.get(pk=reserva.pk)
+        reserva.servicio = self.largo
+        reserva.save()
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).fecha_fin, turno(self.lunes, 11, 30))
+        # Cambiar la duración del servicio no mueve las reservas ya hechas
+        self.largo.duracion = 30
+        self.largo.save()
+        reserva = Reserva.objects.get(pk=reserva.pk)
+        reserva.estado_reserva_id = 2
+        reserva.save()
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).fecha_fin, turno(self.lunes, 11, 30))
+
+
+class PlanificarReservasTests(BaseReservaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Pendientes cargadas sin verificar la capacidad (datos viejos o cargados a mano)
+        self.primera = self.reservar(turno(self.lunes, 10))
+        self.segunda = self.reservar(turno(self.lunes, 10))
+        self.tercera = self.reservar(turno(self.lunes, 10, 30))
+        self.confirmada = self.reservar(turno(self.lunes, 13), estado=2)
+        Horario.objects.create(fecha=self.lunes, hora_inicio=time(11), hora_fin=time(12), estado_horario_id=2)
+
+    def planificar(self, *argumentos):
+        salida = StringIO()
+        call_command('planificar_reservas', '--desde', self.lunes.isoformat(), '--hasta', self.lunes.isoformat(),
+                     *argumentos, stdout=salida)
+        return salida.getvalue()
+
+    def turnos(self):
+        return {
+            reserva.pk: (timezone.localtime(reserva.fecha_hora).time(), reserva.estado_reserva_id)
+            for reserva in Reserva.objects.all()
+        }
+
+    def test_confirma_en_orden_de_creacion_y_mueve_las_que_chocan(self):
+        antes = self.turnos()
+        salida = self.planificar('--simular', '--max-minutos', '60')
+        self.assertIn('2 reservas se confirmarían (1 en otro turno) y 1 sin lugar', salida)
+        self.assertIn(f'Sin lugar: #{self.tercera.pk} Masaje', salida)
+        self.assertEqual(self.turnos(), antes)
+
+        disponibilidad.ocupacion(self.lunes, self.lunes)
+        self.usuario.email = 'ana@ejemplo.com'
+        self.usuario.save()
+        salida = self.planificar('--max-minutos', '120')
+        self.assertIn('3 reservas confirmadas (2 en otro turno) y 0 sin lugar', salida)
+        # La primera conserva su turno; las demás van al más cercano que no choca con ella ni con el bloqueo
+        self.assertEqual(self.turnos(), {
+            self.primera.pk: (time(10), 2),
+            self.segunda.pk: (time(9), 2),
+            self.tercera.pk: (time(12), 2),
+            self.confirmada.pk: (time(13), 2),
+        })
+        self.assertEqual(Reserva.objects.get(pk=self.tercera.pk).fecha_fin, turno(self.lunes, 13))
+        self.assertIsNone(cache.get(disponibilidad.clave_cache(self.lunes)))
+        self.assertFalse(disponibilidad.disponibilidad(self.lunes, self.lunes)[self.lunes] & disponibilidad.mascara_intervalo(
+            turno(self.lunes, 9), turno(self.lunes, 14)
+        ))
+
+        estadistica = EstadisticaUsuario.objects.get(usuario=self.usuario)
+        self.assertEqual((estadistica.reservas_pendientes, estadistica.reservas_confirmadas), (0, 4))
+        self.assertEqual(estadistica.proxima_reserva_id, self.segunda.pk)
+        resumenes_incrementales = sorted(ResumenDiario.objects.exclude(reservas=0).values_list(
+            'fecha', 'servicio_id', 'estado_reserva_id', 'reservas'
+        ))
+        self.assertEqual(resumenes_incrementales, [(self.lunes, self.servicio.id, 2, 4)])
+        call_command('reconstruir_resumenes', stdout=StringIO())
+        self.assertEqual(sorted(ResumenDiario.objects.exclude(reservas=0).values_list(
+            'fecha', 'servicio_id', 'estado_reserva_id', 'reservas'
+        )), resumenes_incrementales)
+
+        self.assertIn('0 reservas confirmadas', self.planificar())
+
+        # Un aviso para el usuario con sus dos reservas movidas
+        tarea = Tarea.objects.get(nombre=avisos.avisar_cambio_de_turno.nombre_tarea)
+        self.assertEqual(sorted(tarea.argumentos['reserva_ids']), sorted([self.segunda.pk, self.tercera.pk]))
+        call_command('procesar_tareas', una_vez=True, stdout=StringIO())
+        self.assertEqual(Tarea.objects.get(pk=tarea.pk).estado, Tarea.COMPLETADA)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Masaje: ', mail.outbox[0].body)
+        self.assertIn('(pediste ', mail.outbox[0].body)
+
+    def test_por_defecto_no_mueve_reservas(self):
+        salida = self.planificar()
+        self.assertIn('1 reservas confirmadas (0 en otro turno) y 2 sin lugar', salida)
+        self.assertEqual(Reserva.objects.get(pk=self.primera.pk).estado_reserva_id, 2)
+        self.assertFalse(Tarea.objects.filter(nombre=avisos.avisar_cambio_de_turno.nombre_tarea).exists())
+
+    def test_respeta_la_capacidad_y_las_reservas_fuera_del_lote(self):
+        self.servicio.capacidad = 2
+        self.servicio.save()
+        with override_settings(CAPACIDAD_SALA=2):
+            asignadas, sin_lugar = planificar_pendientes(
+                Reserva.objects.filter(pk__in=[self.segunda.pk, self.tercera.pk]),
+                max_corrimiento=timedelta(minutes=30)
+            )
+        # La primera sigue pendiente y ocupa su turno: con capacidad 2, la segunda
+        # entra a las 10:00 y la tercera (10:30) ya no entra cerca
+        self.assertEqual(
+            [(reserva.pk, pedida, asignada) for reserva, pedida, asignada in asignadas],
+            [(self.segunda.pk, turno(self.lunes, 10), turno(self.lunes, 10))]
+        )
+        self.assertEqual(sin_lugar, [self.tercera])
+        self.assertEqual(Reserva.objects.get(pk=self.primera.pk).estado_reserva_id, 1)
+
+    def test_accion_del_admin(self):
+        self.usuario.is_staff = self.usuario.is_superuser = True
+        self.usuario.save()
+        self.client.force_login(self.usuario)
+        Horario.objects.filter(fecha=self.lunes).update(hora_inicio=time(8), hora_fin=time(18, 30))
+        respuesta = self.client.post(reverse('admin:core_reserva_changelist'), {
+            'action': 'planificar_pendientes',
+            '_selected_action': [self.primera.pk, self.segunda.pk, self.tercera.pk],
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        avisos = [str(mensaje) for mensaje in get_messages(respuesta.wsgi_request)]
+        self.assertEqual(avisos[0], '0 reservas confirmadas (0 en otro turno)')
+        self.assertIn('3 reservas siguen pendientes por falta de lugar: Masaje', avisos[1])
+        self.assertEqual(Reserva.objects.filter(estado_reserva_id=1).count(), 3)
+
+    def test_miles_de_pendientes_en_una_consulta(self):
+        Reserva.objects.all().delete()
+        Horario.objects.all().delete()
+        usuarios = [Usuario.objects.create(username=f'u{i}') for i in range(20)]
+        dias = [self.lunes + timedelta(days=i) for i in range(5)]
+        self.servicio.capacidad = 100
+        self.servicio.save()
+        Reserva.objects.bulk_create([
+            Reserva(usuario=usuarios[i % 20], servicio=self.servicio, fecha_hora=turno(dias[i % 5], 10),
+                    fecha_fin=turno(dias[i % 5], 11), estado_reserva_id=1)
+            for i in range(2000)
+        ])
+        with override_settings(CAPACIDAD_SALA=100), CaptureQueriesContext(connection) as consultas:
+            asignadas, sin_lugar = planificar_pendientes(Reserva.objects.all(), max_corrimiento=None)
+        # 100 por turno de una hora y 10 turnos de una hora (contando el de las 18:00) por día
+        self.assertEqual((len(asignadas), len(sin_lugar)), (2000, 0))
+        # Una sola lectura de las reservas activas del período y UPDATE de muchas filas a la vez
+        self.assertEqual(len([q for q in consultas if 'AS "cantidad"' in q['sql']]), 1)
+        self.assertLess(len([q for q in consultas if q['sql'].startswith('UPDATE "core_reserva"')]), 20)
+        for dia in dias:
+            maximo = disponibilidad.agenda([(turno(dia, 8), turno(dia, 20))]).simultaneos(turno(dia, 8), turno(dia, 20))
+            self.assertEqual(maximo, 100)
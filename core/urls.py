@@ -1,7 +1,18 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from django.conf import settings
+from rest_framework.routers import SimpleRouter
+from . import api, views, views_async
 from django.contrib import admin
+
+# Endpoints JSON con versión asíncrona para ASGI
+vistas_json = views_async if settings.VISTAS_ASYNC else views
+
+router = SimpleRouter()
+router.register('api/servicios', api.ServicioViewSet, basename='api-servicio')
+router.register('api/reservas', api.ReservaViewSet, basename='api-reserva')
+router.register('api/horarios', api.HorarioViewSet, basename='api-horario')
+
 urlpatterns = [
     # Rutas principales
     path('', views.home, name='home'),
@@ -14,6 +25,12 @@ urlpatterns = [
     path('admin/', views.admin,name='admin'),
     # Rutas de reservas
     path('reservar/', views.reservar, name='reservar'),
-    path('api/reservar/<int:servicio_id>/', views.crear_reserva_api, name='crear_reserva_api'),
+    path('api/reservar/<int:servicio_id>/', vistas_json.crear_reserva_api, name='crear_reserva_api'),
+    path('api/reservar/lote/', views.crear_reservas_lote_api, name='crear_reservas_lote_api'),
+    path('api/disponibilidad/', vistas_json.disponibilidad_api, name='disponibilidad_api'),
     path('mis-reservas/', views.historial_reservas, name='historial_reservas'),
-]
\ No newline at end of file
+    path('api/mis-reservas/', vistas_json.reservas_api, name='reservas_api'),
+    path('api/exportar/reservas/', views.exportar_reservas, name='exportar_reservas'),
+    path('api/reportes/reservas/', views.reporte_reservas_api, name='reporte_reservas_api'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
+] + router.urls
@@ -10,22 +10,32 @@ from django.views.decorators.http import require_http_methods
 from datetime import datetime, timedelta
 import json
 import pytz
+from functools import partial
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.conf import settings
+import hmac
 from .forms import UserRegistrationForm
+from . import catalogos, disponibilidad, destacados, estadisticas, exportacion, metricas, paginacion, resumenes
+from .idempotencia import idempotente
+from .limites import limitar_intentos
+from .reservas import reservar_turno, reservar_lote, validar_horario, parsear_fecha_hora, TurnoOcupado, LIMITE_LOTE
 from .models import Servicio, Reserva, Usuario,TipoUsuario,EstadoReserva
 from datetime import datetime
 import os
 import logging
 from pathlib import Path
+RESERVAS_ACTIVAS_PERFIL = 20
+HISTORIAL_PERFIL = 5
+
 # Vistas principales
 def home(request):
-    servicios_destacados = Servicio.objects.filter(estado_servicio=1).annotate(
-        total_reservas=Count('reservas')
-    ).order_by('-total_reservas')[:3]
+    # El ranking se lee de cache; las señales de Reserva y Servicio lo mantienen al día
     return render(request, 'core/home.html', {
-        'servicios_destacados': servicios_destacados
+        'servicios_destacados': destacados.servicios_destacados()
     })
 
 @require_http_methods(["GET", "POST"])
+@limitar_intentos('login', 'core/login.html')
 def user_login(request):
     if request.user.is_authenticated:
         return redirect('profile')
@@ -52,14 +62,15 @@ def user_logout(request):
     return redirect('home')
 
 @require_http_methods(["GET", "POST"])
+@limitar_intentos('registro', 'core/register.html')
 def register(request):
     if request.user.is_authenticated:
         return redirect('profile')
     if request.method == 'POST':
         form = UserRegistrationForm(request.POST)
         if form.is_valid():
-            # Obtener el tipo de usuario predeterminado (cambia pk=2 según sea necesario)
-            default_tipo_usuario = TipoUsuario.objects.get(pk=2)
+            # Obtener el tipo de usuario predeterminado desde el catálogo en memoria
+            default_tipo_usuario = catalogos.obtener(TipoUsuario, catalogos.id_por_nombre(TipoUsuario, 'docente'))
 
             # Crea el usuario
             user = form.save(commit=False)  # No guarda inmediatamente
@@ -78,34 +89,32 @@ def register(request):
 @login_required
 def profile(request):
     now = timezone.now()
-    # Obtener todas las reservas en una sola consulta
-    todas_reservas = Reserva.objects.filter(
+    # Resumen precalculado: una lectura por clave primaria en lugar de recorrer todo el historial
+    estadistica = estadisticas.obtener(request.user, now)
+    reservas_activas = list(Reserva.objects.filter(
+        usuario=request.user,
+        fecha_hora__gte=now,
+        estado_reserva_id__in=[1, 2]
+    ).select_related('servicio').order_by('fecha_hora')[:RESERVAS_ACTIVAS_PERFIL])
+    historial_reservas = list(Reserva.objects.filter(
+        Q(fecha_hora__lt=now) | Q(estado_reserva_id=3),
         usuario=request.user
-    ).select_related('servicio').order_by('-fecha_hora')
-    # Separar en activas e historial
-
-    reservas_activas = [reserva for reserva in todas_reservas if reserva.fecha_hora >= now and reserva.estado_reserva_id in [1, 2]]
-    historial_reservas = [reserva for reserva in todas_reservas if reserva.fecha_hora < now or reserva.estado_reserva_id == 3]
+    ).select_related('servicio').order_by('-fecha_hora')[:HISTORIAL_PERFIL])
     # Estadísticas del usuario
-    estadisticas = {
-        'total_reservas': len(todas_reservas),
-        'reservas_pendientes': sum(1 for r in reservas_activas if r.estado_reserva_id == 1),
-        'reservas_confirmadas': sum(1 for r in reservas_activas if r.estado_reserva_id == 2),
-        'reservas_completadas': sum(1 for r in reservas_activas if r.estado_reserva_id == 2),
-        'reservas_canceladas': sum(1 for r in todas_reservas if r.estado_reserva_id == 3),
-        'proxima_reserva': next((r for r in reservas_activas if r.fecha_hora > now), None),
-        'servicios_favoritos': Servicio.objects.filter(
-            reservas__usuario=request.user
-        ).annotate(
-            num_reservas=Count('reservas')
-        ).order_by('-num_reservas')[:3]
+    resumen = {
+        'total_reservas': estadistica.total_reservas,
+        'reservas_pendientes': estadistica.reservas_pendientes,
+        'reservas_confirmadas': estadistica.reservas_confirmadas,
+        'reservas_canceladas': estadistica.reservas_canceladas,
+        'proxima_reserva': next((r for r in reservas_activas if r.id == estadistica.proxima_reserva_id), None),
+        # Se evalúa solo si la plantilla lo usa
+        'servicios_favoritos': partial(estadisticas.servicios_favoritos, estadistica)
     }
-    print(reservas_activas," ", historial_reservas,estadisticas)
     context = {
         'user': request.user,
         'reservas_activas': reservas_activas,
         'historial_reservas': historial_reservas,
-        'estadisticas': estadisticas,
+        'estadisticas': resumen,
         'ahora': now
     }
     return render(request, 'core/profile.html', context)
@@ -119,7 +128,8 @@ def nueva_reserva(request):
     ##fecha_actual = datetime.now().strftime('%Y-%m-%dT%H:%M:%S%z')
     context = {
         'usuario':usuario,
-        'servicios':servicios
+        'servicios':servicios,
+        'estados_reserva': catalogos.todos(EstadoReserva)
     }
     return render(request, "core/nueva_reserva.html",context)
 
@@ -130,10 +140,13 @@ def guardar_reserva(request):
           
             usuario = Usuario.objects.get(pk=int(request.POST['usuario']))
             servicio = Servicio.objects.get(pk=int(request.POST['servicio']))
-            estado_reserva = EstadoReserva.objects.get(pk=int(request.POST['estado_reserva']))
+            estado_reserva = catalogos.obtener(EstadoReserva, request.POST['estado_reserva'])
 
-            reserva = Reserva(usuario=usuario, servicio=servicio, fecha_hora=fecha_hora, estado_reserva=estado_reserva)
-            reserva.save()
+            try:
+                reservar_turno(usuario, servicio, fecha_hora, estado_reserva.pk)
+            except TurnoOcupado:
+                messages.error(request, 'El horario seleccionado no está disponible')
+                return redirect('nueva_reserva')
             return redirect('home')
     else:
         print("Método de solicitud incorrecto (no es POST)")
@@ -143,10 +156,10 @@ def guardar_reserva(request):
 def reservar(request):
     try:
         # Obtener servicios activos y sus estadísticas
-        servicios = Servicio.objects.filter(activo=True).annotate(
+        servicios = Servicio.objects.filter(estado_servicio=1).annotate(
             reservas_totales=Count('reservas'),
             reservas_pendientes=Count('reservas', filter=Q(
-                reservas__estado='pendiente',
+                reservas__estado_reserva_id=1,
                 reservas__fecha_hora__gte=timezone.now()
             ))
         ).order_by('nombre')
@@ -168,35 +181,30 @@ def reservar(request):
         messages.error(request, "Hubo un error al cargar los servicios")
         return redirect('home')
 
-def validar_horario(fecha_hora):
-    """Validar que el horario cumpla con las reglas de negocio"""
-    try:
-        fecha_hora_local = timezone.localtime(fecha_hora)
-        now = timezone.now()
-        # Validación de fecha pasada con margen de 5 minutos
-        if fecha_hora_local < now - timedelta(minutes=5):
-            raise ValidationError('No se pueden hacer reservas en el pasado')
-        # Validar que no sea más de 30 días en el futuro
-        if fecha_hora_local > now + timedelta(days=30):
-            raise ValidationError('No se pueden hacer reservas con más de 30 días de anticipación')
-        # Validar horario de atención (8 AM - 6 PM)
-        hora = fecha_hora_local.hour
-        minuto = fecha_hora_local.minute
-        if hora < 8 or (hora >= 18 and minuto > 0):
-            raise ValidationError('El horario de atención es de 8:00 AM a 6:00 PM')
-        # Validar que no sea en fin de semana
-        if fecha_hora_local.weekday() >= 5:
-            raise ValidationError('No se atiende los fines de semana')
-        # Validar que sea en intervalos de 30 minutos
-        if minuto not in [0, 30]:
-            raise ValidationError('Las reservas deben ser en intervalos de 30 minutos')
-        return True
-    except ValidationError:
-        raise
-    except Exception as e:
-        raise ValidationError(f'Error al validar el horario: {str(e)}')
+def _fecha_hora_pedida(request):
+    fecha_hora_str = request.POST.get('fecha_hora')
+    if not fecha_hora_str:
+        raise ValidationError('La fecha y hora son requeridas')
+    fecha_hora = parsear_fecha_hora(fecha_hora_str)
+    validar_horario(fecha_hora)
+    return fecha_hora
+
+def _reserva_creada(reserva, servicio):
+    return JsonResponse({
+        'success': True,
+        'message': 'Reserva creada exitosamente. En espera de confirmación.',
+        'reserva': {
+            'id': reserva.id,
+            'servicio': servicio.nombre,
+            'fecha_hora': reserva.fecha_hora.isoformat(),
+            'estado': 'pendiente',
+            'duracion': servicio.duracion,
+            'precio': float(servicio.precio)
+        }
+    })
 
 @login_required
+@idempotente
 def crear_reserva_api(request, servicio_id):
     if request.method != 'POST':
         return JsonResponse({
@@ -204,36 +212,17 @@ def crear_reserva_api(request, servicio_id):
             'error': 'Método no permitido'
         }, status=405)
 
+    servicio = get_object_or_404(Servicio, id=servicio_id, estado_servicio=1)
     try:
-        servicio = get_object_or_404(Servicio, id=servicio_id, activo=True)
-        fecha_hora_str = request.POST.get('fecha_hora')
-        if not fecha_hora_str:
-            raise ValidationError('La fecha y hora son requeridas')
-        fecha_hora = timezone.make_aware(datetime.fromisoformat(fecha_hora_str))
-        validar_horario(fecha_hora)
-        if Reserva.objects.filter(
-            fecha_hora=fecha_hora,
-            estado__in=['pendiente', 'confirmada']
-        ).exists():
-            raise ValidationError('El horario seleccionado no está disponible')
-        reserva = Reserva.objects.create(
-            usuario=request.user,
-            servicio=servicio,
-            fecha_hora=fecha_hora,
-            estado='pendiente'
-        )
+        fecha_hora = _fecha_hora_pedida(request)
+        # reservar_turno revisa la superposición en la misma transacción que inserta
+        reserva = reservar_turno(request.user, servicio, fecha_hora)
+        return _reserva_creada(reserva, servicio)
+    except TurnoOcupado as e:
         return JsonResponse({
-            'success': True,
-            'message': 'Reserva creada exitosamente. En espera de confirmación.',
-            'reserva': {
-                'id': reserva.id,
-                'servicio': servicio.nombre,
-                'fecha_hora': fecha_hora.isoformat(),
-                'estado': 'pendiente',
-                'duracion': servicio.duracion,
-                'precio': float(servicio.precio)
-            }
-        })
+            'success': False,
+            'error': str(e)
+        }, status=409)
     except ValidationError as e:
         return JsonResponse({
             'success': False,
@@ -245,18 +234,260 @@ def crear_reserva_api(request, servicio_id):
             'error': 'Error al procesar la reserva'
         }, status=500)
 
+@login_required
+@require_http_methods(["POST"])
+@idempotente
+def crear_reservas_lote_api(request):
+    """Crea varias reservas en una sola solicitud (por ejemplo una serie semanal de un curso)"""
+    try:
+        datos = json.loads(request.body)
+        items = datos['reservas']
+        if not isinstance(items, list) or not items:
+            raise ValueError
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({
+            'success': False,
+            'error': 'Se espera un JSON con una lista "reservas" de {servicio, fecha_hora}'
+        }, status=400)
+    if len(items) > LIMITE_LOTE:
+        return JsonResponse({
+            'success': False,
+            'error': f'No se pueden crear más de {LIMITE_LOTE} reservas por solicitud'
+        }, status=400)
+    modo = datos.get('modo', 'todo_o_nada')
+    if modo not in ('todo_o_nada', 'parcial'):
+        return JsonResponse({
+            'success': False,
+            'error': 'El modo debe ser "todo_o_nada" o "parcial"'
+        }, status=400)
+
+    # El personal puede reservar a nombre de otro usuario
+    usuario = request.user
+    if request.user.is_staff and datos.get('usuario'):
+        usuario = get_object_or_404(Usuario, pk=datos['usuario'])
+
+    resultados, creadas = reservar_lote(usuario, items, todo_o_nada=(modo == 'todo_o_nada'))
+    fallidas = len(items) - len(creadas)
+    status = 200
+    if modo == 'todo_o_nada' and fallidas:
+        status = 409 if any(r.get('conflicto') for r in resultados) else 400
+    return JsonResponse({
+        'success': not fallidas,
+        'modo': modo,
+        'creadas': len(creadas),
+        'fallidas': fallidas,
+        'resultados': resultados
+    }, status=status)
+
+def _rango_disponibilidad(request):
+    """Rango pedido recortado a la ventana de reserva, o None si queda vacío"""
+    hoy = timezone.localdate()
+    limite = hoy + timedelta(days=disponibilidad.DIAS_ANTICIPACION)
+    try:
+        desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date() if request.GET.get('desde') else hoy
+        hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date() if request.GET.get('hasta') else limite
+    except ValueError:
+        raise ValidationError('Las fechas deben tener el formato AAAA-MM-DD')
+    if desde > hasta:
+        raise ValidationError('La fecha inicial debe ser anterior a la final')
+    # Fuera de la ventana de reserva no hay turnos libres, no hace falta consultarlos
+    desde, hasta = max(desde, hoy), min(hasta, limite)
+    return (desde, hasta) if desde <= hasta else None
+
+def _servicio_disponibilidad(request):
+    """Id de ``?servicio=``, para calcular los turnos con su duración y capacidad, o None"""
+    if not request.GET.get('servicio'):
+        return None
+    try:
+        return int(request.GET['servicio'])
+    except ValueError:
+        raise ValidationError('El servicio debe ser un id numérico')
+
+def _respuesta_disponibilidad(request, libres):
+    solo_bitmap = request.GET.get('formato') == 'bitmap'
+    dias = []
+    for fecha, bitmap in libres.items():
+        dia = {'fecha': fecha.isoformat(), 'libres': bitmap}
+        if not solo_bitmap:
+            dia['horas'] = disponibilidad.turnos_libres(bitmap)
+        dias.append(dia)
+    return JsonResponse({
+        'success': True,
+        'apertura': disponibilidad.hora_turno(0).strftime('%H:%M'),
+        'intervalo': disponibilidad.INTERVALO_MINUTOS,
+        'turnos': disponibilidad.TOTAL_TURNOS,
+        'dias': dias
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def disponibilidad_api(request):
+    """Turnos libres por día para un rango de fechas (por defecto los próximos 30 días)"""
+    try:
+        rango = _rango_disponibilidad(request)
+        servicio_id = _servicio_disponibilidad(request)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0]
+        }, status=400)
+    if servicio_id is not None:
+        servicio = get_object_or_404(Servicio, id=servicio_id, estado_servicio=1)
+        libres = disponibilidad.disponibilidad_servicio(servicio, *rango) if rango else {}
+    else:
+        libres = disponibilidad.disponibilidad(*rango) if rango else {}
+    return _respuesta_disponibilidad(request, libres)
+
+def _pagina_reservas(usuario, cursor, tamano=paginacion.TAMANO_PAGINA):
+    reservas = Reserva.objects.filter(usuario=usuario).select_related('servicio')
+    return paginacion.paginar(reservas, cursor, tamano)
+
 @login_required
 def historial_reservas(request):
     now = timezone.now()
-    reservas = Reserva.objects.filter(
-        usuario=request.user
-    ).select_related('servicio').order_by('-fecha_hora')
+    try:
+        reservas, siguiente = _pagina_reservas(request.user, request.GET.get('cursor'))
+    except paginacion.CursorInvalido as e:
+        return HttpResponseBadRequest(str(e))
     context = {
         'reservas': reservas,
+        'siguiente': siguiente,
         'ahora': now
     }
     return render(request, 'core/mis_reservas.html', context)
 
+def _limite_pagina(request):
+    try:
+        tamano = int(request.GET.get('limite', paginacion.TAMANO_PAGINA))
+    except ValueError:
+        tamano = 0
+    if tamano < 1:
+        raise ValidationError('El límite debe ser un número positivo')
+    return min(tamano, paginacion.TAMANO_MAXIMO)
+
+def _respuesta_reservas(reservas, siguiente):
+    return JsonResponse({
+        'success': True,
+        'reservas': [{
+            'id': reserva.id,
+            'servicio': reserva.servicio.nombre,
+            'fecha_hora': reserva.fecha_hora.isoformat(),
+            'estado': reserva.nombre_estado
+        } for reserva in reservas],
+        'siguiente': siguiente
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def reservas_api(request):
+    """Reservas del usuario, de la más reciente a la más antigua, paginadas por cursor"""
+    try:
+        tamano = _limite_pagina(request)
+        reservas, siguiente = _pagina_reservas(request.user, request.GET.get('cursor'), tamano)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0]
+        }, status=400)
+    except paginacion.CursorInvalido as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    return _respuesta_reservas(reservas, siguiente)
+
+@login_required
+@require_http_methods(["GET"])
+def exportar_reservas(request):
+    """Descarga de reservas para staff: ?formato=csv|ndjson&desde=&hasta=&servicio="""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'error': 'Solo el personal puede exportar reservas'
+        }, status=403)
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacion.FORMATOS:
+        return JsonResponse({
+            'success': False,
+            'error': 'El formato debe ser csv o ndjson'
+        }, status=400)
+    try:
+        reservas = exportacion.filtrar(
+            Reserva.objects.all(),
+            desde=request.GET.get('desde'),
+            hasta=request.GET.get('hasta'),
+            servicio=request.GET.get('servicio')
+        )
+    except exportacion.FiltroInvalido as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    return exportacion.respuesta(reservas, formato)
+
+def _parametros_reporte(request):
+    """(desde, hasta, agrupar, servicio_id) pedidos; por defecto los 30 días anteriores y posteriores a hoy"""
+    hoy = timezone.localdate()
+    desde, hasta = hoy - timedelta(days=30), hoy + timedelta(days=30)
+    try:
+        if request.GET.get('desde'):
+            desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date()
+        if request.GET.get('hasta'):
+            hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError('Las fechas deben tener el formato AAAA-MM-DD')
+    if desde > hasta:
+        raise ValidationError('La fecha inicial debe ser anterior a la final')
+    agrupar = request.GET.get('agrupar', 'dia')
+    if agrupar not in resumenes.AGRUPACIONES:
+        raise ValidationError('agrupar debe ser dia, semana o mes')
+    servicio = request.GET.get('servicio')
+    if servicio and not servicio.isdigit():
+        raise ValidationError('El servicio debe ser un id numérico')
+    return desde, hasta, agrupar, servicio and int(servicio)
+
+@login_required
+@require_http_methods(["GET"])
+def reporte_reservas_api(request):
+    """Reservas, minutos e ingresos por período, servicio y estado para staff: ?desde=&hasta=&agrupar=dia|semana|mes&servicio="""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'error': 'Solo el personal puede ver los reportes'
+        }, status=403)
+    try:
+        desde, hasta, agrupar, servicio_id = _parametros_reporte(request)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0]
+        }, status=400)
+    return JsonResponse({
+        'success': True,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'agrupar': agrupar,
+        'resultados': [{
+            'periodo': fila['periodo'].isoformat(),
+            'servicio_id': fila['servicio_id'],
+            'servicio': fila['servicio_nombre'],
+            'estado': catalogos.nombre(EstadoReserva, fila['estado_reserva_id']),
+            'reservas': fila['total_reservas'],
+            'minutos': fila['total_minutos'],
+            'ingresos': '{:.2f}'.format(fila['total_ingresos']),
+        } for fila in resumenes.reporte(desde, hasta, agrupar, servicio_id)]
+    })
+
+@require_http_methods(["GET"])
+def metricas_prometheus(request):
+    """Métricas de este proceso en formato Prometheus, para staff o con METRICAS_TOKEN"""
+    token = settings.METRICAS_TOKEN
+    autorizacion = request.headers.get('Authorization', '')
+    con_token = bool(token) and hmac.compare_digest(autorizacion, f'Bearer {token}')
+    if not con_token and not request.user.is_staff:
+        return HttpResponse('Solo el personal puede ver las métricas', status=403, content_type='text/plain')
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def admin():
      return redirect('admin')
\ No newline at end of file
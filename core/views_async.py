@@ -0,0 +1,97 @@
+"""Versiones asíncronas de los endpoints JSON, para correr bajo ASGI (uvicorn).
+
+Con ``VISTAS_ASYNC`` activado, ``core/urls.py`` enruta a estas vistas en lugar
+de las de ``views``. Las lecturas usan el ORM asíncrono de Django, así una
+solicitud que espera a la base o a un cliente lento no ocupa un worker
+completo. La inserción de la reserva necesita una transacción con reintentos,
+que el ORM asíncrono no soporta: se ejecuta con ``sync_to_async``.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.http import require_http_methods
+
+from . import catalogos, disponibilidad, paginacion, views
+from .idempotencia import CABECERA
+from .models import EstadoReserva, Reserva, Servicio
+from .reservas import reservar_turno, TurnoOcupado
+
+
+@login_required
+async def crear_reserva_api(request, servicio_id):
+    if request.headers.get(CABECERA):
+        # La respuesta idempotente se guarda en la misma transacción que la reserva
+        return await sync_to_async(views.crear_reserva_api)(request, servicio_id)
+    if request.method != 'POST':
+        return JsonResponse({
+            'success': False,
+            'error': 'Método no permitido'
+        }, status=405)
+
+    servicio = await aget_object_or_404(Servicio, id=servicio_id, estado_servicio=1)
+    try:
+        fecha_hora = views._fecha_hora_pedida(request)
+        usuario = await request.auser()
+        reserva = await sync_to_async(reservar_turno)(usuario, servicio, fecha_hora)
+        return views._reserva_creada(reserva, servicio)
+    except TurnoOcupado as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=409)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    except Exception:
+        return JsonResponse({
+            'success': False,
+            'error': 'Error al procesar la reserva'
+        }, status=500)
+
+
+@login_required
+@require_http_methods(["GET"])
+async def disponibilidad_api(request):
+    """Turnos libres por día para un rango de fechas (por defecto los próximos 30 días)"""
+    try:
+        rango = views._rango_disponibilidad(request)
+        servicio_id = views._servicio_disponibilidad(request)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0]
+        }, status=400)
+    if servicio_id is not None:
+        servicio = await aget_object_or_404(Servicio, id=servicio_id, estado_servicio=1)
+        libres = await sync_to_async(disponibilidad.disponibilidad_servicio)(servicio, *rango) if rango else {}
+    else:
+        libres = await disponibilidad.adisponibilidad(*rango) if rango else {}
+    return views._respuesta_disponibilidad(request, libres)
+
+
+@login_required
+@require_http_methods(["GET"])
+async def reservas_api(request):
+    """Reservas del usuario, de la más reciente a la más antigua, paginadas por cursor"""
+    usuario = await request.auser()
+    reservas = Reserva.objects.filter(usuario=usuario).select_related('servicio')
+    try:
+        tamano = views._limite_pagina(request)
+        reservas, siguiente = await paginacion.apaginar(reservas, request.GET.get('cursor'), tamano)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0]
+        }, status=400)
+    except paginacion.CursorInvalido as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    # El nombre del estado sale del catálogo en memoria; si está frío se carga fuera del loop
+    await sync_to_async(catalogos.todos)(EstadoReserva)
+    return views._respuesta_reservas(reservas, siguiente)
@@ -0,0 +1,22 @@
+// Agrega la siguiente página a la lista sin recargar; sin JavaScript el enlace navega a ella
+document.addEventListener('click', function (evento) {
+    const enlace = evento.target.closest('#cargar-mas');
+    if (!enlace) return;
+    evento.preventDefault();
+    fetch(enlace.href)
+        .then(function (respuesta) { return respuesta.text(); })
+        .then(function (html) {
+            const pagina = new DOMParser().parseFromString(html, 'text/html');
+            const lista = document.querySelector('.reservas-list');
+            pagina.querySelectorAll('.reservas-list .reserva-card').forEach(function (tarjeta) {
+                lista.appendChild(tarjeta);
+            });
+            const siguiente = pagina.getElementById('cargar-mas');
+            if (siguiente) {
+                enlace.href = siguiente.href;
+            } else {
+                enlace.remove();
+            }
+        })
+        .catch(function () { window.location = enlace.href; });
+});
@@ -0,0 +1,50 @@
+// Envía cada formulario de reserva a /api/reservar/<id>/ y muestra el resultado sin recargar
+(function () {
+    const mensaje = document.getElementById('mensaje');
+    const cargando = document.getElementById('cargando');
+    let temporizador = null;
+
+    function mostrarMensaje(texto, tipo) {
+        mensaje.textContent = texto;
+        mensaje.className = 'toast ' + tipo;
+        mensaje.hidden = false;
+        clearTimeout(temporizador);
+        temporizador = setTimeout(function () { mensaje.hidden = true; }, 3000);
+    }
+
+    function getCookie(nombre) {
+        const prefijo = nombre + '=';
+        const cookie = document.cookie.split(';')
+            .map(function (valor) { return valor.trim(); })
+            .find(function (valor) { return valor.startsWith(prefijo); });
+        return cookie ? decodeURIComponent(cookie.substring(prefijo.length)) : null;
+    }
+
+    document.querySelectorAll('.reservation-form').forEach(function (formulario) {
+        formulario.addEventListener('submit', function (evento) {
+            evento.preventDefault();
+            const boton = formulario.querySelector('button');
+            boton.disabled = true;
+            cargando.hidden = false;
+
+            fetch(formulario.action, {
+                method: 'POST',
+                body: new FormData(formulario),
+                headers: { 'X-CSRFToken': getCookie('csrftoken') }
+            })
+                .then(function (respuesta) { return respuesta.json(); })
+                .then(function (datos) {
+                    if (!datos.success) {
+                        throw new Error(datos.error || 'Error al crear la reserva');
+                    }
+                    mostrarMensaje(datos.message, 'success');
+                    setTimeout(function () { window.location.href = '/perfil/'; }, 2000);
+                })
+                .catch(function (error) { mostrarMensaje(error.message, 'error'); })
+                .finally(function () {
+                    boton.disabled = false;
+                    cargando.hidden = true;
+                });
+        });
+    });
+})();
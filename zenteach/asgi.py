@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zenteach.settings')
 
 application = get_asgi_application()
+
+
+# Cargar los catálogos en memoria antes de atender la primera solicitud
+from core import catalogos
+catalogos.calentar()
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class PruebasRunner(DiscoverRunner):
+    """Las pruebas no ejecutan collectstatic: usan los estáticos sin el manifiesto de hashes"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._estaticos = override_settings(STORAGES={
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        self._estaticos.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._estaticos.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,7 +1,9 @@
 # zenteach/settings.py
 from pathlib import Path
 import os
+import tempfile
 import logging
+from email.utils import getaddresses
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,13 +33,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # AuthenticationMiddleware que toma de la cache el usuario de la sesión
+    'core.autenticacion.AutenticacionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware'
 ]
@@ -64,11 +68,60 @@ TEMPLATES = [
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.environ.get('SQLITE_RUTA', os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Perfil de producción para SQLite con varios workers (SQLITE_PRODUCCION=1):
+# WAL deja leer mientras otro escribe, BEGIN IMMEDIATE toma el bloqueo de
+# escritura al empezar la transacción (los escritores esperan en fila hasta
+# SQLITE_BUSY_TIMEOUT en vez de fallar al pasar de lectura a escritura) y las
+# conexiones se reutilizan entre solicitudes.
+SQLITE_OPCIONES_PRODUCCION = {
+    'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': ';'.join([
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024))}",
+        # Negativo: tamaño en KiB en lugar de páginas
+        f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KIB', 32 * 1024))}",
+        'PRAGMA temp_store=MEMORY',
+    ]),
+}
+if os.environ.get('SQLITE_PRODUCCION', '').lower() in ('1', 'true', 'si'):
+    DATABASES['default']['OPTIONS'] = SQLITE_OPCIONES_PRODUCCION
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 600))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Cache: 'locmem' (por defecto, uno por proceso) o 'file'/'db' para compartirlo entre workers.
+# El backend 'db' necesita crear la tabla con: python manage.py createcachetable
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'zenteach'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache',
+             os.path.join(tempfile.gettempdir(), 'zenteach_cache')),
+    'db': ('django.core.cache.backends.db.DatabaseCache', 'zenteach_cache'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+    }
+}
+# Workers del servidor: gunicorn y uvicorn toman la cantidad de WEB_CONCURRENCY.
+# Solo lo usa check para avisar de caches locales que no se comparten (core.W001).
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# collectstatic agrega el hash del contenido a cada nombre y genera copias .gz
+# y .br (con Brotli instalado); WhiteNoise sirve esas rutas con caché inmutable
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+# El manifiesto solo existe después de collectstatic, que las pruebas no ejecutan:
+# su runner cambia el almacenamiento de estáticos mientras corren
+TEST_RUNNER = 'zenteach.pruebas.PruebasRunner'
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(str(BASE_DIR), 'staticfiles')
@@ -95,9 +148,9 @@ REST_FRAMEWORK = {
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",
     "http://127.0.0.1:8080",
-    "zenteach-suet.onrender.com",
-    "render.com", 
-    "onrender.com"
+    "https://zenteach-suet.onrender.com",
+    "https://render.com",
+    "https://onrender.com"
 ]
 
 # Authentication
@@ -108,10 +161,85 @@ LOGOUT_REDIRECT_URL = 'home'
 
 # Authentication Backends
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    # ModelBackend que carga el usuario con su tipo_usuario (AutenticacionMiddleware lo guarda en cache)
+    'core.autenticacion.UsuarioCacheBackend',
 ]
+# Segundos que se conserva en cache el usuario de la sesión (0 para no guardarlo)
+USUARIO_CACHE_TIMEOUT = int(os.environ.get('USUARIO_CACHE_TIMEOUT', 300))
+
+# Sesiones: 'db' (por defecto), 'cached_db' (lee de la cache y escribe en ambas;
+# con varios workers necesita CACHE_BACKEND compartido) o 'cookies' (firmadas con
+# SECRET_KEY, sin consultas: el contenido viaja en la cookie y cerrar sesión solo
+# borra la cookie de ese navegador)
+SESION_MODO = os.environ.get('SESION_MODO', 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESION_MODO]
+
+# Límites de intentos de login y registro (core/limites.py), como 'ráfaga,intentos por minuto'.
+# Un valor vacío desactiva ese límite. 'contrasenas' es común a todo el sitio y acota
+# cuántos hashes de contraseña calcula cada worker (con locmem) aunque cambien IP y usuario;
+# viene desactivado porque vaciarlo bloquea el login de todos. Para activarlo, dimensionarlo
+# con la CPU de cada worker: un hash PBKDF2 cuesta cerca de 0,4 s de un núcleo.
+LIMITES_INTENTOS = {
+    nombre: tuple(float(valor) for valor in limite.split(',')) if limite else None
+    for nombre, limite in [
+        ('login_ip', os.environ.get('LIMITE_LOGIN_IP', '10,10')),
+        ('login_usuario', os.environ.get('LIMITE_LOGIN_USUARIO', '5,2')),
+        ('registro_ip', os.environ.get('LIMITE_REGISTRO_IP', '5,2')),
+        ('contrasenas', os.environ.get('LIMITE_CONTRASENAS', '')),
+    ]
+}
+# Cabecera de META con la IP del cliente detrás de un proxy (por ejemplo HTTP_X_FORWARDED_FOR).
+# Solo configurarla si el proxy la agrega siempre; si no, el cliente puede falsificarla.
+IP_CLIENTE_CABECERA = os.environ.get('IP_CLIENTE_CABECERA', '')
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = 'login'
+
+# Segundos que se conserva en cache la ocupación diaria de turnos
+DISPONIBILIDAD_CACHE_TIMEOUT = int(os.environ.get('DISPONIBILIDAD_CACHE_TIMEOUT', 300))
+
+# Reservas activas que pueden coincidir en el tiempo en toda la sala, sumando todos los
+# servicios (cada servicio tiene además su propia Servicio.capacidad). 1: una a la vez.
+CAPACIDAD_SALA = int(os.environ.get('CAPACIDAD_SALA', 1))
+
+# Minutos que planificar_reservas (y la acción del admin) puede mover una reserva pendiente
+# respecto del turno pedido. 0: solo confirma las que entran en su turno. Cada reserva movida
+# recibe un correo con el turno nuevo.
+PLANIFICAR_MAX_MINUTOS = int(os.environ.get('PLANIFICAR_MAX_MINUTOS', 0))
+
+# Segundos antes de recalcular el ranking de servicios destacados de la página de inicio
+DESTACADOS_CACHE_TIMEOUT = int(os.environ.get('DESTACADOS_CACHE_TIMEOUT', 300))
+
+# Segundos que cada proceso conserva en memoria las tablas de catálogo (Estado*, TipoUsuario)
+CATALOGOS_TTL = int(os.environ.get('CATALOGOS_TTL', 300))
+
+# Con VISTAS_ASYNC=1 los endpoints JSON de reservas usan las vistas asíncronas
+# (core/views_async.py). Activarlo solo al servir con ASGI (ver README).
+VISTAS_ASYNC = os.environ.get('VISTAS_ASYNC', '').lower() in ('1', 'true', 'si')
+
+# Fracción de solicitudes medidas por core.middleware.MetricasMiddleware (0 a 1).
+# Las no medidas solo suman al contador de solicitudes.
+METRICAS_MUESTREO = float(os.environ.get('METRICAS_MUESTREO', 1.0))
+# Token opcional para que Prometheus lea /metrics sin sesión de staff
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+
+# Correo: lo envía el trabajador de tareas (manage.py procesar_tareas), no la solicitud
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '').lower() in ('1', 'true', 'si')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'ZenTeach <no-responder@zenteach.local>')
+SERVER_EMAIL = DEFAULT_FROM_EMAIL
+# Destinatarios de los avisos de reservas nuevas: "Nombre <correo>,Nombre <correo>"
+ADMINS = [(nombre, correo) for nombre, correo in getaddresses([os.environ.get('ADMINS', '')]) if correo]
+
+# Horas que una reserva puede quedar pendiente antes de que manage.py vencer_reservas la cancele
+RESERVAS_PENDIENTES_TTL_HORAS = int(os.environ.get('RESERVAS_PENDIENTES_TTL_HORAS', 48))
@@ -4,4 +4,8 @@ from whitenoise import WhiteNoise
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zenteach.settings')
 
 application = get_wsgi_application()
-application = WhiteNoise(application, root='/opt/render/project/src/staticfiles')
\ No newline at end of file
+application = WhiteNoise(application, root='/opt/render/project/src/staticfiles')
+
+# Cargar los catálogos en memoria antes de atender la primera solicitud
+from core import catalogos
+catalogos.calentar()